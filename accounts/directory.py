@@ -0,0 +1,105 @@
+"""
+Local cache of external user directory searches (Microsoft Graph and LDAP).
+
+Typeahead lookups hit the external directory whenever nothing matches locally. Every search is recorded here, along with
+the usernames it found, so that repeating it (or narrowing down a search that found nobody) can be answered from the
+database until the entry expires.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import signals
+from django.utils import timezone
+
+from .models import DirectoryQuery
+
+MAX_QUERY_LENGTH = DirectoryQuery._meta.get_field('query').max_length
+
+
+def normalize(q):
+    """ Lowercase the query and collapse whitespace """
+    return " ".join(q.lower().split())[:MAX_QUERY_LENGTH]
+
+
+def cached_usernames(source, q):
+    """
+    Look up a search in the cache
+
+    :param source: `graph` or `ldap`
+    :param q: The search query
+    :return: List of usernames, or `None` if the search has to be sent to the directory
+    """
+    q = normalize(q)
+    now = timezone.now()
+    negative_since = now - datetime.timedelta(seconds=settings.DIRECTORY_NEGATIVE_CACHE_TTL)
+    hit = DirectoryQuery.objects.filter(source=source, query=q).first()
+    if hit is not None:
+        since = now - datetime.timedelta(seconds=settings.DIRECTORY_CACHE_TTL) if hit.usernames else negative_since
+        if hit.fetched >= since:
+            return [username for username in hit.usernames.split(',') if username]
+    # A search that found nobody won't find anyone once more characters are typed either
+    prefixes = [q[:end] for end in range(1, len(q))]
+    if DirectoryQuery.objects.filter(source=source, query__in=prefixes, usernames='',
+                                     fetched__gte=negative_since).exists():
+        return []
+    return None
+
+
+def store(source, q, usernames):
+    """ Record the usernames found by a search """
+    DirectoryQuery.objects.update_or_create(source=source, query=normalize(q),
+                                            defaults={'usernames': ','.join(usernames), 'fetched': timezone.now()})
+
+
+def upsert_users(entries):
+    """
+    Create any users that don't exist yet, in bulk. Existing users are left untouched.
+
+    :param entries: List of dictionaries of User fields (each must include `username`)
+    :return: QuerySet of all the users in `entries`
+    """
+    model = get_user_model()
+    usernames = [entry['username'] for entry in entries]
+    existing = set(model.objects.filter(username__in=usernames).values_list('username', flat=True))
+    new_users = {}
+    for entry in entries:
+        if entry['username'] not in existing and entry['username'] not in new_users:
+            new_users[entry['username']] = model(**entry)
+    model.objects.bulk_create(new_users.values(), ignore_conflicts=True)
+    if new_users:
+        # Primary keys don't come back from bulk_create on every backend, so load the new users again
+        send_post_save(model.objects.filter(username__in=list(new_users)), created=True)
+    return model.objects.filter(username__in=usernames)
+
+
+def send_post_save(users, created=False, update_fields=None):
+    """
+    bulk_create() and bulk_update() don't send post_save, which keeps the site search (django-watson) and the typeahead
+    index up to date, so send it for each user once they have been saved in bulk
+    """
+    model = get_user_model()
+    for user in users:
+        signals.post_save.send(sender=model, instance=user, created=created, update_fields=update_fields, raw=False,
+                               using=user._state.db)
+
+
+def search_or_create_users(source, q, search):
+    """
+    Search an external directory through the cache
+
+    :param source: `graph` or `ldap`
+    :param q: The search query
+    :param search: Function that searches the directory for `q` and returns a list of dictionaries of User fields
+    :return: List of matching users
+    """
+    usernames = cached_usernames(source, q)
+    if usernames is None:
+        # Send the directory the same query the result will be cached under
+        entries = search(normalize(q))
+        users = list(upsert_users(entries)) if entries else []
+        store(source, q, [user.username for user in users])
+        return users
+    if not usernames:
+        return []
+    return list(get_user_model().objects.filter(username__in=usernames))
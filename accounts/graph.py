@@ -2,15 +2,18 @@ import json
 import requests
 import msal
 
-from django.contrib.auth import get_user_model
 from django.conf import settings
 
+from . import directory
+
 
 app = msal.ConfidentialClientApplication(
     settings.GRAPH_API_CLIENT_ID, authority=settings.GRAPH_API_AUTHORITY,
     client_credential=settings.GRAPH_API_SECRET,
 )
 
+_session = None
+
 def acquire_graph_access_token():
     result = None
 
@@ -31,9 +34,17 @@ def acquire_graph_access_token():
         print(result.get("correlation_id"))  # You may need this when reporting a bug
         return None
 
+def get_session():
+    """ Shared HTTP session for Graph requests, so connections are pooled and kept alive between searches """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
 def search_users(q):
     token = acquire_graph_access_token()
-    results = requests.get(
+    results = get_session().get(
         settings.GRAPH_API_ENDPOINT,
         headers={
             'Authorization': f'Bearer {token}',
@@ -43,34 +54,36 @@ def search_users(q):
             '$select': 'givenName,surname,mail,mailNickname,employeeId,OnPremisesExtensionAttributes',
             #'$search': f'displayName:{q}'
             '$search': "\"displayName:" + q + "\""
-        }
+        },
+        timeout=10
     )
     return results
 
-def search_or_create_users(q):
-    objs = []
+
+def user_entries(q):
+    """ Search Graph and convert the results to dictionaries of User fields """
+    entries = []
     graph_resp = search_users(q)
     graph_resp = json.loads(graph_resp.text)
     for graph_u in graph_resp["value"]:
         if graph_u.get('givenName', '') is not None and graph_u.get('surname', '') is not None:
             try:
                 class_year = graph_u.get('onPremisesExtensionAttributes').get('extensionAttribute2', [None])
-            except IndexError:
+            except (IndexError, AttributeError):
                 class_year = None
             try:
                 class_year = int('20' + class_year)  #Graph only provides final two digits of class year 
             except (ValueError, TypeError):
                 class_year = None
-            given_name = graph_u.get('givenName', '')
-            last_name = graph_u.get('surname', '')
-            u, created = get_user_model().objects.get_or_create(
-                username=graph_u['mailNickname'],
-                defaults={
-                    'email': graph_u.get('mail', [False]) or graph_u['mailNickname'][0] + "@wpi.edu",
-                    'first_name': given_name,
-                    'last_name': last_name,
-                    'class_year': class_year,
-                }
-            )
-            objs.append(u)
-    return objs
+            entries.append({
+                'username': graph_u['mailNickname'],
+                'email': graph_u.get('mail') or graph_u['mailNickname'] + "@wpi.edu",
+                'first_name': graph_u.get('givenName', ''),
+                'last_name': graph_u.get('surname', ''),
+                'class_year': class_year,
+            })
+    return entries
+
+
+def search_or_create_users(q):
+    return directory.search_or_create_users('graph', q, user_entries)
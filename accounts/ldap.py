@@ -2,6 +2,10 @@ import sys
 import os
 
 import ldap3
+from django.db import transaction
+from ldap3.utils.conv import escape_filter_chars
+
+from . import directory
 
 try:
     from django.contrib.auth import get_user_model
@@ -37,36 +41,67 @@ def search_users(q):
     return resp
 
 
-def search_or_create_users(q):
-    ldap_resp = search_users(q)
-    objs = []
-    for ldap_u in ldap_resp:
+def user_entries(q):
+    """ Search LDAP and convert the results to dictionaries of User fields """
+    entries = []
+    for ldap_u in search_users(q):
         ldap_u = ldap_u['attributes']
         if 'uid' not in ldap_u:
             continue
-        try:
-            class_year = ldap_u.get('wpieduPersonClass', [None])[0]
-        except IndexError:
-            class_year = None
-        try:
-            class_year = int(class_year)
-        except (ValueError, TypeError):
-            class_year = None
+        class_year = parse_class_year(ldap_u)
         given_name = ldap_u.get('givenName', [''])
         given_name.append('')
         last_name = ldap_u.get('sn', [''])
         last_name.append('')
-        u, created = get_user_model().objects.get_or_create(
-            username=ldap_u['uid'][0],
-            defaults={
-                'email': ldap_u.get('mail', [False])[0] or ldap_u['uid'][0] + "@wpi.edu",
-                'first_name': given_name[0][0:NAME_LENGTH - 1],
-                'last_name': last_name[0][0:NAME_LENGTH - 1],
-                'class_year': class_year,
-            }
-        )
-        objs.append(u)
-    return objs
+        entries.append({
+            'username': ldap_u['uid'][0],
+            'email': ldap_u.get('mail', [False])[0] or ldap_u['uid'][0] + "@wpi.edu",
+            'first_name': given_name[0][0:NAME_LENGTH - 1],
+            'last_name': last_name[0][0:NAME_LENGTH - 1],
+            'class_year': class_year,
+        })
+    return entries
+
+
+def search_or_create_users(q):
+    return directory.search_or_create_users('ldap', q, user_entries)
+
+
+def parse_class_year(attributes):
+    try:
+        class_year = attributes.get('wpieduPersonClass', [None])[0]
+    except IndexError:
+        class_year = None
+    try:
+        return int(class_year)
+    except (ValueError, TypeError):
+        return None
+
+
+def apply_entry(user, attributes):
+    """
+    Fill in any missing details on a user from their directory entry. Existing values are never overwritten.
+
+    :param user: The user to update (not saved)
+    :param attributes: The attributes of the user's LDAP entry
+    :return: List of the names of the fields that changed
+    """
+    changed = []
+    if not user.first_name and attributes.get('givenName'):
+        user.first_name = attributes['givenName'][0][0:NAME_LENGTH - 1]
+        changed.append('first_name')
+    if not user.last_name and attributes.get('sn'):
+        user.last_name = attributes['sn'][0][0:NAME_LENGTH - 1]
+        changed.append('last_name')
+    if not user.email:
+        user.email = attributes.get('mail', [False])[0] or user.username + "@wpi.edu"
+        changed.append('email')
+    if not user.class_year:
+        class_year = parse_class_year(attributes)
+        if class_year:
+            user.class_year = class_year
+            changed.append('class_year')
+    return changed
 
 
 def fill_in_user(user):
@@ -75,30 +110,70 @@ def fill_in_user(user):
     conn_args = get_ldap_settings()
 
     with ldap3.Connection(server_pool, **conn_args) as conn:
-        conn.search(search_base='ou=People,dc=wpi,dc=edu', search_filter=("(uid=%s)" % user.username), search_scope=ldap3.LEVEL, attributes=('givenName', 'sn', 'mail', 'wpieduPersonClass'), paged_size=1)
+        conn.search(search_base='ou=People,dc=wpi,dc=edu', search_filter=("(uid=%s)" % escape_filter_chars(user.username)), search_scope=ldap3.LEVEL, attributes=('givenName', 'sn', 'mail', 'wpieduPersonClass'), paged_size=1)
         resp = conn.response
     if len(resp):
-        resp = resp[0]['attributes']
-        if not user.first_name:
-            user.first_name = resp.get('givenName', [''])[0][0:NAME_LENGTH - 1]
-        if not user.last_name:
-            user.last_name = resp.get('sn', [''])[0][0:NAME_LENGTH - 1]
-        if not user.email:
-            user.email = resp.get('mail', [False])[0][0] or user.username + "@wpi.edu"
-        if not user.class_year:
-            try:
-                class_year = resp.get('wpieduPersonClass', [None])[0]
-            except IndexError:
-                class_year = None
-            try:
-                class_year = int(class_year)
-            except (ValueError, TypeError):
-                class_year = None
-            if class_year:
-                user.class_year = class_year
+        apply_entry(user, resp[0]['attributes'])
     return user
 
 
+def fetch_entries(conn, usernames, page_size=200):
+    """
+    Look up several users in a single (paged) search
+
+    :param conn: A bound ldap3 Connection
+    :param usernames: The usernames to look up
+    :param page_size: Number of entries to request per page
+    :return: Dictionary of usernames to the attributes of their entries
+    """
+    ldap_q = "(|" + "".join("(uid=%s)" % escape_filter_chars(username) for username in usernames) + ")"
+    results = conn.extend.standard.paged_search(
+        search_base='ou=People,dc=wpi,dc=edu', search_filter=ldap_q, search_scope=ldap3.LEVEL,
+        attributes=('givenName', 'sn', 'mail', 'uid', 'wpieduPersonClass'), paged_size=page_size, generator=True)
+    entries = {}
+    for entry in results:
+        attributes = entry.get('attributes', {})
+        if attributes.get('uid'):
+            entries[attributes['uid'][0]] = attributes
+    return entries
+
+
+def sync_users(users, batch_size=200, progress=None):
+    """
+    Fill in missing details for many users at once. Users are looked up in batches over a single connection and saved
+    with one bulk update (in its own transaction) per batch.
+
+    :param users: Iterable of users to update
+    :param batch_size: Number of users to look up per search
+    :param progress: Optional callback, called with the number of users checked and updated so far after each batch
+    :return: Number of users that were updated
+    """
+    users = list(users)
+    checked = updated = 0
+    with ldap3.Connection(server_pool, **get_ldap_settings()) as conn:
+        for start in range(0, len(users), batch_size):
+            batch = users[start:start + batch_size]
+            entries = fetch_entries(conn, [user.username for user in batch], batch_size)
+            changed_users = []
+            changed_fields = set()
+            for user in batch:
+                if user.username in entries:
+                    changed = apply_entry(user, entries[user.username])
+                    if changed:
+                        changed_users.append(user)
+                        changed_fields.update(changed)
+            if changed_users:
+                with transaction.atomic():
+                    get_user_model().objects.bulk_update(changed_users, sorted(changed_fields))
+                # Keep the site search and typeahead indexes in step with the new names and emails
+                directory.send_post_save(changed_users, update_fields=frozenset(changed_fields))
+            checked += len(batch)
+            updated += len(changed_users)
+            if progress:
+                progress(checked, updated)
+    return updated
+
+
 def get_student_id(username):
     """
     Obtain a user's Student ID number from the server (if tied into the WPI network).
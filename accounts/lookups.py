@@ -2,9 +2,11 @@ from ajax_select import LookupChannel
 from django.contrib.auth import get_user_model
 from django.db.models import Q, Count
 
+from helpers.typeahead import TypeaheadIndex
 from . import ldap
 from . import graph
 
+user_index = TypeaheadIndex(get_user_model(), ('username', 'first_name', 'nickname', 'last_name'))
 
 # if anyone else is looking, apparently these lookup channels are registered and named under
 # settings.AJAX_LOOKUP_CHANNELS in lnldb/settings.py
@@ -13,15 +15,11 @@ class UserLookup(LookupChannel):
     model = get_user_model()
 
     def check_auth(self, request):
-        if request.user.groups.filter(Q(name="Alumni") | Q(name="Active") | Q(name="Officer")).exists():
+        if request.user.is_authenticated and request.user.in_group("Alumni", "Active", "Officer"):
             return True
 
     def get_query(self, q, request, search_ldap=True):
-        qs = Q()
-        for term in q.split():
-            qs &= (Q(username__icontains=term) | Q(first_name__icontains=term) |
-                   Q(nickname__icontains=term) | Q(last_name__icontains=term))
-        results = get_user_model().objects.filter(qs).\
+        results = user_index.filter(get_user_model().objects.all(), q).\
             annotate(is_prioritized=Count("groups", filter=Q(groups__name="Active"))).\
             order_by("-is_prioritized", "last_name", "first_name", "class_year").\
             prefetch_related('groups').distinct().all()
@@ -47,15 +45,12 @@ class OfficerLookup(LookupChannel):
     model = get_user_model()
 
     def check_auth(self, request):
-        if request.user.groups.filter(Q(name="Alumni") | Q(name="Active") | Q(name="Officer")).exists():
+        if request.user.is_authenticated and request.user.in_group("Alumni", "Active", "Officer"):
             return True
 
     def get_query(self, q, request):
         for term in q.split():
-            return get_user_model().objects.filter(
-                Q(username__icontains=term) | Q(first_name__icontains=term) |
-                Q(nickname__icontains=term) | Q(last_name__icontains=term)
-            ).filter(groups__name="Officer").distinct()
+            return user_index.filter(get_user_model().objects.all(), term).filter(groups__name="Officer").distinct()
 
     def format_match(self, obj):
         return self.format_item_display(obj)
@@ -68,15 +63,12 @@ class MemberLookup(LookupChannel):
     model = get_user_model()
 
     def check_auth(self, request):
-        if request.user.groups.filter(Q(name="Alumni") | Q(name="Active") | Q(name="Officer")).exists():
+        if request.user.is_authenticated and request.user.in_group("Alumni", "Active", "Officer"):
             return True
 
     def get_query(self, q, request):
         for term in q.split():
-            return get_user_model().objects.filter(
-                Q(username__icontains=term) | Q(first_name__icontains=term) |
-                Q(nickname__icontains=term) | Q(last_name__icontains=term)
-            ).filter(Q(groups__name="Alumni") | Q(groups__name="Active") | Q(groups__name="Officer")).distinct()
+            return user_index.filter(get_user_model().objects.all(), term).filter(Q(groups__name="Alumni") | Q(groups__name="Active") | Q(groups__name="Officer")).distinct()
 
     def format_match(self, obj):
         return self.format_item_display(obj)
@@ -89,15 +81,12 @@ class AssocMemberLookup(LookupChannel):
     model = get_user_model()
 
     def check_auth(self, request):
-        if request.user.groups.filter(Q(name="Alumni") | Q(name="Active") | Q(name="Officer")).exists():
+        if request.user.is_authenticated and request.user.in_group("Alumni", "Active", "Officer"):
             return True
 
     def get_query(self, q, request):
         for term in q.split():
-            return get_user_model().objects.filter(
-                Q(username__icontains=term) | Q(first_name__icontains=term) |
-                Q(nickname__icontains=term) | Q(last_name__icontains=term)
-            ).filter(
+            return user_index.filter(get_user_model().objects.all(), term).filter(
                 Q(groups__name="Associate") | Q(groups__name="Alumni") |
                 Q(groups__name="Active") | Q(groups__name="Officer")
             ).distinct()
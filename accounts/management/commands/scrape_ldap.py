@@ -1,6 +1,7 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.db.models import Q
-from django.db.transaction import atomic
 
 from ... import ldap
 from ...models import User
@@ -9,16 +10,18 @@ from ...models import User
 class Command(BaseCommand):
     help = "Searches ldap for info on users without it"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Number of users to look up per search")
+
     def handle(self, *args, **options):
-        users_needing_update = User.objects.filter(Q(first_name="") | Q(last_name="") | (Q(groups__name="Active") & Q(class_year__isnull=True)))
-        num_updated = 0
-        with atomic():
-            for u in users_needing_update:
-                try:
-                    ldap.fill_in_user(u)
-                    u.save()
-                    num_updated += 1
-                except Exception:
-                    self.stderr.write("Error in '%s'" % str(u))
-                    raise
+        users_needing_update = User.objects.filter(Q(first_name="") | Q(last_name="") | (Q(groups__name="Active") & Q(class_year__isnull=True))).distinct()
+        total = users_needing_update.count()
+        started = time.monotonic()
+
+        def progress(checked, updated):
+            elapsed = time.monotonic() - started
+            self.stdout.write("%d/%d users checked, %d updated (%.1f users/s)" %
+                              (checked, total, updated, checked / elapsed if elapsed else 0))
+
+        num_updated = ldap.sync_users(users_needing_update, batch_size=options['batch_size'], progress=progress)
         self.stdout.write("%d users updated." % num_updated)
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_superuser_alter_user_class_year'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('graph', 'Microsoft Graph'), ('ldap', 'LDAP')], max_length=8)),
+                ('query', models.CharField(help_text='Normalized search query', max_length=150)),
+                ('usernames', models.TextField(blank=True, help_text='Comma-separated usernames of the matching users (empty if none)')),
+                ('fetched', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'directory queries',
+                'unique_together': {('source', 'query')},
+            },
+        ),
+    ]
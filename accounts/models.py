@@ -1,5 +1,5 @@
 # noinspection PyProtectedMember
-from django.contrib.auth.models import AbstractUser, _user_has_perm
+from django.contrib.auth.models import AbstractUser, Group, _user_has_perm
 from django.db.models import (Model, BooleanField, CharField, IntegerField, BigIntegerField, PositiveIntegerField, Q,
                               TextField, DateField, DateTimeField, OneToOneField, ManyToManyField, ImageField, CASCADE,
                               SET_NULL, signals)
@@ -71,6 +71,23 @@ class User(AbstractUser):
             return self.first_name + " " + nick + self.last_name
         return "[%s]" % self.username
 
+    # Bumped whenever any group membership or permission assignment changes, so that cached lookups on every loaded
+    # user (not just the one the change was made through) are dropped
+    _membership_generation = 0
+
+    def _membership_cache(self):
+        """ Per-instance cache of the user's group names and global permission checks """
+        cache = self.__dict__.get('_membership')
+        if cache is None or cache['generation'] != User._membership_generation:
+            self.invalidate_membership_cache()
+            cache = self.__dict__['_membership'] = {'generation': User._membership_generation, 'perms': {}}
+        return cache
+
+    def invalidate_membership_cache(self):
+        """ Drops the cached group names and permissions, including the ones cached by Django's ModelBackend """
+        for attr in ('_membership', '_perm_cache', '_user_perm_cache', '_group_perm_cache'):
+            self.__dict__.pop(attr, None)
+
     def has_perm(self, perm, obj=None):
         """
         Returns True if the user has the specified permission. This method
@@ -82,14 +99,34 @@ class User(AbstractUser):
         This differs from the default in that superusers, while still having
         every permission, will be allowed after the logic has executed. This
         helps with typos in permission strings.
+
+        Global permissions (without an object) are only resolved once per user instance.
         """
-        has_perm = _user_has_perm(self, perm, obj)
+        if obj is None:
+            perms = self._membership_cache()['perms']
+            if perm not in perms:
+                perms[perm] = _user_has_perm(self, perm, obj)
+            has_perm = perms[perm]
+        else:
+            has_perm = _user_has_perm(self, perm, obj)
         # Active superusers have all permissions.
         if self.is_active and self.is_superuser:
             return True
         else:
             return has_perm
 
+    @property
+    def group_names(self):
+        """Names of the groups the user belongs to"""
+        cache = self._membership_cache()
+        if 'groups' not in cache:
+            cache['groups'] = frozenset(g.name for g in self.groups.all())
+        return cache['groups']
+
+    def in_group(self, *names):
+        """Whether the user belongs to any of the named groups"""
+        return not self.group_names.isdisjoint(names)
+
     @property
     def name(self):
         """User's full name"""
@@ -98,8 +135,7 @@ class User(AbstractUser):
     @property
     def is_lnl(self):
         """Is an LNL member"""
-        return self.groups.filter(Q(name="Alumni") | Q(name="Active") | Q(name="Officer") | Q(name="Associate") | Q(
-            name="Away") | Q(name="Inactive")).exists()
+        return self.in_group("Alumni", "Active", "Officer", "Associate", "Away", "Inactive")
 
     @property
     def is_complete(self):
@@ -113,7 +149,7 @@ class User(AbstractUser):
     @property
     def group_str(self):
         """Groups the user belongs to"""
-        groups = [g.name for g in self.groups.all()]
+        groups = self.group_names
         out_str = ""
         if "Alumni" in groups:
             out_str += 'Alum '
@@ -201,6 +237,17 @@ class ProfilePhoto(Model):
         return self.officer.name
 
 
+@receiver(signals.m2m_changed, sender=User.groups.through)
+@receiver(signals.m2m_changed, sender=User.user_permissions.through)
+@receiver(signals.m2m_changed, sender=Group.permissions.through)
+def membership_cache_invalidate(sender, instance, action, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    User._membership_generation += 1
+    if isinstance(instance, User):
+        instance.invalidate_membership_cache()
+
+
 @receiver(signals.post_delete, sender=ProfilePhoto)
 def officer_img_cleanup(sender, instance, **kwargs):
     """
@@ -279,3 +326,18 @@ class UserPreferences(Model):
     )
 
     meeting_invite_subscriptions = ManyToManyField(MeetingType, blank=True, related_name="invite_subscriptions")
+
+
+class DirectoryQuery(Model):
+    """ Cached result of searching an external user directory (Microsoft Graph or LDAP) """
+    source = CharField(choices=(('graph', 'Microsoft Graph'), ('ldap', 'LDAP')), max_length=8)
+    query = CharField(max_length=150, help_text="Normalized search query")
+    usernames = TextField(blank=True, help_text="Comma-separated usernames of the matching users (empty if none)")
+    fetched = DateTimeField()
+
+    def __str__(self):
+        return "%s: %s" % (self.source, self.query)
+
+    class Meta:
+        unique_together = (('source', 'query'),)
+        verbose_name_plural = "directory queries"
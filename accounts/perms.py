@@ -2,11 +2,11 @@ from events.perms import AssocUsersCustomPermissionLogic
 
 
 class EventUserPermLogic(AssocUsersCustomPermissionLogic):
-    field_name = ['submitter__contact', 'submitter__crew_chief', 'submitter__ccinstances__crew_chief',
-                  'event__submitted_by', 'event__lnl_contact', 'event__crew_chief', 'event__ccinstances__crew_chief',
-                  'ccinstances__event__submitted_by', 'ccinstances__event__contact', 'ccinstances__event__crew_chief',
+    field_name = ['submitter__contact', 'submitter__event__crew_chief', 'submitter__ccinstances__crew_chief',
+                  'ccinstances__event__submitted_by', 'ccinstances__event__contact',
+                  'ccinstances__event__event__crew_chief',
                   'crewchiefx__contact', 'crewchiefx__submitted_by', 'crewchiefx__ccinstances__crew_chief',
-                  'contact__ccinstances__crew_chief', 'contact__crew_chief', 'contact__submitted_by']
+                  'contact__ccinstances__crew_chief', 'contact__event__crew_chief', 'contact__submitted_by']
     perms = ('accounts.view_user',)
 
 
@@ -8,13 +8,14 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.template import Context, Template
 from django.utils import timezone
 from six import StringIO
+from watson import search as watson
 
 from data.tests.util import ViewTestCase
 from events.tests.generators import UserFactory, OrgFactory, Event2019Factory
 from events.models import EventCCInstance, Category, Service, Location, Building
 from helpers.challenges import is_officer
 from .templatetags import at_user_linking
-from . import ldap, models, lookups
+from . import directory, ldap, models, lookups
 import os, logging
 
 
@@ -448,6 +449,23 @@ class AccountsTestCase(ViewTestCase):
         self.assertEqual(assoc_lookup.format_match(self.user), "&nbsp;<strong>[testuser]</strong>")
 
 
+    def test_lookup_index(self):
+        self.setup()
+        self.officer.user_set.add(self.user)
+        request = self.request_factory.get("/", {'term': 'test'})
+        request.user = self.user
+        lookup = lookups.UserLookup()
+
+        # Changes to users are reflected in lookups right away
+        self.assertIn(self.user, list(lookup.get_query('testuser', request, False)))
+        self.user.nickname = "Sparky"
+        self.user.save()
+        self.assertIn(self.user, list(lookup.get_query('spark', request, False)))
+        self.assertEqual(list(lookup.get_query('spark zzz', request, False)), [])
+
+        self.user.delete()
+        self.assertEqual(list(lookup.get_query('spark', request, False)), [])
+
 class UserTestCase(test.TestCase):
     def setUp(self):
         self.user = models.User.objects.create(username="lnl", first_name="Test", last_name="User")
@@ -489,6 +507,24 @@ class UserTestCase(test.TestCase):
         result = self.user.group_str.split()
         self.assertIn("Inactive", result)
 
+    def test_membership_cache(self):
+        self.assertFalse(self.user.is_lnl)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.user.is_lnl)
+            self.assertEqual(self.user.group_str, "Unclassified")
+        self.assertFalse(self.user.has_perm('events.view_events'))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.user.has_perm('events.view_events'))
+
+        # Changing memberships or permissions through either side drops the cache
+        self.active.user_set.add(self.user)
+        self.assertTrue(self.user.is_lnl)
+        self.active.permissions.add(Permission.objects.get(codename='view_events'))
+        self.assertTrue(self.user.has_perm('events.view_events'))
+        self.user.groups.remove(self.active)
+        self.assertFalse(self.user.is_lnl)
+        self.assertFalse(self.user.has_perm('events.view_events'))
+
     def test_owns(self):
         self.org.user_in_charge = self.user
         self.org.save()
@@ -506,6 +542,23 @@ class UserTestCase(test.TestCase):
         self.assertIn(self.org, list(self.user.all_orgs))
         self.assertIn(self.org2, list(self.user.all_orgs))
 
+    def test_view_user_perm(self):
+        # Regular users can see people they work with on events or in organizations
+        viewer = UserFactory.create(password="123", is_superuser=False)
+        self.assertFalse(viewer.has_perm('accounts.view_user', self.user))
+
+        event = Event2019Factory.create(event_name="Perm Test Event", submitted_by=self.user)
+        EventCCInstance.objects.create(event=event, crew_chief=viewer, category=Category.objects.create(name="Sound"),
+                                       setup_location=event.location)
+        viewer = models.User.objects.get(pk=viewer.pk)
+        self.assertTrue(viewer.has_perm('accounts.view_user', self.user))
+
+        other = UserFactory.create(password="123", is_superuser=False)
+        self.assertFalse(other.has_perm('accounts.view_user', self.user))
+        self.org.associated_users.add(self.user, other)
+        other = models.User.objects.get(pk=other.pk)
+        self.assertTrue(other.has_perm('accounts.view_user', self.user))
+
     def test_mdc_name(self):
         self.user.first_name = "Test"
         self.user.last_name = "User"
@@ -517,6 +570,52 @@ class UserTestCase(test.TestCase):
         self.assertEqual(self.user.mdc_name, "PERSONS,TEST")
 
 
+class LdapEntryTestCase(test.TestCase):
+    def test_apply_entry(self):
+        user = models.User(username="lnl", last_name="Existing")
+        attributes = {'givenName': ['Lens'], 'sn': ['Lights'], 'mail': ['lnl@wpi.edu'], 'wpieduPersonClass': ['2024']}
+
+        # Only missing details are filled in
+        self.assertEqual(ldap.apply_entry(user, attributes), ['first_name', 'email', 'class_year'])
+        self.assertEqual(user.first_name, "Lens")
+        self.assertEqual(user.last_name, "Existing")
+        self.assertEqual(user.email, "lnl@wpi.edu")
+        self.assertEqual(user.class_year, 2024)
+        self.assertEqual(ldap.apply_entry(user, attributes), [])
+
+class DirectoryCacheTestCase(test.TestCase):
+    def setUp(self):
+        self.searches = []
+
+    def search(self, q):
+        self.searches.append(q)
+        if q.startswith("lnl"):
+            return [{'username': "lnl", 'email': "lnl@wpi.edu", 'first_name': "Lens", 'last_name': "Lights",
+                     'class_year': None}]
+        return []
+
+    def test_search_or_create_users(self):
+        # The first search goes to the directory and creates the users it finds
+        users = directory.search_or_create_users('graph', "LNL ", self.search)
+        self.assertEqual([u.username for u in users], ["lnl"])
+        self.assertTrue(models.User.objects.filter(username="lnl", first_name="Lens").exists())
+        # New users are added to the site search
+        self.assertIn(users[0], [result.object for result in watson.search("Lens")])
+
+        # Repeating it is answered locally
+        self.assertEqual(directory.search_or_create_users('graph', "lnl", self.search), users)
+        self.assertEqual(self.searches, ["lnl"])
+
+        # Searches that found nobody are remembered, including for longer queries
+        self.assertEqual(directory.search_or_create_users('graph', "xq", self.search), [])
+        self.assertEqual(directory.search_or_create_users('graph', "xqz", self.search), [])
+        self.assertEqual(self.searches, ["lnl", "xq"])
+
+        # Expired entries are searched again
+        models.DirectoryQuery.objects.update(fetched=timezone.now() - timezone.timedelta(days=2))
+        directory.search_or_create_users('graph', "lnl", self.search)
+        self.assertEqual(self.searches, ["lnl", "xq", "lnl"])
+
 # class LdapTestCase(test.TestCase):
 
 #     def setUp(self):
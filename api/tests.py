@@ -350,6 +350,45 @@ class APIViewTest(ViewTestCase):
         # Test getting an event by its ID
         self.assertEqual(self.client.get("/api/v1/events", {"id": "1"}).content.decode('utf-8'), name_response)
 
+    def test_events_endpoint_paginated(self):
+        self.assertOk(self.client.get("/api/v1/events", {"page_size": 2}), 204)
+
+        now = timezone.now().replace(microsecond=0)
+        end = now + timezone.timedelta(days=1)
+        for i in range(5):
+            # Two events share each start time to make sure ties are broken by id
+            Event2019Factory.create(event_name="Event %d" % i, datetime_start=now + timezone.timedelta(hours=i // 2),
+                                    datetime_end=end, approved=True)
+
+        # Results are returned in order of start time, then id
+        resp = self.client.get("/api/v1/events", {"page_size": 2})
+        self.assertOk(resp)
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 0", "Event 1"])
+        self.assertIsNone(resp.data['previous'])
+
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 2", "Event 3"])
+
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 4"])
+        self.assertIsNone(resp.data['next'])
+
+        # Walk back to the previous page
+        resp = self.client.get(resp.data['previous'])
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 2", "Event 3"])
+        self.assertIsNotNone(resp.data['next'])
+        self.assertIsNotNone(resp.data['previous'])
+
+        # Filters still apply
+        resp = self.client.get("/api/v1/events", {"page_size": 2, "name": "Event 4"})
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 4"])
+        self.assertIsNone(resp.data['next'])
+
+        # Invalid page sizes are rejected and invalid cursors start over from the beginning
+        self.assertOk(self.client.get("/api/v1/events", {"page_size": "all"}), 400)
+        resp = self.client.get("/api/v1/events", {"page_size": 2, "cursor": "invalid"})
+        self.assertEqual([event['event_name'] for event in resp.data['results']], ["Event 0", "Event 1"])
+
     def test_crew_endpoint(self):
         # Get token for authentication
         token, created = Token.objects.get_or_create(user=self.user)
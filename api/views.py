@@ -19,6 +19,7 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound, ParseError, AuthenticationFailed, PermissionDenied, NotAuthenticated
+from rest_framework.utils.urls import replace_query_param
 from cryptography.fernet import Fernet
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter, OpenApiTypes, OpenApiResponse, \
     OpenApiExample, inline_serializer
@@ -29,6 +30,7 @@ from accounts.models import UserPreferences, Officer
 from accounts.forms import SMSOptInForm
 from emails.generators import generate_sms_email
 from events.models import OfficeHour, Event2019, Location, CrewAttendanceRecord
+from helpers.pagination import keyset_paginate
 from data.models import Notification, Extension, ResizedRedirect
 from pages.models import Page
 from spotify.models import Session, SpotifyUser, SongRequest
@@ -39,6 +41,9 @@ from .serializers import OfficerSerializer, HourSerializer, NotificationSerializ
     SpotifySessionWriteSerializer, SongRequestSerializer, TokenRequestSerializer
 from . import examples
 
+EVENTS_DEFAULT_PAGE_SIZE = 100
+EVENTS_MAX_PAGE_SIZE = 500
+
 
 # Create your views here.
 @extend_schema_view(
@@ -234,6 +239,15 @@ class EventViewSet(viewsets.ReadOnlyModelViewSet):
             OpenApiParameter('location', OpenApiTypes.STR, OpenApiParameter.QUERY, False, "Filter by location"),
             OpenApiParameter('start', OpenApiTypes.DATETIME, OpenApiParameter.QUERY, False, "Filter by start time"),
             OpenApiParameter('end', OpenApiTypes.DATETIME, OpenApiParameter.QUERY, False, "Filter by end time"),
+            OpenApiParameter(
+                'page_size', OpenApiTypes.INT, OpenApiParameter.QUERY, False,
+                "Number of events per page (max %d). Paginated results are ordered by start time and wrapped in an "
+                "object with \"next\" and \"previous\" links." % EVENTS_MAX_PAGE_SIZE
+            ),
+            OpenApiParameter(
+                'cursor', OpenApiTypes.STR, OpenApiParameter.QUERY, False,
+                "Cursor from the \"next\" or \"previous\" link of a paginated response"
+            ),
         ],
         responses={
             200: EventSerializer,
@@ -252,12 +266,32 @@ class EventViewSet(viewsets.ReadOnlyModelViewSet):
     )
     def list(self, request):
         queryset = self.get_queryset()
-        if queryset.count() == 0:
+        if 'page_size' in request.query_params or 'cursor' in request.query_params:
+            return self.list_page(request, queryset)
+        serializer = EventSerializer(queryset, many=True)
+        if not serializer.data:
             content = {'204': 'No events could be found with the specified parameters'}
             return Response(content, status=status.HTTP_204_NO_CONTENT)
-        serializer = EventSerializer(queryset, many=True)
         return Response(serializer.data)
 
+    def list_page(self, request, queryset):
+        """ Returns one page of events, walking the list by (datetime_start, id) with a cursor """
+        try:
+            page_size = int(request.query_params.get('page_size', EVENTS_DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ParseError("page_size must be an integer")
+        page_size = max(1, min(page_size, EVENTS_MAX_PAGE_SIZE))
+        page = keyset_paginate(queryset.select_related('location'), request.query_params.get('cursor'), page_size)
+        if not page.object_list:
+            content = {'204': 'No events could be found with the specified parameters'}
+            return Response(content, status=status.HTTP_204_NO_CONTENT)
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'cursor', page.next_cursor) if page.has_next() else None,
+            'previous': replace_query_param(url, 'cursor', page.previous_cursor) if page.has_previous() else None,
+            'results': EventSerializer(page.object_list, many=True).data
+        })
+
     def get_queryset(self):
         queryset = Event2019.objects.filter(sensitive=False, test_event=False, approved=True).order_by('id')
         event_id = self.request.query_params.get('id', None)
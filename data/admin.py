@@ -2,7 +2,7 @@ from cryptography.fernet import Fernet
 from django.contrib import admin
 from django.conf import settings
 from django.contrib.redirects.models import Redirect as BaseRedirect
-from .models import ResizedRedirect, Notification, Extension
+from .models import ResizedRedirect, Notification, Extension, Task
 
 
 class RedirectAdmin(admin.ModelAdmin):
@@ -19,8 +19,15 @@ class ExtensionAdmin(admin.ModelAdmin):
         return "Not available"
 
 
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'created', 'finished', 'duration')
+    list_filter = ('status',)
+    readonly_fields = ('name', 'payload', 'encrypted', 'attempts', 'max_attempts', 'error', 'created', 'started', 'finished')
+
+
 admin.site.index_template = "admin/index.html"
 admin.site.unregister(BaseRedirect)
 admin.site.register(ResizedRedirect, RedirectAdmin)
 admin.site.register(Notification)
 admin.site.register(Extension, ExtensionAdmin)
+admin.site.register(Task, TaskAdmin)
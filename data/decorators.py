@@ -1,17 +1,27 @@
-from threading import Thread
+from functools import wraps
 
+from . import tasks
 
-def process_in_thread(method):
+
+def process_in_thread(method=None, retry=False):
     """
-    Use this decorator to indicate that a method should be processed on a separate thread.
+    Use this decorator to indicate that a method should be processed in the background.
+
+    Calls are saved to the task queue (see ``data.tasks``) and run on a bounded pool of worker threads, so the arguments
+    must be JSON serializable. Database connections are closed automatically once the method returns.
 
-    WARNING: Refrain from interacting with the database while using this decorator (i.e. no read / write). If you do
-    access the database, be sure to call ``connection.close()`` (from django.db import connection) at the end of the
-    method.
+    Failed calls are only run again if the decorator is used as ``@process_in_thread(retry=True)``, so leave that off
+    for anything that isn't safe to repeat (like sending an email, which may fail after some of it has gone out).
     """
 
-    def decorator(*args, **kwargs):
-        t = Thread(target=method, args=args, kwargs=kwargs)
-        t.daemon = True
-        t.start()
-    return decorator
+    def wrap(method):
+        name = tasks.register(method, retry)
+
+        @wraps(method)
+        def decorator(*args, **kwargs):
+            tasks.enqueue(name, args, kwargs)
+        return decorator
+
+    if method is None:
+        return wrap
+    return wrap(method)
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from events.models import BaseEvent, Event2019
+from pdfs import rendering, views
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Reports per-PDF rendering latency with a cold and a warm rendering context (bypassing the PDF cache)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=10, help="Number of PDFs to render per renderer and mode")
+        parser.add_argument('--event', type=int, default=None, help="Event to render (defaults to the latest one)")
+
+    def time_renders(self, method, html, samples, cold):
+        timings = []
+        if not cold:
+            # Warm up (the first render sets up the context)
+            method(html)
+        for _ in range(samples):
+            if cold:
+                rendering.reset()
+            start = time.perf_counter()
+            method(html)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def handle(self, *args, **options):
+        timezone.activate(timezone.get_current_timezone())
+        events = BaseEvent.objects.order_by('-datetime_start')
+        if options['event']:
+            events = events.filter(pk=options['event'])
+        event = events.first()
+        if event is None:
+            raise CommandError("No event to render")
+
+        documents = [('workorder', views.pisa_to_pdf, views.workorder_documents([event])[0][0])]
+        if isinstance(event, Event2019):
+            html = render_to_string('pdf_templates/bill-itemized-2025.html', context=views.get_quote_data(event))
+            documents.append(('bill', views.weasyprint_to_pdf, html))
+
+        for name, method, html in documents:
+            for mode in ('cold', 'warm'):
+                timings = self.time_renders(method, html, options['samples'], mode == 'cold')
+                self.stdout.write("%-10s %-5s mean %7.1f ms   p50 %7.1f ms   max %7.1f ms" %
+                                  (name, mode, sum(timings) / len(timings), percentile(timings, 50), max(timings)))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from pdfs import cache
+
+
+class Command(BaseCommand):
+    help = "Reports usage of the rendered PDF cache, optionally trimming or clearing it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help="Trim the cache down to PDF_CACHE_MAX_SIZE")
+        parser.add_argument('--clear', action='store_true', help="Delete every cached PDF and reset the counters")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            cache.clear()
+        elif options['evict']:
+            self.stdout.write("Deleted %d file(s)" % cache.evict(settings.PDF_CACHE_MAX_SIZE))
+
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        self.stdout.write("Hits: %d, misses: %d (hit rate %.0f%%)" %
+                          (stats['hits'], stats['misses'], 100.0 * stats['hits'] / lookups if lookups else 0))
+        self.stdout.write("%d file(s), %s of %s" % (stats['files'], filesizeformat(stats['size']),
+                                                    filesizeformat(settings.PDF_CACHE_MAX_SIZE)))
@@ -0,0 +1,36 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from data import tasks
+
+
+class Command(BaseCommand):
+    help = "Runs queued background tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of tasks to run at once (defaults to TASK_WORKERS)")
+        parser.add_argument('--poll', type=float, default=5, help="Seconds to wait between checks for new tasks")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.TASK_WORKERS or 1
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task') as executor:
+            while True:
+                tasks.requeue_stale()
+                pending = tasks.pending_tasks(workers * 2)
+                if pending:
+                    if workers == 1:
+                        for pk in pending:
+                            tasks.run_task(pk)
+                    else:
+                        list(executor.map(tasks.run_in_thread, pending))
+                    if options['verbosity'] > 1:
+                        self.stdout.write("Ran %d task(s)" % len(pending))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll'])
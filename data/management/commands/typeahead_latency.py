@@ -0,0 +1,51 @@
+import random
+import time
+
+from ajax_select import registry
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Reports typeahead latency (p50 / p95 / max) for the ajax_select lookup channels"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200, help="Number of queries to time per channel")
+        parser.add_argument('channels', nargs='*', help="Channels to test (defaults to the user and org lookups)")
+
+    def handle(self, *args, **options):
+        channels = options['channels'] or ['Users', 'Officers', 'Members', 'AssocMembers', 'Orgs']
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.filter(is_superuser=True).first() or get_user_model()()
+
+        # Queries are prefixes of 1 to 4 characters of real names, like someone typing them
+        names = [name for name in get_user_model().objects.values_list('last_name', flat=True)[:1000] if name]
+        if not names:
+            self.stderr.write("No users to search for")
+            return
+        queries = [random.choice(names)[:random.randint(1, 4)] for _ in range(options['samples'])]
+
+        for channel in channels:
+            if channel not in settings.AJAX_LOOKUP_CHANNELS:
+                self.stderr.write("Unknown channel '%s'" % channel)
+                continue
+            lookup = registry.get(channel)
+            kwargs = {'search_ldap': False} if channel == 'Users' else {}
+            timings = []
+            for q in queries:
+                start = time.perf_counter()
+                list(lookup.get_query(q, request, **kwargs) or [])
+                timings.append((time.perf_counter() - start) * 1000)
+            # The first query also builds the index, so it is reported on its own
+            first = timings.pop(0)
+            if not timings:
+                timings = [first]
+            self.stdout.write("%-14s first %7.1f ms   p50 %7.1f ms   p95 %7.1f ms   max %7.1f ms" %
+                              (channel, first, percentile(timings, 50), percentile(timings, 95), max(timings)))
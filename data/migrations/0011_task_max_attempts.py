@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0010_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Number of times to try running the task'),
+        ),
+    ]
@@ -113,3 +113,51 @@ class Extension(models.Model):
 
     class Meta:
         verbose_name = "Third-party application"
+
+
+class Task(models.Model):
+    """Background task queued by the ``process_in_thread`` decorator"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=255, help_text="Dotted path of the task function")
+    payload = models.TextField(help_text="JSON-encoded arguments (encrypted if a crypto key is configured)")
+    encrypted = models.BooleanField(default=False)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1, help_text="Number of times to try running the task")
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s (%s)" % (self.name, self.status)
+
+    @property
+    def duration(self):
+        """ How long the last attempt took to run """
+        if self.started and self.finished and self.finished >= self.started:
+            return self.finished - self.started
+        return None
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [models.Index(fields=['status', 'created'], name='data_task_status_idx')]
+
+
+class Counter(models.Model):
+    """Named running count shared by every process (such as hits and misses of the rendered PDF cache)"""
+    name = models.CharField(max_length=64, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return "%s: %d" % (self.name, self.value)
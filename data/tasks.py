@@ -0,0 +1,169 @@
+"""
+Background task queue behind the ``process_in_thread`` decorator.
+
+Every call is saved to the database as a :class:`~data.models.Task` and, once the surrounding transaction commits, handed
+to a small pool of worker threads. When the pool is busy the task simply stays queued, and anything left behind (because
+the pool was full, the process restarted or the task failed and is due for a retry) is picked up by
+``manage.py run_tasks``. Since tasks are saved in the same transaction as the changes that queued them, they are never
+lost or run against data that was rolled back.
+"""
+import datetime
+import importlib
+import json
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+retrying = set()
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def register(method, retry=False):
+    """
+    Make a function available to task workers. Returns the name tasks refer to it by.
+
+    :param retry: Whether failed calls should be run again (up to TASK_MAX_ATTEMPTS times)
+    """
+    name = '%s.%s' % (method.__module__, method.__qualname__)
+    registry[name] = method
+    if retry:
+        retrying.add(name)
+    return name
+
+
+def resolve(name):
+    """ Look up a registered task function, importing its module if this process hasn't loaded it yet """
+    if name not in registry:
+        importlib.import_module(name.rsplit('.', 1)[0])
+    return registry[name]
+
+
+def encode_payload(args, kwargs):
+    payload = json.dumps({'args': list(args), 'kwargs': kwargs}, cls=DjangoJSONEncoder)
+    if settings.CRYPTO_KEY:
+        return Fernet(settings.CRYPTO_KEY).encrypt(payload.encode('utf-8')).decode('utf-8'), True
+    return payload, False
+
+
+def decode_payload(task):
+    payload = task.payload
+    if task.encrypted:
+        payload = Fernet(settings.CRYPTO_KEY).decrypt(payload.encode('utf-8')).decode('utf-8')
+    payload = json.loads(payload)
+    return payload['args'], payload['kwargs']
+
+
+def enqueue(name, args=(), kwargs=None):
+    """
+    Queue a call to a registered task function
+
+    :param name: The name returned by :func:`register`
+    :param args: Positional arguments (must be JSON serializable)
+    :param kwargs: Keyword arguments (must be JSON serializable)
+    :return: Task
+    """
+    payload, encrypted = encode_payload(args, kwargs or {})
+    max_attempts = settings.TASK_MAX_ATTEMPTS if name in retrying else 1
+    task = Task.objects.create(name=name, payload=payload, encrypted=encrypted, max_attempts=max_attempts)
+    if settings.TASK_WORKERS:
+        transaction.on_commit(lambda: dispatch(task.pk))
+    else:
+        # No worker threads configured; run the task right away
+        run_task(task.pk)
+    return task
+
+
+def get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.TASK_WORKERS, thread_name_prefix='task')
+            _slots = threading.BoundedSemaphore(settings.TASK_WORKERS + settings.TASK_QUEUE_SIZE)
+    return _executor, _slots
+
+
+def dispatch(pk):
+    """ Hand a queued task to the worker pool, unless the pool is already full """
+    executor, slots = get_executor()
+    if not slots.acquire(blocking=False):
+        logger.warning("Task queue is full; task %s will wait for the run_tasks worker", pk)
+        return
+    future = executor.submit(run_in_thread, pk)
+    future.add_done_callback(lambda f: slots.release())
+
+
+def run_in_thread(pk):
+    """ Run a task on a worker thread, closing the thread's database connections afterwards """
+    try:
+        run_task(pk)
+    finally:
+        connections.close_all()
+
+
+def claim(pk):
+    """ Atomically mark a pending task as running. Returns False if another worker got to it first. """
+    return Task.objects.filter(pk=pk, status=Task.PENDING) \
+        .update(status=Task.RUNNING, started=timezone.now(), attempts=F('attempts') + 1) == 1
+
+
+def run_task(pk):
+    """
+    Run a pending task and record the outcome. Failed tasks that allow retries go back in the queue (to be retried by
+    the run_tasks worker after TASK_RETRY_DELAY seconds) until they run out of attempts.
+    """
+    if not claim(pk):
+        return
+    task = Task.objects.get(pk=pk)
+    start = time.perf_counter()
+    try:
+        args, kwargs = decode_payload(task)
+        resolve(task.name)(*args, **kwargs)
+    except Exception:
+        elapsed = time.perf_counter() - start
+        retry = task.attempts < task.max_attempts
+        logger.exception("Task %s (%s) failed after %.3fs on attempt %d%s", task.pk, task.name, elapsed,
+                         task.attempts, "; will retry" if retry else "")
+        Task.objects.filter(pk=pk).update(status=Task.PENDING if retry else Task.FAILED, finished=timezone.now(),
+                                          error=traceback.format_exc())
+    else:
+        elapsed = time.perf_counter() - start
+        logger.info("Task %s (%s) finished in %.3fs", task.pk, task.name, elapsed)
+        Task.objects.filter(pk=pk).update(status=Task.DONE, finished=timezone.now())
+
+
+def pending_tasks(limit):
+    """ Primary keys of the oldest pending tasks that are due to run """
+    retry_after = timezone.now() - datetime.timedelta(seconds=settings.TASK_RETRY_DELAY)
+    return list(Task.objects.filter(status=Task.PENDING).filter(Q(attempts=0) | Q(finished__lt=retry_after))
+                .order_by('created').values_list('pk', flat=True)[:limit])
+
+
+def requeue_stale():
+    """
+    Put tasks that have been running for longer than TASK_STALE_AFTER seconds (because the process running them went
+    away) back in the queue if they have attempts left, and mark the rest as failed. Also clears out finished tasks
+    older than a week.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING,
+                                started__lt=now - datetime.timedelta(seconds=settings.TASK_STALE_AFTER))
+    stale.filter(attempts__lt=F('max_attempts')).update(status=Task.PENDING)
+    stale.update(status=Task.FAILED, finished=now, error="The worker running this task went away")
+    Task.objects.filter(status=Task.DONE, finished__lt=now - datetime.timedelta(days=7)).delete()
@@ -0,0 +1,79 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..decorators import process_in_thread
+from ..models import Task, Notification
+
+
+@process_in_thread
+def create_notification(title, target='All'):
+    Notification.objects.create(title=title, message="", format="alert", type="info", target=target,
+                                expires="2100-01-01T00:00:00Z")
+
+
+@process_in_thread
+def broken_task():
+    raise ValueError("Something went wrong")
+
+
+@process_in_thread(retry=True)
+def flaky_task():
+    raise ValueError("Something went wrong")
+
+
+class TaskQueueTests(TestCase):
+    @override_settings(TASK_WORKERS=0)
+    def test_inline(self):
+        # Without worker threads, tasks run as soon as they are queued
+        self.assertIsNone(create_notification("Inline", target="events"))
+        self.assertTrue(Notification.objects.filter(title="Inline", target="events").exists())
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+        # Failures are recorded instead of being raised to the caller
+        broken_task()
+        task = Task.objects.get(status=Task.FAILED)
+        self.assertIn("Something went wrong", task.error)
+        self.assertEqual(task.attempts, 1)
+
+    @override_settings(TASK_WORKERS=2)
+    def test_worker(self):
+        # Tasks wait in the queue until the transaction commits, and the worker command picks up anything left behind
+        create_notification("Queued")
+        self.assertFalse(Notification.objects.filter(title="Queued").exists())
+        self.assertEqual(Task.objects.get().status, Task.PENDING)
+
+        call_command('run_tasks', once=True, workers=1)
+        self.assertTrue(Notification.objects.filter(title="Queued").exists())
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    @override_settings(TASK_WORKERS=0, TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=0)
+    def test_retry(self):
+        # Failed tasks go back in the queue for the worker until they run out of attempts
+        flaky_task()
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertEqual(task.attempts, 1)
+        self.assertIsNotNone(task.duration)
+
+        call_command('run_tasks', once=True, workers=1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, 2)
+
+    @override_settings(TASK_WORKERS=0, TASK_RETRY_DELAY=3600)
+    def test_retry_delay(self):
+        # Retries wait until the delay has passed
+        flaky_task()
+        call_command('run_tasks', once=True, workers=1)
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertEqual(task.attempts, 1)
+
+    @override_settings(TASK_WORKERS=0, TASK_RETRY_DELAY=0)
+    def test_no_retry(self):
+        # Tasks that aren't safe to repeat fail on the first error
+        broken_task()
+        call_command('run_tasks', once=True, workers=1)
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, 1)
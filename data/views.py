@@ -22,6 +22,7 @@ import reversion
 from watson import search as watson
 
 from events import models as events_models
+from events.perms import filter_visible
 from emails.generators import EventEmailGenerator
 
 
@@ -89,14 +90,16 @@ def workorderwizard_load(request):
                         'address': request.user.addr}
     for loc in events_models.Location.objects.filter(show_in_wo_form=True):
         response['locations'].append({'id': loc.pk, 'name': loc.name, 'building': loc.building.name})
-    for org in events_models.Organization.objects.filter(archived=False):
+    orgs = events_models.Organization.objects.filter(archived=False)
+    visible = set(filter_visible(orgs, request.user, 'events.view_org').values_list('pk', flat=True))
+    for org in orgs.prefetch_related('associated_users'):
         data = {'id': org.pk,
                 'name': org.name,
                 'shortname': org.shortname,
-                'owner': org.user_in_charge == request.user,
+                'owner': org.user_in_charge_id == request.user.pk,
                 'member': request.user in org.associated_users.all(),
                 'delinquent': org.delinquent}
-        if request.user.has_perm('events.view_org', org):
+        if org.pk in visible:
             data['email'] = org.exec_email
             data['phone'] = org.phone
             data['address'] = org.address
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0013_alter_configurationprofile_profile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='installationrecord',
+            index=models.Index(fields=['installed_on'], name='devices_install_on_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='installationrecord',
+            index=models.Index(fields=['expires'], name='devices_install_expires_idx'),
+        ),
+    ]
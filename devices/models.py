@@ -119,3 +119,9 @@ class InstallationRecord(models.Model):
             return "%s (v%s) on %s" % (str(self.profile), str(self.version), str(self.device))
         else:
             return "%s (v%s) on %s" % (str(self.app), str(self.version), str(self.device))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['installed_on'], name='devices_install_on_idx'),
+            models.Index(fields=['expires'], name='devices_install_expires_idx'),
+        ]
@@ -460,6 +460,13 @@ class MDMTestCase(ViewTestCase):
         self.assertTrue(models.InstallationRecord.objects.filter(app=app2, device=self.laptop2, active=False).exists())
         self.assertTrue(models.MacOSApp.objects.filter(name="Test App").exists())
         self.assertEqual(app.version, "2021.11 (1062)")
+        self.assertEqual(models.InstallationRecord.objects.get(app=app, device=self.laptop2, active=True).version,
+                         "2021.11 (1062)")
+
+        # Reporting the same apps again should not change anything
+        num_records = models.InstallationRecord.objects.count()
+        self.client.post(reverse("mdm:confirm-install"), json.dumps(data_with_apps), content_type="application/json")
+        self.assertEqual(models.InstallationRecord.objects.count(), num_records)
 
         # Verify that record does not exist at first
         profile = models.ConfigurationProfile.objects.get(pk=pk)
@@ -1546,6 +1553,51 @@ class MDMTestCase(ViewTestCase):
 
         self.assertEqual(app.description, "It's a computer program")
 
+    def test_munki_sync(self):
+        models.MacOSApp.objects.all().delete()
+        existing = models.MacOSApp.objects.create(name="Firefox", managed=False)
+        merged = models.MacOSApp.objects.create(name="Old Chrome", managed=True)
+        chrome = models.MacOSApp.objects.create(name="Google Chrome", version="1.0")
+        merged.merged_into = chrome
+        merged.save()
+        retired = models.MacOSApp.objects.create(name="Retired App", managed=True)
+
+        catalog = [
+            {'display_name': 'firefox', 'description': ' A web browser \n', 'version': '99.0', 'developer': 'Mozilla'},
+            {'display_name': 'old chrome', 'description': 'Another web browser', 'version': '2.0'},
+            {'name': 'NewApp', 'description': 'Brand new', 'version': '1.0'},
+            {'display_name': 'NEWAPP', 'description': 'Duplicate entry', 'version': '0.9', 'developer': 'Someone'},
+        ]
+        stats = views.sync_managed_software(views.parse_munki_catalog(catalog))
+        self.assertEqual((stats['created'], stats['updated'], stats['unmanaged']), (1, 2, 2))
+
+        # Names match regardless of case, and only missing details are filled in
+        existing.refresh_from_db()
+        self.assertTrue(existing.managed)
+        self.assertEqual(existing.description, "A web browser")
+        self.assertEqual(existing.developer, "Mozilla")
+
+        # Merged apps update the app they were merged into
+        chrome.refresh_from_db()
+        merged.refresh_from_db()
+        self.assertTrue(chrome.managed)
+        self.assertEqual(chrome.version, "1.0")
+        self.assertEqual(chrome.description, "Another web browser")
+        self.assertFalse(merged.managed)
+
+        # Apps that appear more than once are only created once
+        new_app = models.MacOSApp.objects.get(name__iexact="newapp")
+        self.assertEqual(new_app.description, "Brand new")
+        self.assertEqual(new_app.developer, "Someone")
+        self.assertTrue(new_app.managed)
+
+        retired.refresh_from_db()
+        self.assertFalse(retired.managed)
+
+        # Nothing changes when the catalog is synced again
+        stats = views.sync_managed_software(views.parse_munki_catalog(catalog))
+        self.assertEqual((stats['created'], stats['updated'], stats['unmanaged']), (0, 0, 0))
+
     def test_list_apps(self):
         self.setup()
 
@@ -1713,3 +1765,18 @@ class MDMTestCase(ViewTestCase):
         self.user.user_permissions.add(permission)
 
         self.assertOk(self.client.get(reverse("mdm:install-logs")))
+
+        # Removals and installs are listed together, newest first
+        resp = self.client.get(reverse("mdm:install-logs"))
+        self.assertEqual(len(resp.context['events']), 4)
+        timestamps = [event['timestamp'] for event in resp.context['events']]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+        self.assertEqual(len([event for event in resp.context['events'] if 'was removed from' in event['details']]),
+                         1)
+
+        # Filter by app or profile
+        resp = self.client.get(reverse("mdm:install-logs"), {'app': app.pk})
+        self.assertEqual([event['details'] for event in resp.context['events']],
+                         ["Test Application was installed on %s" % self.laptop2.name])
+        resp = self.client.get(reverse("mdm:install-logs"), {'profile': profile.pk, 'device': self.laptop2.pk})
+        self.assertEqual(len(resp.context['events']), 3)
@@ -3,14 +3,16 @@ from __future__ import unicode_literals
 
 from hashlib import sha256
 from itertools import chain
-import json, os, datetime, uuid, plistlib
+import json, logging, os, datetime, time, uuid, plistlib
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
 from django.contrib import messages
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import BooleanField, F, Q, Value
+from django.db.models.functions import Lower
 from django.http import JsonResponse, HttpResponse, FileResponse, Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render, reverse
 from django.template import loader
@@ -25,6 +27,8 @@ from .forms import ProfileForm, EnrollmentForm, RemovalForm, ClientForm, Assignm
     NewAppForm, UpdateAppForm, UninstallAppForm, AppMergeForm
 from emails.generators import GenericEmailGenerator
 
+logger = logging.getLogger(__name__)
+
 
 @login_required
 @require_GET
@@ -257,6 +261,7 @@ def mdm_checkin(request):
 
 @require_POST
 @csrf_exempt
+@transaction.atomic
 def install_confirmation(request):
     """
     Endpoint for accepting receipt of install. Managed devices should contact this endpoint anytime new resources are
@@ -267,76 +272,118 @@ def install_confirmation(request):
     data = json.loads(request.body)
     device = get_object_or_404(Laptop, api_key_hash=sha256(data['APIKey'].encode('utf-8')).hexdigest(),
                                mdm_enrolled=True)
-    profiles_installed = data['installed']
-    profiles_removed = data['removed']
-    apps = data['apps'].split('#')
+    now = timezone.now()
+    profiles_installed = [int(pk) for pk in data['installed']]
+    profiles_removed = [int(pk) for pk in data['removed']]
+    profiles = ConfigurationProfile.objects.in_bulk(profiles_installed + profiles_removed)
+    if len(profiles) != len(set(profiles_installed + profiles_removed)):
+        raise Http404
+
+    # Load the device's current state once and work out what changed in memory
+    new_records = []
+    updated_records = {}
+    profile_records = {record.profile_id: record for record in
+                       InstallationRecord.objects.filter(device=device, profile__in=profiles.values(), active=True)}
     for pk in profiles_installed:
-        profile = get_object_or_404(ConfigurationProfile, pk=pk)
-        timestamp = datetime.datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
-        metadata = get_profile_metadata(profile, timestamp)
-        expiration_date = metadata['expires']
-        version = metadata['version']
-        device.pending.remove(profile)
-        device.installed.add(profile)
-        try:
-            record = InstallationRecord.objects.get(profile=profile, device=device, active=True)
-            record.version = version
-            record.expires = expiration_date
-            record.installed_on = timezone.now()
-        except InstallationRecord.DoesNotExist:
-            record = InstallationRecord.objects.create(profile=profile, device=device, version=version,
-                                                       expires=expiration_date, active=True)
-        record.save()
+        timestamp = datetime.datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%SZ') \
+            .replace(tzinfo=datetime.timezone.utc)
+        metadata = get_profile_metadata(profiles[pk], timestamp)
+        record = profile_records.get(pk)
+        if record is None:
+            record = InstallationRecord(profile=profiles[pk], device=device, active=True)
+            profile_records[pk] = record
+            new_records.append(record)
+        elif record.pk is not None:
+            record.installed_on = now
+            updated_records[record.pk] = record
+        record.version = metadata['version']
+        record.expires = metadata['expires']
     for pk in profiles_removed:
-        profile = get_object_or_404(ConfigurationProfile, pk=pk)
-        device.pending.remove(profile)
-        record = InstallationRecord.objects.get(profile=profile, device=device, active=True)
-        record.active = False
-        record.expires = timezone.now()
-        record.save()
-
-    installed = []
-    for item in apps:
-        if item in [None, '']:
-            continue
-        identifier = item.split('=')[0]
-        version = item.split('=')[1]
-        app = MacOSApp.objects.filter(name__iexact=identifier).first()
-        if app:
-            if app.merged_into is not None:
-                app = app.merged_into
-            if version not in [None, ''] and app.version is None:
-                app.version = version
-                app.save()
-            if app in MacOSApp.objects.filter(pending_install=device):
-                app.pending_install.remove(device)
-            if app not in MacOSApp.objects.filter(installed=device):
-                app.installed.add(device)
-                if version is None:
-                    version = app.version
-                InstallationRecord.objects.create(app=app, device=device, version=version)
-            elif InstallationRecord.objects.get(app=app, device=device, active=True).version != version:
-                record = InstallationRecord.objects.get(app=app, device=device, active=True)
-                record.active = False
-                record.expires = timezone.now()
-                record.save()
-                InstallationRecord.objects.create(app=app, device=device, version=version)
-        else:
+        record = profile_records.pop(pk, None)
+        if record is not None:
+            record.active = False
+            record.expires = now
+            if record.pk is not None:
+                updated_records[record.pk] = record
+
+    app_records = {}
+    for record in InstallationRecord.objects.filter(device=device, app__isnull=False, active=True).order_by('pk'):
+        app_records[record.app_id] = record
+    installed_apps = set(device.apps_installed.values_list('pk', flat=True))
+    pending_apps = set(device.apps_pending.values_list('pk', flat=True))
+    unassigned_apps = set()
+    reported = [item.split('=', 1) for item in data['apps'].split('#') if item not in [None, '']]
+    known_apps = {}
+    apps_by_pk = {}
+    for app in MacOSApp.objects.annotate(lower_name=Lower('name')).select_related('merged_into') \
+            .filter(lower_name__in=set(identifier.lower() for identifier, version in reported)):
+        known_apps.setdefault(app.lower_name, app)
+        apps_by_pk.setdefault(app.pk, app)
+
+    # Several reported names can resolve to the same app (through merged_into), so settle on one version per app
+    # before comparing against its installation record. The last version reported wins, unless it is blank.
+    updated_apps = {}
+    reported_versions = {}
+    for identifier, version in reported:
+        app = known_apps.get(identifier.lower())
+        if app is None:
+            # New apps are rare, so these are created one at a time to get their primary keys back on every backend
             if version not in [None, '']:
                 app = MacOSApp.objects.create(name=identifier, version=version)
             else:
                 app = MacOSApp.objects.create(name=identifier)
-            app.installed.add(device)
-            InstallationRecord.objects.create(app=app, device=device, version=app.version)
-        installed.append(app)
-
-    for app in MacOSApp.objects.filter(installed=device):
-        if app not in installed:
-            app.installed.remove(device)
-            record = InstallationRecord.objects.get(app=app, device=device, active=True)
+            known_apps[identifier.lower()] = app
+            apps_by_pk[app.pk] = app
+            version = app.version
+        elif app.merged_into is not None:
+            # Use the same instance for an app however it was reported so that changes to it are not lost
+            app = apps_by_pk.setdefault(app.merged_into_id, app.merged_into)
+        if app.pk not in reported_versions or version not in [None, '']:
+            reported_versions[app.pk] = version
+
+    added_apps = set()
+    seen_apps = set()
+    for pk, version in reported_versions.items():
+        app = apps_by_pk[pk]
+        if version not in [None, ''] and app.version is None:
+            app.version = version
+            updated_apps[app.pk] = app
+        if app.pk in pending_apps:
+            unassigned_apps.add(app.pk)
+        seen_apps.add(app.pk)
+
+        record = app_records.get(app.pk)
+        if app.pk in installed_apps and record is not None and record.version == version:
+            continue
+        if app.pk not in installed_apps:
+            installed_apps.add(app.pk)
+            added_apps.add(app.pk)
+        elif record is not None:
             record.active = False
-            record.expires = timezone.now()
-            record.save()
+            record.expires = now
+            if record.pk is not None:
+                updated_records[record.pk] = record
+        app_records[app.pk] = InstallationRecord(app=app, device=device, version=version)
+        new_records.append(app_records[app.pk])
+
+    removed_apps = installed_apps - seen_apps
+    for pk in removed_apps:
+        record = app_records.get(pk)
+        if record is not None:
+            record.active = False
+            record.expires = now
+            if record.pk is not None:
+                updated_records[record.pk] = record
+
+    # Apply all of the changes in bulk
+    device.pending.remove(*profiles.values())
+    device.installed.add(*[profiles[pk] for pk in profiles_installed])
+    MacOSApp.objects.bulk_update(updated_apps.values(), ['version'])
+    device.apps_pending.remove(*unassigned_apps)
+    device.apps_installed.add(*added_apps)
+    device.apps_installed.remove(*removed_apps)
+    InstallationRecord.objects.bulk_update(updated_records.values(), ['version', 'expires', 'installed_on', 'active'])
+    InstallationRecord.objects.bulk_create(new_records)
     return JsonResponse({'status': 200})
 
 
@@ -1016,52 +1063,99 @@ def merge_app(request, pk):
     return render(request, 'form_crispy.html', context)
 
 
+def parse_munki_catalog(data):
+    """
+    Pull the app details out of a Munki catalog
+
+    :param data: The parsed catalog plist (a list of pkginfo dictionaries)
+    :returns: List of dictionaries with the name, description, version and developer of each app
+    """
+    apps = []
+    for app_data in data:
+        app_name = app_data.get('display_name') or app_data.get('name')
+        if not app_name:
+            continue
+        app_description = app_data.get('description', None)
+        if app_description:
+            app_description = app_description.strip()
+        apps.append({"name": app_name, "description": app_description, "version": app_data.get('version', None),
+                     "developer": app_data.get('developer', None)})
+    return apps
+
+
+@transaction.atomic
+def sync_managed_software(apps):
+    """
+    Bring the app library in line with the Munki catalog. Apps in the catalog are marked as managed (and created if
+    they don't exist yet, or have their missing details filled in), and any other managed apps are no longer managed.
+
+    Apps are matched by name (ignoring case). Apps that have been merged into another app update that app instead.
+    Everything is worked out in memory from a single query and written back in bulk.
+
+    :param apps: List of app details, as returned by :func:`parse_munki_catalog`
+    :returns: Dictionary with the number of apps created, updated and unmanaged, and how long the sync took (seconds)
+    """
+    start = time.perf_counter()
+    existing = list(MacOSApp.objects.all())
+    apps_by_pk = {app.pk: app for app in existing}
+    apps_by_name = {}
+    for app in existing:
+        apps_by_name.setdefault(app.name.casefold(), app)
+
+    new_apps = []
+    updated_apps = {}
+    managed = set()
+    for details in apps:
+        key = details['name'].casefold()
+        obj = apps_by_name.get(key)
+        if obj is None:
+            obj = MacOSApp(name=details['name'], description=details['description'], version=details['version'],
+                           developer=details['developer'], managed=True)
+            apps_by_name[key] = obj
+            new_apps.append(obj)
+            continue
+        if obj.merged_into_id is not None:
+            obj = apps_by_pk[obj.merged_into_id]
+        changed = not obj.managed
+        obj.managed = True
+        for field in ('description', 'developer', 'version'):
+            if details[field] and not getattr(obj, field):
+                setattr(obj, field, details[field])
+                changed = True
+        if obj.pk is not None:
+            managed.add(obj.pk)
+            if changed:
+                updated_apps[obj.pk] = obj
+
+    # Check for old managed apps that are no longer in the catalog
+    unmanaged = [app for app in existing if app.managed and app.pk not in managed]
+    for app in unmanaged:
+        app.managed = False
+
+    MacOSApp.objects.bulk_create(new_apps)
+    MacOSApp.objects.bulk_update(list(updated_apps.values()) + unmanaged,
+                                 ['managed', 'description', 'developer', 'version'])
+
+    stats = {'created': len(new_apps), 'updated': len(updated_apps), 'unmanaged': len(unmanaged),
+             'seconds': time.perf_counter() - start}
+    logger.info("Synced managed software with Munki: %(created)d created, %(updated)d updated, %(unmanaged)d no "
+                "longer managed in %(seconds).3fs", stats)
+    return stats
+
+
 def refresh_managed_software_status():
-    """ Checks the Munki catalogs to retrieve the latest managed software lists """
+    """
+    Checks the Munki catalogs to retrieve the latest managed software lists
+
+    :returns: Sync results (see :func:`sync_managed_software`), or `None` if there is no catalog
+    """
 
     try:
         with open(settings.MEDIA_ROOT + '/software/catalogs/default', 'rb') as catalog:
             data = plistlib.load(catalog)
-
-            apps = []
-
-            # Grab app data from plist
-            for app_data in data:
-                app_name = app_data.get('display_name', None)
-                app_description = app_data.get('description', None)
-                app_version = app_data.get('version', None)
-                app_developer = app_data.get('developer', None)
-                apps.append({"name": app_name, "description": app_description.strip(), "version": app_version,
-                             "developer": app_developer})
-
-            # Update database
-            managed_apps = []
-            for app in apps:
-                obj = MacOSApp.objects.filter(name__iexact=app['name']).first()
-                if obj:
-                    if obj.merged_into is not None:
-                        obj = obj.merged_into
-                    obj.managed = True
-                    managed_apps.append(obj)
-                    if app['description'] and not obj.description:
-                        obj.description = app['description']
-                    if app['developer'] and not obj.developer:
-                        obj.developer = app['developer']
-                    if app['version'] and not obj.version:
-                        obj.version = app['version']
-                    obj.save()
-                else:
-                    obj = MacOSApp.objects.create(name=app['name'], description=app['description'],
-                                                  version=app['version'], developer=app['developer'], managed=True)
-                    managed_apps.append(obj)
-
-            # Check for old managed apps that are no longer in the catalog
-            for app in MacOSApp.objects.filter(managed=True).all():
-                if app not in managed_apps:
-                    app.managed = False
-                    app.save()
     except FileNotFoundError:
-        pass
+        return None
+    return sync_managed_software(parse_munki_catalog(data))
 
 
 @login_required
@@ -1289,12 +1383,30 @@ def remove_app(request, app, device=0):
 @login_required
 @permission_required('devices.manage_mdm', raise_exception=True)
 def logs(request):
-    """Displays logs detailing what was installed on what devices and when"""
-    def get_timestamp(data):
-        return data.get('timestamp')
-
+    """
+    Displays logs detailing what was installed on what devices and when. Can be filtered by device, app or profile
+    (by primary key) using query parameters.
+    """
+    records = InstallationRecord.objects.all()
+    for field in ('device', 'app', 'profile'):
+        if request.GET.get(field, '').isdigit():
+            records = records.filter(**{field: request.GET[field]})
+
+    # Every record was installed at some point and inactive records were removed later, so the log is the union of
+    # both. Sorting and pagination happen in the database; only the records on the current page are loaded.
+    installs = records.annotate(timestamp=F('installed_on'), removal=Value(False, output_field=BooleanField())) \
+        .values('id', 'timestamp', 'removal')
+    removals = records.filter(active=False, expires__isnull=False) \
+        .annotate(timestamp=F('expires'), removal=Value(True, output_field=BooleanField())) \
+        .values('id', 'timestamp', 'removal')
+    paginator = Paginator(installs.union(removals, all=True).order_by('-timestamp', '-id'), 50)
+    current_page = paginator.get_page(request.GET.get('page', 1))
+
+    on_page = InstallationRecord.objects.select_related('profile', 'app', 'device') \
+        .in_bulk([row['id'] for row in current_page.object_list])
     events = []
-    for record in InstallationRecord.objects.all():
+    for row in current_page.object_list:
+        record = on_page[row['id']]
         if record.profile:
             resource = record.profile
             resource_type = "(Configuration Profile) "
@@ -1304,21 +1416,12 @@ def logs(request):
                 resource_type = "(" + record.version + ") "
             else:
                 resource_type = ""
-        if record.active:
-            obj = {'timestamp': record.installed_on,
-                   'details': resource.name + " " + resource_type + "was installed on " + record.device.name}
-            events.append(obj)
+        if row['removal']:
+            details = resource.name + " " + resource_type + "was removed from " + record.device.name
         else:
-            obj = {'timestamp': record.expires,
-                   'details': resource.name + " " + resource_type + "was removed from " + record.device.name}
-            events.append(obj)
-            obj = {'timestamp': record.installed_on,
-                   'details': resource.name + " " + resource_type + "was installed on " + record.device.name}
-            events.append(obj)
-    events.sort(key=get_timestamp, reverse=True)
-
-    paginator = Paginator(events, 50)
-    page_number = request.GET.get('page', 1)
-    current_page = paginator.get_page(page_number)
+            details = resource.name + " " + resource_type + "was installed on " + record.device.name
+        events.append({'timestamp': row['timestamp'], 'details': details})
+    current_page.object_list = events
+
     context = {'headers': ['Timestamp', 'Event'], 'title': 'Install Log', 'events': current_page}
     return render(request, 'access_log.html', context)
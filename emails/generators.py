@@ -1,14 +1,24 @@
+import base64
 import datetime
+import logging
+import time
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.message import Message
 
 from six import string_types
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.core.mail.message import MIMEMixin
 from django.template.loader import render_to_string
 from django.urls.base import reverse
 from django.utils import timezone
 
+from data.decorators import process_in_thread
 from events.models import Event, Category, Service, ServiceInstance
 
+logger = logging.getLogger(__name__)
+
 EMAIL_KEY_START_END = settings.EMAIL_KEY_START_END
 EMAIL_TARGET_START_END = settings.EMAIL_TARGET_START_END
 DEFAULT_TO_ADDR = settings.DEFAULT_TO_ADDR
@@ -26,12 +36,81 @@ def send_survey_if_necessary(event):
         return
     email = SurveyEmailGenerator(event=event, subject='Post-event survey for {}'.format(event.event_name),
                                  to_emails=event.contact.email)
-    email.send()
+    queue_batch([email])
     # set_revision_comment('Post-event survey sent.')
     event.survey_sent = True
     event.save()
 
 
+def send_batch(emails, connection=None, fail_silently=False):
+    """
+    Send several emails over a single SMTP connection
+
+    :param emails: Email generators or EmailMessage objects
+    :param connection: Open mail connection to reuse [Optional]
+    :param fail_silently: If False, the first failure is raised once the rest of the batch has been sent
+    :return: Tuple of the number of emails sent and a list of (email, exception) tuples for the ones that failed
+    """
+    messages = [getattr(email, 'email', email) for email in emails]
+    if not messages:
+        return 0, []
+    started = time.monotonic()
+    sent = 0
+    failed = []
+    connection = connection or get_connection(fail_silently=fail_silently)
+    with connection:
+        for message in messages:
+            try:
+                sent += connection.send_messages([message]) or 0
+            except Exception as e:
+                failed.append((message, e))
+    logger.info("Sent %d of %d emails in %.2fs", sent, len(messages), time.monotonic() - started)
+    for message, e in failed:
+        logger.error("Failed to send '%s' to %s: %s", message.subject, ', '.join(message.recipients()), e)
+    if failed and not fail_silently:
+        raise failed[0][1]
+    return sent, failed
+
+
+class PreparedMIMEMessage(MIMEMixin, Message):
+    pass
+
+
+class PreparedEmailMessage(EmailMessage):
+    """ Email that has already been rendered to MIME, so that it can be sent from the task queue """
+    def __init__(self, from_email, recipients, mime):
+        self.mime = mime
+        subject = str(make_header(decode_header(self.message()['Subject'] or '')))
+        super(PreparedEmailMessage, self).__init__(subject=subject, from_email=from_email)
+        self.to_recipients = recipients
+
+    def recipients(self):
+        return self.to_recipients
+
+    def message(self):
+        return message_from_bytes(self.mime, _class=PreparedMIMEMessage)
+
+
+def queue_batch(emails):
+    """
+    Send several emails in the background, over a single SMTP connection. The emails are rendered right away.
+
+    :param emails: Email generators or EmailMessage objects
+    """
+    messages = [getattr(email, 'email', email) for email in emails]
+    prepared = [{'from_email': message.from_email, 'recipients': message.recipients(),
+                 'mime': base64.b64encode(message.message().as_bytes()).decode('ascii')}
+                for message in messages if message.recipients()]
+    if prepared:
+        _send_prepared(prepared)
+
+
+@process_in_thread
+def _send_prepared(prepared):
+    messages = [PreparedEmailMessage(p['from_email'], p['recipients'], base64.b64decode(p['mime'])) for p in prepared]
+    send_batch(messages)
+
+
 def generate_web_service_email(details):
     """
     Generate a generic email message with the Webmaster listed as the reply address
@@ -303,7 +382,9 @@ class DefaultLNLEmailGenerator(object):  # yay classes
             content_html = render_to_string(template_html, context)
             self.email.attach_alternative(content_html, "text/html")
 
-    def send(self):
+    def send(self, connection=None):
+        if connection is not None:
+            self.email.connection = connection
         self.email.send()
 
 
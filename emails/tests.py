@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 from data.tests.util import ViewTestCase
 from django.urls.base import reverse
+from django.core import mail
 from django.core.management import call_command
 from django.contrib.auth.models import Permission, Group
 from django.utils import timezone
@@ -242,3 +243,16 @@ class EmailTestCase(ViewTestCase):
 
         # Try with strike email
         self.assertIsNone(generators.generate_event_start_end_emails())
+
+    def test_send_batch(self):
+        emails = [generators.GenericEmailGenerator(subject="Batch %d" % i, to_emails="user%d@wpi.edu" % i, body="Hi")
+                  for i in range(3)]
+        self.assertEqual(generators.send_batch(emails), (3, []))
+        self.assertEqual([m.subject for m in mail.outbox], ["Batch 0", "Batch 1", "Batch 2"])
+
+        # Queued emails are rendered right away and sent later (immediately while testing)
+        mail.outbox = []
+        generators.queue_batch(emails)
+        self.assertEqual([m.subject for m in mail.outbox], ["Batch 0", "Batch 1", "Batch 2"])
+        self.assertEqual(mail.outbox[1].recipients(), ["user1@wpi.edu"])
+        self.assertIn("Hi", mail.outbox[1].message().as_string())
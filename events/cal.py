@@ -1,18 +1,19 @@
+import hashlib
 import json
 import icalendar
 from time import mktime
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Count, F, Q
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.template.defaultfilters import slugify
 from django.urls.base import reverse
 from django.utils import timezone
 import datetime
-from django.utils.decorators import method_decorator
 from django.utils.html import conditional_escape
+from django.utils.http import parse_etags, quote_etag
 from django.views.generic.base import View
-from django.views.decorators.cache import cache_page
 from django_ical.views import ICalFeed
 from django.utils.timezone import localtime
 
@@ -24,17 +25,155 @@ from helpers.mixins import HasPermMixin
 from six import string_types
 
 
+def fragment_cache_key(kind, pk):
+    """ Cache key for the rendered VEVENT of a calendar item (kind is one of the FRAGMENT_SOURCES keys) """
+    return 'cal:vevent:%s:%s' % (kind, pk)
+
+
+def invalidate_cal_fragments(kind, pks):
+    """ Removes the cached VEVENTs for the given items so that they are rendered again on the next feed request """
+    cache.delete_many([fragment_cache_key(kind, pk) for pk in pks])
+
+
+def invalidate_event_cal_fragments(event_ids):
+    """ Removes the cached VEVENTs for events along with those of their occurrences (which include event details) """
+    event_ids = list(event_ids)
+    invalidate_cal_fragments('event', event_ids)
+    invalidate_cal_fragments('eventoccurrence', EventOccurrence.objects.filter(event__in=event_ids)
+                             .values_list('pk', flat=True))
+
+
+def _load_events(pks):
+    return BaseEvent.objects.non_polymorphic().filter(pk__in=pks).select_related('location') \
+        .prefetch_related('org', 'ccinstances__crew_chief', 'ccinstances__service', 'ccinstances__category')
+
+
+def _load_occurrences(pks):
+    return EventOccurrence.objects.filter(pk__in=pks).select_related('event__location') \
+        .prefetch_related('event__org', 'event__ccinstances__crew_chief', 'event__ccinstances__service',
+                          'event__ccinstances__category')
+
+
+def _load_meetings(pks):
+    return Meeting.objects.filter(pk__in=pks).select_related('meeting_type', 'location')
+
+
+# Calendar item types, mapped to the model they come from and a function that loads everything needed to render them
+FRAGMENT_SOURCES = {
+    'event': (BaseEvent, _load_events),
+    'eventoccurrence': (EventOccurrence, _load_occurrences),
+    'mtg': (Meeting, _load_meetings),
+}
+
+# Fields holding the start and end times of each kind of calendar item
+FEED_WINDOW_FIELDS = {
+    'event': ('datetime_start', 'datetime_end'),
+    'eventoccurrence': ('start', 'end'),
+    'mtg': ('datetime', 'datetime'),
+}
+
+
 class BaseFeed(ICalFeed):
     """
     A simple event calender
+
+    Each item is rendered once into a VEVENT that is kept in the cache until the item changes (see events.signals) or
+    CAL_FRAGMENT_CACHE_TTL passes, and feeds are put together from those fragments. Since the output only changes when
+    an item does, clients can poll with If-None-Match and receive a 304.
+
+    Only items within a window around the current time are included. Clients can adjust it with the "past" and
+    "future" query parameters (in days).
     """
     product_id = '-//' + settings.ALLOWED_HOSTS[0] + ' //LNLDB//EN'
     timezone = 'UTC'
     file_name = "event.ics"
 
-    @method_decorator(cache_page(15 * 60))
-    def __call__(self, *args, **kwargs):
-        return super(BaseFeed, self).__call__(*args, **kwargs)
+    def __call__(self, request, *args, **kwargs):
+        content = self.render_feed(*self.get_window(request))
+        etag = quote_etag(hashlib.md5(content).hexdigest())
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=self.feed_type.mime_type)
+            response['Content-Disposition'] = 'attachment; filename="%s"' % self.file_name
+        response['ETag'] = etag
+        return response
+
+    def get_window(self, request=None):
+        """ Start and end of the time window to include in the feed, based on the request's query parameters """
+        def days(name, default):
+            try:
+                value = int(request.GET[name])
+            except (AttributeError, KeyError, ValueError):
+                return default
+            return min(max(value, 0), settings.CAL_FEED_MAX_DAYS)
+
+        now = timezone.now()
+        return (now - datetime.timedelta(days=days('past', settings.CAL_FEED_PAST_DAYS)),
+                now + datetime.timedelta(days=days('future', settings.CAL_FEED_FUTURE_DAYS)))
+
+    def item_querysets(self):
+        """ List of (kind, queryset) pairs, in the order they should appear in the feed """
+        raise NotImplementedError
+
+    def windowed_querysets(self, start, end):
+        """ item_querysets(), limited to the items that overlap the given window """
+        querysets = []
+        for kind, queryset in self.item_querysets():
+            start_field, end_field = FEED_WINDOW_FIELDS[kind]
+            querysets.append((kind, queryset.filter(**{end_field + '__gte': start, start_field + '__lte': end})))
+        return querysets
+
+    def items(self):
+        items = []
+        for kind, queryset in self.windowed_querysets(*self.get_window()):
+            items += list(queryset)
+        return items
+
+    def render_feed(self, start, end):
+        """ Assembles the feed from cached VEVENTs, rendering only the ones that are missing """
+        keys = []
+        for kind, queryset in self.windowed_querysets(start, end):
+            keys += [(kind, pk) for pk in queryset.values_list('pk', flat=True)]
+        fragments = cache.get_many([fragment_cache_key(kind, pk) for kind, pk in keys])
+
+        missing = {}
+        for kind, pk in keys:
+            if fragment_cache_key(kind, pk) not in fragments:
+                missing.setdefault(kind, []).append(pk)
+        rendered = {}
+        for kind, pks in missing.items():
+            for item in FRAGMENT_SOURCES[kind][1](pks):
+                rendered[fragment_cache_key(kind, item.pk)] = self.render_item(item)
+        cache.set_many(rendered, settings.CAL_FRAGMENT_CACHE_TTL)
+        fragments.update(rendered)
+
+        cal = icalendar.Calendar()
+        cal.add('version', '2.0')
+        cal.add('calscale', 'GREGORIAN')
+        cal.add('prodid', self.product_id)
+        cal.add('method', self.method(None))
+        cal.add('x-wr-timezone', self.timezone)
+        footer = b'END:VCALENDAR\r\n'
+        header = cal.to_ical()[:-len(footer)]
+        body = [fragments[fragment_cache_key(kind, pk)] for kind, pk in keys
+                if fragment_cache_key(kind, pk) in fragments]
+        return header + b''.join(body) + footer
+
+    def render_item(self, item):
+        """ Renders a single calendar item into a VEVENT block """
+        feed = self.feed_type(title='', link='', description='')
+        feed.add_item(
+            title=self.item_title(item),
+            link=self.item_link(item),
+            description=self.item_description(item),
+            unique_id=self.item_guid(item),
+            categories=None,
+            **self.item_extra_kwargs(item)
+        )
+        cal = icalendar.Calendar()
+        feed.write_items(cal)
+        return cal.subcomponents[0].to_ical()
 
     def item_title(self, item):
         return item.cal_name()
@@ -62,51 +201,57 @@ class BaseFeed(ICalFeed):
 
 
 class EventFeed(BaseFeed):
-    def items(self):
-        return list(BaseEvent.objects.filter(approved=True)\
-            .exclude(
-                Q(closed=True) |
-                Q(cancelled=True) |
-                Q(test_event=True) |
-                Q(sensitive=True)
-            ).order_by('datetime_start').all()) + \
-            list(EventOccurrence.objects.filter(display_on_cal=True, event__approved=True)\
-            .exclude(
-                Q(event__closed=True) |
-                Q(event__cancelled=True) |
-                Q(event__test_event=True) |
-                Q(event__sensitive=True)
-            ).order_by('start').all()) + \
-            list(Meeting.objects.order_by('datetime').all())
+    def item_querysets(self):
+        return [
+            ('event', BaseEvent.objects.filter(approved=True)
+                .exclude(
+                    Q(closed=True) |
+                    Q(cancelled=True) |
+                    Q(test_event=True) |
+                    Q(sensitive=True)
+                ).order_by('datetime_start')),
+            ('eventoccurrence', EventOccurrence.objects.filter(display_on_cal=True, event__approved=True)
+                .exclude(
+                    Q(event__closed=True) |
+                    Q(event__cancelled=True) |
+                    Q(event__test_event=True) |
+                    Q(event__sensitive=True)
+                ).order_by('start')),
+            ('mtg', Meeting.objects.order_by('datetime')),
+        ]
 
 
 class FullEventFeed(BaseFeed):
-    def items(self):
-        return list(BaseEvent.objects.exclude(
+    def item_querysets(self):
+        return [
+            ('event', BaseEvent.objects.exclude(
                 Q(closed=True) |
                 Q(cancelled=True) |
                 Q(test_event=True) |
                 Q(sensitive=True)
-            ).order_by('datetime_start').all()) + \
-            list(EventOccurrence.objects.filter(display_on_cal=True).exclude(\
+            ).order_by('datetime_start')),
+            ('eventoccurrence', EventOccurrence.objects.filter(display_on_cal=True).exclude(
                 Q(event__closed=True) |
                 Q(event__cancelled=True) |
                 Q(event__test_event=True) |
                 Q(event__sensitive=True)
-            ).order_by('start').all()) + \
-            list(Meeting.objects.order_by('datetime').all())
+            ).order_by('start')),
+            ('mtg', Meeting.objects.order_by('datetime')),
+        ]
 
 
 class LightEventFeed(BaseFeed):
-    def items(self):
-        return list(BaseEvent.objects.filter(approved=True)\
-            .exclude(
-                Q(closed=True) |
-                Q(cancelled=True) |
-                Q(test_event=True) |
-                Q(sensitive=True)
-            ).order_by('datetime_start').all()) + \
-            list(Meeting.objects.order_by('datetime').all())
+    def item_querysets(self):
+        return [
+            ('event', BaseEvent.objects.filter(approved=True)
+                .exclude(
+                    Q(closed=True) |
+                    Q(cancelled=True) |
+                    Q(test_event=True) |
+                    Q(sensitive=True)
+                ).order_by('datetime_start')),
+            ('mtg', Meeting.objects.order_by('datetime')),
+        ]
 
 
 class BaseCalJsonView(HasPermMixin, View):
@@ -193,7 +338,7 @@ class UnbilledCalJsonView(BaseCalJsonView):
     def get(self, request, *args, **kwargs):
         queryset = BaseEvent.objects.filter(closed=False) \
             .filter(reviewed=True) \
-            .filter(billings__isnull=True, multibillings__isnull=True) \
+            .filter(billing_status='unbilled') \
             .filter(billed_in_bulk=False) \
             .distinct()
         return super(UnbilledCalJsonView, self).get(request, queryset)
@@ -205,7 +350,7 @@ class UnbilledSemesterCalJsonView(BaseCalJsonView):
     def get(self, request, *args, **kwargs):
         queryset = BaseEvent.objects.filter(closed=False) \
             .filter(reviewed=True) \
-            .filter(billings__isnull=True, multibillings__isnull=True) \
+            .filter(billing_status='unbilled') \
             .filter(billed_in_bulk=True) \
             .order_by('datetime_start') \
             .distinct()
@@ -217,7 +362,7 @@ class PaidCalJsonView(BaseCalJsonView):
 
     def get(self, request, *args, **kwargs):
         queryset = BaseEvent.objects.filter(closed=False) \
-            .filter(Q(billings__date_paid__isnull=False) | Q(multibillings__date_paid__isnull=False)) \
+            .filter(billing_status='paid') \
             .distinct()
         return super(PaidCalJsonView, self).get(request, queryset)
 
@@ -226,11 +371,8 @@ class UnpaidCalJsonView(BaseCalJsonView):
     perms = ['events.bill_event']
 
     def get(self, request, *args, **kwargs):
-        queryset = BaseEvent.objects.annotate(
-            numpaid=Count('billings__date_paid')+Count('multibillings__date_paid')) \
-            .filter(closed=False) \
-            .filter(Q(billings__date_billed__isnull=False) | Q(multibillings__date_billed__isnull=False)) \
-            .exclude(numpaid__gt=0) \
+        queryset = BaseEvent.objects.filter(closed=False) \
+            .filter(billing_status='unpaid') \
             .filter(reviewed=True) \
             .distinct()
         return super(UnpaidCalJsonView, self).get(request, queryset)
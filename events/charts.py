@@ -1,11 +1,63 @@
 import datetime
 
-from django.db.models import Avg, Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
 from django.utils import timezone
 from jchart import Chart
 from jchart.config import Axes, DataSet
 
-from events.models import BaseEvent
+from events.models import BaseEvent, PostEventSurvey
+
+SURVEY_FIELDS = ('services_quality', 'lighting_quality', 'sound_quality', 'work_order_experience', 'work_order_ease',
+                 'communication_responsiveness', 'pricelist_ux', 'setup_on_time', 'crew_respectfulness',
+                 'price_appropriate', 'customer_would_return')
+
+SURVEY_RESULTS_CACHE_KEY = 'survey_dashboard:results'
+
+
+def survey_results(events):
+    """
+    Per-event averages and response counts for every survey question, computed in a single grouped query
+
+    Answers below zero (i.e. "N/A") are left out. Returns a dictionary of event ids to dictionaries with
+    "<field>__avg" and "<field>__count" entries for each field in SURVEY_FIELDS.
+    """
+    aggregates = {}
+    for field in SURVEY_FIELDS:
+        answered = Q(**{field + '__gte': 0})
+        aggregates[field + '__avg'] = Avg(field, filter=answered)
+        aggregates[field + '__count'] = Count(field, filter=answered)
+    rows = PostEventSurvey.objects.filter(event__in=events).order_by().values('event').annotate(**aggregates)
+    return {row.pop('event'): row for row in rows}
+
+
+def recent_survey_results():
+    """
+    Survey results for approved events that ended in the past year, as a list of (event, results) tuples, newest
+    first. Cached for SURVEY_DASHBOARD_CACHE_TTL seconds.
+    """
+    results = cache.get(SURVEY_RESULTS_CACHE_KEY)
+    if results is None:
+        now = timezone.now()
+        year_ago = now - datetime.timedelta(days=365)
+        events = BaseEvent.objects.non_polymorphic() \
+            .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
+            .filter(surveys__isnull=False) \
+            .distinct()
+        by_event = survey_results(events)
+        results = [(event, by_event[event.pk]) for event in events.only('event_name', 'datetime_start')
+                   .order_by('-datetime_start', '-pk')]
+        if settings.SURVEY_DASHBOARD_CACHE_TTL:
+            cache.set(SURVEY_RESULTS_CACHE_KEY, results, settings.SURVEY_DASHBOARD_CACHE_TTL)
+    return results
+
+
+def survey_data(field):
+    """ Chart data points of the average response to a survey question for each recent event """
+    return [{'x': event.datetime_start.isoformat(), 'y': data[field + '__avg']}
+            for event, data in recent_survey_results() if data[field + '__avg'] is not None]
+
 
 class SurveyVpChart(Chart):
     chart_type = 'line'
@@ -15,22 +67,10 @@ class SurveyVpChart(Chart):
     }
 
     def get_datasets(self, *args, **kwargs):
-        now = timezone.now()
-        year_ago = now - datetime.timedelta(days=365)
-        events = BaseEvent.objects \
-            .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
-            .filter(surveys__isnull=False) \
-            .distinct()
-        data_communication_responsiveness = []
-        for event in events:
-            data = event.surveys.aggregate(
-                Avg('communication_responsiveness'),
-            )
-            if data['communication_responsiveness__avg'] >= 0:
-                data_communication_responsiveness.append({'x': event.datetime_start.isoformat(), 'y': data['communication_responsiveness__avg']})
         options = {'type': 'line', 'fill': False, 'lineTension': 0}
         return [
-            DataSet(label='Communication responsiveness', data=data_communication_responsiveness, color=(193, 37, 82), **options),
+            DataSet(label='Communication responsiveness', data=survey_data('communication_responsiveness'),
+                    color=(193, 37, 82), **options),
         ]
 
 
@@ -42,43 +82,13 @@ class SurveyCrewChart(Chart):
     }
 
     def get_datasets(self, *args, **kwargs):
-        now = timezone.now()
-        year_ago = now - datetime.timedelta(days=365)
-        events = BaseEvent.objects \
-            .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
-            .filter(surveys__isnull=False) \
-            .distinct()
-        data_lighting_quality = []
-        data_sound_quality = []
-        data_setup_on_time = []
-        data_crew_respectfulness = []
-        data_crew_preparedness = []
-        data_crew_knowledgeability = []
-        for event in events:
-            data = event.surveys.aggregate(
-                Avg('lighting_quality'),
-                Avg('sound_quality'),
-                Avg('setup_on_time'),
-                Avg('crew_respectfulness'),
-                # Avg('crew_preparedness'),
-                # Avg('crew_knowledgeability'),
-            )
-            if data['lighting_quality__avg'] >= 0:
-                data_lighting_quality.append({'x': event.datetime_start.isoformat(), 'y': data['lighting_quality__avg']})
-            if data['sound_quality__avg'] >= 0:
-                data_sound_quality.append({'x': event.datetime_start.isoformat(), 'y': data['sound_quality__avg']})
-            if data['setup_on_time__avg'] >= 0:
-                data_setup_on_time.append({'x': event.datetime_start.isoformat(), 'y': data['setup_on_time__avg']})
-            if data['crew_respectfulness__avg'] >= 0:
-                data_crew_respectfulness.append({'x': event.datetime_start.isoformat(), 'y': data['crew_respectfulness__avg']})
-            # data_crew_preparedness.append({'x': event.datetime_start.isoformat(), 'y': data['crew_preparedness__avg']})
-            # data_crew_knowledgeability.append({'x': event.datetime_start.isoformat(), 'y': data['crew_knowledgeability__avg']})
         options = {'type': 'line', 'fill': False, 'lineTension': 0}
         return [
-            DataSet(label='Lighting quality', data=data_lighting_quality, color=(193, 37, 82), **options),
-            DataSet(label='Sound quality', data=data_sound_quality, color=(255, 102, 0), **options),
-            DataSet(label='Setup on time', data=data_setup_on_time, color=(245, 199, 0), **options),
-            DataSet(label='Crew was helpful', data=data_crew_respectfulness, color=(106, 150, 31), **options),
+            DataSet(label='Lighting quality', data=survey_data('lighting_quality'), color=(193, 37, 82), **options),
+            DataSet(label='Sound quality', data=survey_data('sound_quality'), color=(255, 102, 0), **options),
+            DataSet(label='Setup on time', data=survey_data('setup_on_time'), color=(245, 199, 0), **options),
+            DataSet(label='Crew was helpful', data=survey_data('crew_respectfulness'), color=(106, 150, 31),
+                    **options),
             # DataSet(label='Crew preparedness', data=data_crew_preparedness, color=(0, 133, 53), **options),
             # DataSet(label='Crew knowledgeability', data=data_crew_knowledgeability, color=(110, 45, 214), **options),
         ]
@@ -92,31 +102,11 @@ class SurveyPricelistChart(Chart):
     }
 
     def get_datasets(self, *args, **kwargs):
-        now = timezone.now()
-        year_ago = now - datetime.timedelta(days=365)
-        events = BaseEvent.objects \
-            .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
-            .filter(surveys__isnull=False) \
-            .distinct()
-        data_pricelist_ux = []
-        data_quote_as_expected = []
-        data_price_appropriate = []
-        for event in events:
-            data = event.surveys.aggregate(
-                Avg('pricelist_ux'),
-                # Avg('quote_as_expected'),
-                Avg('price_appropriate'),
-            )
-            if data['pricelist_ux__avg'] >= 0:
-                data_pricelist_ux.append({'x': event.datetime_start.isoformat(), 'y': data['pricelist_ux__avg']})
-            # data_quote_as_expected.append({'x': event.datetime_start.isoformat(), 'y': data['quote_as_expected__avg']})
-            if data['price_appropriate__avg'] >= 0:
-                data_price_appropriate.append({'x': event.datetime_start.isoformat(), 'y': data['price_appropriate__avg']})
         options = {'type': 'line', 'fill': False, 'lineTension': 0}
         return [
-            DataSet(label='Pricelist UX', data=data_pricelist_ux, color=(193, 37, 82), **options),
+            DataSet(label='Pricelist UX', data=survey_data('pricelist_ux'), color=(193, 37, 82), **options),
             # DataSet(label='Quote as expected', data=data_quote_as_expected, color=(245, 199, 0), **options),
-            DataSet(label='Price appropriate', data=data_price_appropriate, color=(0, 133, 53), **options),
+            DataSet(label='Price appropriate', data=survey_data('price_appropriate'), color=(0, 133, 53), **options),
         ]
 
 
@@ -128,25 +118,9 @@ class SurveyLnlChart(Chart):
     }
 
     def get_datasets(self, *args, **kwargs):
-        now = timezone.now()
-        year_ago = now - datetime.timedelta(days=365)
-        events = BaseEvent.objects \
-            .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
-            .filter(surveys__isnull=False) \
-            .distinct()
-        data_services_quality = []
-        data_customer_would_return = []
-        for event in events:
-            data = event.surveys.aggregate(
-                Avg('services_quality'),
-                Avg('customer_would_return'),
-            )
-            if data['services_quality__avg'] >= 0:
-                data_services_quality.append({'x': event.datetime_start.isoformat(), 'y': data['services_quality__avg']})
-            if data['customer_would_return__avg'] >= 0:
-                data_customer_would_return.append({'x': event.datetime_start.isoformat(), 'y': data['customer_would_return__avg']})
         options = {'type': 'line', 'fill': False, 'lineTension': 0}
         return [
-            DataSet(label='Services quality', data=data_services_quality, color=(193, 37, 82), **options),
-            DataSet(label='Customer would return', data=data_customer_would_return, color=(106, 150, 31), **options),
+            DataSet(label='Services quality', data=survey_data('services_quality'), color=(193, 37, 82), **options),
+            DataSet(label='Customer would return', data=survey_data('customer_would_return'), color=(106, 150, 31),
+                    **options),
         ]
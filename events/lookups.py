@@ -3,6 +3,9 @@ from django.db.models import Q
 from django.utils.html import escape
 
 from events.models import Organization
+from helpers.typeahead import TypeaheadIndex
+
+org_index = TypeaheadIndex(Organization, ('name', 'shortname'))
 
 
 class OrgLookup(LookupChannel):
@@ -12,8 +15,7 @@ class OrgLookup(LookupChannel):
         return request.user.is_authenticated
 
     def get_query(self, q, request):
-        return Organization.objects.filter(Q(name__icontains=q) | Q(shortname__icontains=q)).filter(archived=False)\
-            .distinct()
+        return org_index.filter(Organization.objects.filter(archived=False), q)
 
     def get_result(self, obj):
         return obj.name
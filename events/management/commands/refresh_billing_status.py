@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...models import BaseEvent
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the stored billing status of every event from its bills and multibills"
+
+    def handle(self, *args, **options):
+        num_updated = BaseEvent.objects.all().refresh_billing_status()
+        self.stdout.write("%d events updated." % num_updated)
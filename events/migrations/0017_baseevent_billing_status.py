@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Case, Exists, OuterRef, Value, When
+
+
+def populate_billing_status(apps, schema_editor):
+    BaseEvent = apps.get_model('events', 'BaseEvent')
+    Billing = apps.get_model('events', 'Billing')
+    MultiBilling = apps.get_model('events', 'MultiBilling')
+
+    paid = Exists(Billing.objects.filter(event=OuterRef('pk'), date_paid__isnull=False)) | \
+        Exists(MultiBilling.objects.filter(events=OuterRef('pk'), date_paid__isnull=False))
+    billed = Exists(Billing.objects.filter(event=OuterRef('pk'))) | \
+        Exists(MultiBilling.objects.filter(events=OuterRef('pk')))
+    BaseEvent.objects.update(billing_status=Case(When(paid, then=Value('paid')), When(billed, then=Value('unpaid')),
+                                                 default=Value('unbilled')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0016_pricelist_default_pricelist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='baseevent',
+            name='billing_status',
+            field=models.CharField(choices=[('unbilled', 'Not billed'), ('unpaid', 'Awaiting payment'), ('paid', 'Paid')], db_index=True, default='unbilled', editable=False, max_length=8),
+        ),
+        migrations.RunPython(populate_billing_status, migrations.RunPython.noop),
+    ]
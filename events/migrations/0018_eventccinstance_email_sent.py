@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0017_baseevent_billing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventccinstance',
+            name='email_sent',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
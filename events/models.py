@@ -9,12 +9,13 @@ from django.conf import settings
 # Create your models here.
 from django.core.validators import MinLengthValidator
 from django.db import models, transaction
-from django.db.models import Count, Sum
+from django.db.models import Case, Count, Exists, OuterRef, Sum, Value, When
 from django.urls.base import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 from six import python_2_unicode_compatible
 from polymorphic.models import PolymorphicManager, PolymorphicModel
+from polymorphic.query import PolymorphicQuerySet
 import reversion
 
 # if settings unset, have sane defaults
@@ -47,6 +48,12 @@ EXCELLENCE_CHOICES = (
     (4, 'Excellent'),
 )
 
+BILLING_STATUSES = (
+    ('unbilled', 'Not billed'),
+    ('unpaid', 'Awaiting payment'),
+    ('paid', 'Paid'),
+)
+
 
 def get_host():
     out = ''
@@ -227,6 +234,61 @@ class OptimizedEventManager(PolymorphicManager):
                                                  .select_related('projection')
 
 
+class BaseEventQuerySet(PolymorphicQuerySet):
+    """ Event queryset that can compute the costs of the events it returns in bulk """
+
+    def __init__(self, *args, **kwargs):
+        super(BaseEventQuerySet, self).__init__(*args, **kwargs)
+        self._with_costs = False
+
+    def _clone(self, *args, **kwargs):
+        new = super(BaseEventQuerySet, self)._clone(*args, **kwargs)
+        new._with_costs = self._with_costs
+        return new
+
+    def with_costs(self):
+        """
+        Attach a cost breakdown to every Event2019 in the results when they are fetched. Costs for the whole result set
+        are loaded in a fixed number of queries instead of several queries per event.
+        """
+        clone = self._chain()
+        clone._with_costs = True
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(BaseEventQuerySet, self)._fetch_all()
+        if self._with_costs and not fetched:
+            EventCosts.attach(self._result_cache)
+
+    def refresh_billing_status(self):
+        """
+        Recalculate the stored billing status of every event in the queryset from its bills and multibills
+
+        :returns: Number of events updated
+        """
+        return self.update(billing_status=billing_status_expression())
+
+
+def billing_status_expression():
+    """ Expression that calculates an event's billing status from its bills and multibills """
+    # Each Exists gets its own When rather than being OR'ed into a Q, since django-polymorphic expects every child of a
+    # Q passed to annotate() to be a lookup or another Q
+    return Case(
+        When(Exists(Billing.objects.filter(event=OuterRef('pk'), date_paid__isnull=False)), then=Value('paid')),
+        When(Exists(MultiBilling.objects.filter(events=OuterRef('pk'), date_paid__isnull=False)), then=Value('paid')),
+        When(Exists(Billing.objects.filter(event=OuterRef('pk'))), then=Value('unpaid')),
+        When(Exists(MultiBilling.objects.filter(events=OuterRef('pk'))), then=Value('unpaid')),
+        default=Value('unbilled'))
+
+
+class BaseEventManager(PolymorphicManager):
+    queryset_class = BaseEventQuerySet
+
+    def with_costs(self):
+        return self.get_queryset().with_costs()
+
+
 @python_2_unicode_compatible
 @reversion.register(follow=['extrainstance_set', 'arbitraryfees'])
 class BaseEvent(PolymorphicModel):
@@ -235,6 +297,8 @@ class BaseEvent(PolymorphicModel):
         It contains the parts of the old Event model that were kept in Event2019.
         The parts of the old Event model that were _not_ kept in Event2019 remain in the Event model.
     """
+    objects = BaseEventManager()
+
     submitted_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='submitter')
     submitted_ip = models.GenericIPAddressField(max_length=16)
     submitted_on = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -275,9 +339,21 @@ class BaseEvent(PolymorphicModel):
     cancelled_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="eventcancellations", null=True, blank=True)
     cancelled_reason = models.TextField(null=True, blank=True)
 
+    # Kept in sync with the event's bills by signals (see events.signals)
+    billing_status = models.CharField(max_length=8, choices=BILLING_STATUSES, default='unbilled', db_index=True,
+                                      editable=False)
+
     def __str__(self):
         return self.event_name
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The billing status is only written by the signals (see events.signals), so leave it out when updating an
+        # existing event to keep a stale copy of the event from overwriting it
+        if update_fields is None and self.pk and not self._state.adding and not force_insert:
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name != 'billing_status']
+        super(BaseEvent, self).save(force_insert, force_update, using, update_fields)
+
     def cal_name(self):
         """ Title to display on calendars """
         return self.event_name
@@ -351,9 +427,9 @@ class BaseEvent(PolymorphicModel):
         elif not self.reviewed:
             return "Awaiting Review"
         else:
-            if self.paid:
+            if self.billing_status == 'paid':
                 return "Paid"
-            elif self.unpaid:
+            elif self.billing_status == 'unpaid':
                 return "Awaiting Payment"
             else:
                 return "To Be Billed"  # used to be "Open" git #245
@@ -851,122 +927,65 @@ class Event2019(BaseEvent):
         """ Number of different `types` of services provided (based on category) """
         return self.serviceinstance_set.aggregate(Count('service__category', distinct=True))['service__category__count']
 
+    def compute_costs(self):
+        """
+        Load everything needed to price this event and return an :class:`EventCosts` breakdown.
+
+        The breakdown is a snapshot; it will not reflect changes made to the event's services, extras, etc. afterwards.
+        """
+        return EventCosts.for_event(self)
+
+    @property
+    def costs(self):
+        """ Cost breakdown for this event. Uses the breakdown attached to the event if there is one. """
+        return getattr(self, '_costs', None) or self.compute_costs()
+
     @property
     def services_total(self):
-        return sum(si.cost for si in self.serviceinstance_set.all())
+        return self.costs.services_total
 
     @property
     def extras_total(self):
-        return sum(ei.totalcost for ei in self.extrainstance_set.all())
+        return self.costs.extras_total
+
+    @property
+    def oneoff_total(self):
+        return self.costs.oneoff_total
 
     @property
     def rental_fee_total(self):
-        percent = self.pricelist.rental_fee_percentage if self.pricelist else 15
-        applicable_total = sum(decimal.Decimal(rental.totalcost) for rental in self.rentals.filter(rental_fee_applied=True))
-        total = applicable_total * decimal.Decimal(percent) / decimal.Decimal("100")
-        return total.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
+        return self.costs.rental_fee_total
 
     @property
     def rentals_total(self):
-        return sum(rental.totalcost for rental in self.rentals.all()) + self.rental_fee_total
+        return self.costs.rentals_total
 
     @property
     def cost_total_pre_discount(self):
-        return self.services_total + self.extras_total + self.oneoff_total
+        return self.costs.cost_total_pre_discount
 
     def category_subtotal(self, category):
-        return sum(si.cost for si in self.serviceinstance_set.filter(service__category=category)) + \
-               sum(ei.totalcost for ei in self.extrainstance_set.filter(extra__category=category)) - \
-               sum(self.get_discount_values(category=category).values()) + \
-               sum(self.get_fee_values(category=category).values())
+        return self.costs.category_subtotal(category)
 
     @property
     def discount_applied(self):
-        if self.uses_new_discounts:
-            return False
-
-        categories = ['Lighting', 'Sound']
-        return all(self.serviceinstance_set.filter(service__category__name=category).exists() for category in categories)
+        return self.costs.discount_applied
 
     @property
     def discount_value(self):
-        if self.discount_applied:
-            category_names = ['Lighting', 'Sound', 'Rigging', 'Power']
-            categories = Category.objects.filter(name__in=category_names)
-            discountable_total = sum(decimal.Decimal(si.cost) for si in self.serviceinstance_set.filter(service__category__in=categories)) + self.extras_total
-            discount = discountable_total * decimal.Decimal(".15")
-            return discount.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
-        else:
-            return decimal.Decimal("0.0")
+        return self.costs.discount_value
 
     def get_discount_values(self, category=None):
-        if not self.uses_new_discounts:
-            return {}
-
-        values = {}
-        for discount in self.applied_discounts.all():
-            if self.pricelist and DiscountPrice.objects.filter(discount=discount, pricelist=self.pricelist).exists():
-                percentage = DiscountPrice.objects.get(pricelist=self.pricelist, discount=discount).percent
-                if category:
-                    discountable_total = sum(decimal.Decimal(si.cost)
-                                                for si in self.serviceinstance_set.filter(
-                                                    service__category__in=discount.categories.all(),
-                                                    service__category=category))
-                    discountable_total += sum(decimal.Decimal(ei.totalcost)
-                                                for ei in self.extrainstance_set.filter(
-                                                    extra__category__in=discount.categories.all(),
-                                                    extra__category=category))
-                else:
-                    discountable_total = sum(decimal.Decimal(si.cost)
-                                                for si in self.serviceinstance_set.filter(
-                                                    service__category__in=discount.categories.all()))
-                    discountable_total += sum(decimal.Decimal(ei.totalcost)
-                                                for ei in self.extrainstance_set.filter(
-                                                    extra__category__in=discount.categories.all()))
-                if discountable_total == 0:
-                    continue
-                discount_value = discountable_total * decimal.Decimal(percentage) / decimal.Decimal("100")
-                values[(discount, percentage)] = discount_value.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
-        return values
+        return self.costs.get_discount_values(category)
     discount_values = property(get_discount_values)
 
     def get_fee_values(self, category=None):
-        if not self.uses_new_discounts:
-            return {}
-
-        values = {}
-        for fee in self.applied_fees.all():
-            if self.pricelist and FeePrice.objects.filter(fee=fee, pricelist=self.pricelist).exists():
-                percentage = FeePrice.objects.get(pricelist=self.pricelist, fee=fee).percent
-                if category:
-                    applicable_total = sum(decimal.Decimal(si.cost)
-                                            for si in self.serviceinstance_set.filter(
-                                                service__category__in=fee.categories.all(),
-                                                service__category=category))
-                    applicable_total += sum(decimal.Decimal(ei.totalcost)
-                                            for ei in self.extrainstance_set.filter(
-                                                extra__category__in=fee.categories.all(),
-                                                extra__category=category))
-                else:
-                    applicable_total = sum(decimal.Decimal(si.cost)
-                                            for si in self.serviceinstance_set.filter(
-                                                service__category__in=fee.categories.all()))
-                    applicable_total += sum(decimal.Decimal(ei.totalcost)
-                                            for ei in self.extrainstance_set.filter(
-                                                extra__category__in=fee.categories.all()))
-                if applicable_total == 0:
-                    continue
-                value = applicable_total * decimal.Decimal(percentage) / decimal.Decimal("100")
-                values[(fee, percentage)] = value.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
-        return values
+        return self.costs.get_fee_values(category)
     fee_values = property(get_fee_values)
 
     @property
     def cost_total(self):
-        if self.uses_new_discounts:
-            return self.cost_total_pre_discount - sum(self.discount_values.values()) + sum(self.fee_values.values()) + self.rentals_total
-        else:
-            return self.cost_total_pre_discount - self.discount_value
+        return self.costs.cost_total
 
     @property
     def workday_form_hash(self):
@@ -998,6 +1017,264 @@ class Event2019(BaseEvent):
         verbose_name = '2019 Event'
 
 
+class EventCosts(object):
+    """
+        In-memory cost breakdown for an Event2019.
+
+        All of the event's service, extra, rental, one-off, discount and fee rows are loaded up front in a fixed number
+        of queries. Every subtotal, discount and fee is then calculated from those rows without hitting the database.
+    """
+    OLD_DISCOUNT_REQUIRED = ('Lighting', 'Sound')
+    OLD_DISCOUNT_CATEGORIES = ('Lighting', 'Sound', 'Rigging', 'Power')
+
+    def __init__(self, event, services, extras, oneoffs, rentals, discounts, fees):
+        """
+        :param event: The Event2019 being priced
+        :param services: List of (category, cost) pairs, one per service instance
+        :param extras: List of (category, total cost) pairs, one per extra instance
+        :param oneoffs: List of EventArbitrary objects
+        :param rentals: List of Rental objects
+        :param discounts: List of (discount, percent, category ids) for applied discounts priced in the pricelist
+        :param fees: List of (fee, percent, category ids) for applied fees priced in the pricelist
+        """
+        self.event = event
+        self.services = services
+        self.extras = extras
+        self.oneoffs = oneoffs
+        self.rentals = rentals
+        self.discounts = discounts
+        self.fees = fees
+
+    @classmethod
+    def for_event(cls, event):
+        """ Load the pricing data for a single event """
+        return cls.for_events([event])[event.pk]
+
+    @classmethod
+    def for_events(cls, events):
+        """
+        Load the pricing data for any number of events at once. The number of queries does not depend on the number of
+        events.
+
+        :param events: Iterable of events (anything other than an Event2019 is skipped)
+        :returns: Dictionary mapping event ids to their cost breakdowns
+        """
+        events = [event for event in events if isinstance(event, Event2019)]
+        if not events:
+            return {}
+        event_ids = [event.pk for event in events]
+
+        # Pricelists
+        uncached = {event.pricelist_id for event in events
+                    if event.pricelist_id and not Event2019.pricelist.is_cached(event)}
+        if uncached:
+            pricelists = Pricelist.objects.in_bulk(uncached)
+            for event in events:
+                if event.pricelist_id in pricelists:
+                    event.pricelist = pricelists[event.pricelist_id]
+        pricelist_ids = {event.pricelist_id for event in events if event.pricelist_id}
+
+        # Services and extras, priced using each event's pricelist if it has an entry
+        service_instances = list(ServiceInstance.objects.filter(event_id__in=event_ids)
+                                 .select_related('service__category'))
+        extra_instances = list(ExtraInstance.objects.filter(event_id__in=event_ids).select_related('extra__category'))
+        service_prices = {}
+        extra_prices = {}
+        if pricelist_ids and service_instances:
+            for price in ServicePrice.objects.filter(pricelist_id__in=pricelist_ids,
+                                                     service_id__in={si.service_id for si in service_instances}):
+                service_prices[(price.pricelist_id, price.service_id)] = price.cost
+        if pricelist_ids and extra_instances:
+            for price in ExtraPrice.objects.filter(pricelist_id__in=pricelist_ids,
+                                                   extra_id__in={ei.extra_id for ei in extra_instances}):
+                extra_prices[(price.pricelist_id, price.extra_id)] = price.cost
+
+        by_id = {event.pk: event for event in events}
+        services = {pk: [] for pk in event_ids}
+        extras = {pk: [] for pk in event_ids}
+        for si in service_instances:
+            pricelist_id = by_id[si.event_id].pricelist_id
+            services[si.event_id].append(
+                (si.service.category, service_prices.get((pricelist_id, si.service_id), si.service.base_cost)))
+        for ei in extra_instances:
+            pricelist_id = by_id[ei.event_id].pricelist_id
+            extras[ei.event_id].append(
+                (ei.extra.category, ei.quant * extra_prices.get((pricelist_id, ei.extra_id), ei.extra.cost)))
+
+        # One-off charges and rentals
+        oneoffs = {pk: [] for pk in event_ids}
+        for oneoff in EventArbitrary.objects.filter(event_id__in=event_ids):
+            oneoffs[oneoff.event_id].append(oneoff)
+        rentals = {pk: [] for pk in event_ids}
+        for rental in Rental.objects.filter(event_id__in=event_ids):
+            rentals[rental.event_id].append(rental)
+
+        # Discounts and fees only apply to events using the new discount system with a pricelist
+        discounted_ids = [event.pk for event in events if event.uses_new_discounts and event.pricelist_id]
+        discounts = cls._load_adjustments(
+            discounted_ids, pricelist_ids, Event2019.applied_discounts.through, 'discount', Discount, DiscountPrice)
+        fees = cls._load_adjustments(
+            discounted_ids, pricelist_ids, Event2019.applied_fees.through, 'fee', Fee, FeePrice)
+
+        return {
+            event.pk: cls(event, services[event.pk], extras[event.pk], oneoffs[event.pk], rentals[event.pk],
+                          [(adjustment, percents[event.pricelist_id], categories)
+                           for adjustment, percents, categories in discounts.get(event.pk, [])
+                           if event.pricelist_id in percents],
+                          [(adjustment, percents[event.pricelist_id], categories)
+                           for adjustment, percents, categories in fees.get(event.pk, [])
+                           if event.pricelist_id in percents])
+            for event in events
+        }
+
+    @staticmethod
+    def _load_adjustments(event_ids, pricelist_ids, link_model, name, model, price_model):
+        """
+        Load the discounts or fees applied to the given events
+
+        :returns: Dictionary mapping event ids to lists of (discount or fee, {pricelist id: percent}, category ids)
+        """
+        if not event_ids:
+            return {}
+        links = list(link_model.objects.filter(event2019_id__in=event_ids).order_by('pk')
+                     .values_list('event2019_id', name + '_id'))
+        if not links:
+            return {}
+        adjustment_ids = {adjustment_id for event_id, adjustment_id in links}
+        adjustments = model.objects.in_bulk(adjustment_ids)
+        categories = {pk: set() for pk in adjustment_ids}
+        for adjustment_id, category_id in model.categories.through.objects.filter(
+                **{name + '_id__in': adjustment_ids}).values_list(name + '_id', 'category_id'):
+            categories[adjustment_id].add(category_id)
+        percents = {pk: {} for pk in adjustment_ids}
+        for adjustment_id, pricelist_id, percent in price_model.objects.filter(
+                **{name + '_id__in': adjustment_ids, 'pricelist_id__in': pricelist_ids}) \
+                .values_list(name + '_id', 'pricelist_id', 'percent'):
+            percents[adjustment_id][pricelist_id] = percent
+
+        out = {}
+        for event_id, adjustment_id in links:
+            out.setdefault(event_id, []).append(
+                (adjustments[adjustment_id], percents[adjustment_id], categories[adjustment_id]))
+        return out
+
+    @classmethod
+    def attach(cls, events):
+        """
+        Compute the costs for a list of events in bulk and attach them to the events, so that properties like
+        ``cost_total`` no longer need to query the database
+
+        :param events: Iterable of events
+        :returns: The events, as a list
+        """
+        events = list(events)
+        for pk, costs in cls.for_events(events).items():
+            costs.event._costs = costs
+        return events
+
+    @cached_property
+    def services_total(self):
+        return sum(cost for category, cost in self.services)
+
+    @cached_property
+    def extras_total(self):
+        return sum(cost for category, cost in self.extras)
+
+    @cached_property
+    def oneoff_total(self):
+        return sum([x.totalcost for x in self.oneoffs])
+
+    @cached_property
+    def rental_fee_total(self):
+        percent = self.event.pricelist.rental_fee_percentage if self.event.pricelist else 15
+        applicable_total = sum(decimal.Decimal(rental.totalcost) for rental in self.rentals if rental.rental_fee_applied)
+        total = applicable_total * decimal.Decimal(percent) / decimal.Decimal("100")
+        return total.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
+
+    @cached_property
+    def rentals_total(self):
+        return sum(rental.totalcost for rental in self.rentals) + self.rental_fee_total
+
+    @cached_property
+    def cost_total_pre_discount(self):
+        return self.services_total + self.extras_total + self.oneoff_total
+
+    @cached_property
+    def discount_applied(self):
+        if self.event.uses_new_discounts:
+            return False
+
+        category_names = {category.name for category, cost in self.services}
+        return all(name in category_names for name in self.OLD_DISCOUNT_REQUIRED)
+
+    @cached_property
+    def discount_value(self):
+        if self.discount_applied:
+            discountable_total = sum(decimal.Decimal(cost) for category, cost in self.services
+                                     if category.name in self.OLD_DISCOUNT_CATEGORIES) + self.extras_total
+            discount = discountable_total * decimal.Decimal(".15")
+            return discount.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
+        else:
+            return decimal.Decimal("0.0")
+
+    def applicable_total(self, category_ids, category=None):
+        """
+        Total cost of the services and extras that fall under the given categories
+
+        :param category_ids: Set of category ids a discount or fee applies to
+        :param category: Only include services and extras in this category (optional)
+        """
+        if category is not None:
+            category_id = getattr(category, 'pk', category)
+            if category_id not in category_ids:
+                return 0
+            category_ids = {category_id}
+        return sum(decimal.Decimal(cost) for cat, cost in self.services if cat.pk in category_ids) + \
+            sum(decimal.Decimal(cost) for cat, cost in self.extras if cat.pk in category_ids)
+
+    def _percentage_values(self, adjustments, category=None):
+        if not self.event.uses_new_discounts:
+            return {}
+
+        values = {}
+        for adjustment, percentage, category_ids in adjustments:
+            applicable_total = self.applicable_total(category_ids, category)
+            if applicable_total == 0:
+                continue
+            value = applicable_total * decimal.Decimal(percentage) / decimal.Decimal("100")
+            values[(adjustment, percentage)] = value.quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN)
+        return values
+
+    def get_discount_values(self, category=None):
+        return self._percentage_values(self.discounts, category)
+
+    def get_fee_values(self, category=None):
+        return self._percentage_values(self.fees, category)
+
+    @cached_property
+    def discount_values(self):
+        return self.get_discount_values()
+
+    @cached_property
+    def fee_values(self):
+        return self.get_fee_values()
+
+    def category_subtotal(self, category):
+        category_id = getattr(category, 'pk', category)
+        return sum(cost for cat, cost in self.services if cat.pk == category_id) + \
+            sum(cost for cat, cost in self.extras if cat.pk == category_id) - \
+            sum(self.get_discount_values(category=category).values()) + \
+            sum(self.get_fee_values(category=category).values())
+
+    @cached_property
+    def cost_total(self):
+        if self.event.uses_new_discounts:
+            return self.cost_total_pre_discount - sum(self.discount_values.values()) + \
+                sum(self.fee_values.values()) + self.rentals_total
+        else:
+            return self.cost_total_pre_discount - self.discount_value
+
+
 @python_2_unicode_compatible
 class Building(models.Model):
     """ Used to group locations together in forms """
@@ -1508,6 +1785,8 @@ class EventCCInstance(models.Model):
     service = models.ForeignKey(Service, on_delete=models.PROTECT, null=True, related_name='ccinstances')
     setup_location = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='ccinstances')
     setup_start = models.DateTimeField(null=True, blank=True)
+    # Set once the crew chief has been emailed about the assignment, so that a retried notification isn't sent twice
+    email_sent = models.BooleanField(default=False, editable=False)
 
     def cal_name(self):
         """ Title used by calendars """
@@ -1,10 +1,11 @@
 import logging
-import inspect
 from six import string_types
 
-from django.core.exceptions import PermissionDenied
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, PermissionDenied
+from django.db.models import BooleanField, Case, Exists, OuterRef, Q, Value, When
 from permission.logics import PermissionLogic
-from permission.utils.field_lookup import field_lookup
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,19 @@ class AssocUsersCustomPermissionLogic(PermissionLogic):
     field_name = 'authorized_users'
     perms = []
     denied = []
+    _model = None
+
+    @property
+    def model(self):
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        # Set by django-permission when the logic is registered, so a bad lookup fails at startup rather than on
+        # every permission check
+        for lookup in self.lookups:
+            check_user_lookup(model, lookup)
+        self._model = model
 
     def has_perm(self, user_obj, perm, obj=None):
         # User must be logged in
@@ -20,7 +34,7 @@ class AssocUsersCustomPermissionLogic(PermissionLogic):
             logger.debug("%s not signed in" % user_obj)
             return False
         # See if we can handle that perm
-        if perm not in self.perms and perm not in self.denied:
+        if not self.handles(perm):
             logger.debug("%s - permission not recognized" % perm)
             return False
         # if there isn't an object, that means we're looking for a module permission.
@@ -32,29 +46,41 @@ class AssocUsersCustomPermissionLogic(PermissionLogic):
         if not user_obj.is_active:
             logger.debug("%s is not an active user" % user_obj)
             return False
-        # get all authorized_users in the object
+        # Unsaved objects can't have anyone associated with them through a related table
+        if obj.pk is None:
+            logger.debug("%s - has_perm called with unsaved instance; denying permission" % perm)
+            return False
+        # Whether the user is associated with the object only depends on the lookups, not on the perm, so the answer
+        # is remembered on the user instance (which lives as long as the request) and reused for every other perm.
+        cache = user_obj.__dict__.setdefault('_assoc_perm_cache', {})
+        key = (self.__class__, obj._meta.label, obj.pk)
+        if key not in cache:
+            cache[key] = type(obj)._base_manager.filter(pk=obj.pk).filter(self.user_q(user_obj)).exists()
+        if cache[key]:
+            if perm in self.denied:
+                logger.debug("%s - DENIED for %s in lookups %s" % (perm, user_obj, self.lookups))
+                raise PermissionDenied()
+            logger.debug("%s - GRANTED for %s in lookups %s" % (perm, user_obj, self.lookups))
+            return True
+        return False
+
+    @property
+    def lookups(self):
+        """ The field lookups leading from the object to its authorized users """
         if isinstance(self.field_name, string_types):
-            self.field_name = [self.field_name]
-        for lookup in self.field_name:
-            authorized_users = field_lookup(obj, lookup)
-            # break out of a generator expression
-            if inspect.isgenerator(authorized_users):
-                try:
-                    authorized_users = list(*authorized_users)
-                except TypeError:
-                    authorized_users = list(field_lookup(obj, lookup))
-            else:
-                authorized_users = [authorized_users]
-            for user in authorized_users:
-                if hasattr(user, 'all'):
-                    authorized_users.extend(user.all())
-                    authorized_users.remove(user)
-            if user_obj in authorized_users:
-                if perm in self.denied:
-                    logger.debug("%s - DENIED for %s in lookup '%s'" % (perm, user_obj, lookup))
-                    raise PermissionDenied()
-                logger.debug("%s - GRANTED for %s in lookup '%s'" % (perm, user_obj, lookup))
-                return True
+            return [self.field_name]
+        return list(self.field_name)
+
+    def user_q(self, user_obj):
+        """ A filter matching the objects that the user is associated with through any of the lookups """
+        q = Q(pk__in=[])
+        for lookup in self.lookups:
+            q |= Q(**{lookup: user_obj})
+        return q
+
+    def handles(self, perm):
+        """ Whether this logic grants or denies the given permission """
+        return perm in self.perms or perm in self.denied
 
 
 class CrewChiefPermLogic(AssocUsersCustomPermissionLogic):
@@ -145,3 +171,60 @@ PERMISSION_LOGICS = (
     ('events.CCReport', ReportAuthorPermLogic()),
     ('events.PostEventSurvey', CrewChiefSurveyPerms()),
 )
+
+
+def check_user_lookup(model, lookup):
+    """
+    Make sure that a field lookup leads from a model to users through its relations
+
+    :raises ImproperlyConfigured: If the lookup can't be used to filter the model by user
+    """
+    target = model
+    for name in lookup.split('__'):
+        try:
+            field = target._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured("%s has no field '%s' (in lookup '%s')" % (target.__name__, name, lookup))
+        if not field.is_relation:
+            raise ImproperlyConfigured("'%s' in lookup '%s' is not a relation" % (name, lookup))
+        target = field.related_model
+    if target is not get_user_model():
+        raise ImproperlyConfigured("Lookup '%s' on %s leads to %s instead of users" %
+                                   (lookup, model.__name__, target.__name__))
+
+
+def filter_visible(queryset, user, perm):
+    """
+    Limits a queryset to the objects that a user has a permission on, either globally or through any of the
+    PERMISSION_LOGICS registered for the queryset's model. Each matching logic adds one EXISTS subquery, so list views
+    don't have to check their objects one at a time.
+    """
+    if user.has_perm(perm):
+        return queryset
+    if not user.is_authenticated or not user.is_active:
+        return queryset.none()
+    granted = []
+    denied = []
+    for label, logic in PERMISSION_LOGICS:
+        if not issubclass(queryset.model, apps.get_model(label)) or not logic.handles(perm):
+            continue
+        associated = Exists(queryset.model._base_manager.filter(logic.user_q(user), pk=OuterRef('pk')))
+        if perm in logic.denied:
+            denied.append(associated)
+        else:
+            granted.append(associated)
+    if not granted:
+        return queryset.none()
+    queryset = queryset.filter(any_of(granted))
+    if denied:
+        queryset = queryset.exclude(any_of(denied))
+    return queryset
+
+
+def any_of(conditions):
+    """
+    Combine boolean expressions with OR. django-polymorphic can't handle expressions inside Q objects, so this builds a
+    CASE instead of OR'ing them into a Q.
+    """
+    return Case(*[When(condition, then=Value(True)) for condition in conditions], default=Value(False),
+                output_field=BooleanField())
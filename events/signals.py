@@ -1,68 +1,235 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from email.mime.base import MIMEBase
 from email.encoders import encode_base64
 from django.dispatch import receiver
-from django.utils import timezone
 from django.utils.text import slugify
 
 from accounts.models import UserPreferences
+from data.decorators import process_in_thread
 from emails.generators import CcAddEmailGenerator
-from events.models import EventCCInstance
-from events.cal import generate_ics, EventAttendee
+from events.models import (BaseEvent, Billing, Category, Event, Event2019, EventCCInstance, EventOccurrence, Location,
+                           MultiBilling, Organization, Service)
+from events.cal import generate_ics, EventAttendee, invalidate_cal_fragments, invalidate_event_cal_fragments
+from meetings.models import Meeting, MeetingType
 from pdfs.views import generate_pdfs_standalone
 from slack.views import cc_add_notification
 from slack.api import lookup_user, slack_post
 
 __all__ = [
     'email_cc_notification',
+    'update_billing_status',
+    'update_multibilling_status',
+    'remember_multibilling_events',
+    'update_deleted_multibilling_status',
+    'update_multibilling_events_status',
+    'invalidate_event_cal',
+    'invalidate_event_org_cal',
+    'invalidate_org_cal',
+    'invalidate_ccinstance_cal',
+    'invalidate_occurrence_cal',
+    'invalidate_meeting_cal',
+    'invalidate_location_cal',
+    'invalidate_crew_chief_cal',
+    'invalidate_service_cal',
+    'invalidate_meeting_type_cal',
 ]
 
 
 @receiver(post_save, sender=EventCCInstance)
 def email_cc_notification(sender, instance, created, raw=False, **kwargs):
-    """ Sends an email or Slack message to a crew chief to notify them of being made one """
-    prefs, new_pref = UserPreferences.objects.get_or_create(user=instance.crew_chief)
-
+    """
+    Notifies a crew chief of being made one. The email and Slack message are sent by the task queue once the
+    assignment has been saved, so adding crew chiefs doesn't wait on PDF rendering, SMTP or Slack.
+    """
     if created and not raw:
-        if 'Email' in str(prefs.cc_add_subscriptions).split(', '):
-            i = instance
-
-            # generate our pdf
-            event = i.event
-            pdf_handle = generate_pdfs_standalone([event.id])
-            filename = "%s.workorder.pdf" % slugify(event.event_name)
-            attachments = [{"file_handle": pdf_handle, "name": filename}]
-
-            # generate an Outlook invite
-            chief = EventAttendee(event, i.crew_chief)
-            invite_filename = '%s.invite.ics' % slugify(event.event_name)
-            invite = MIMEBase('text', "calendar", method="PUBLISH", name=invite_filename)
-            invite.set_payload(generate_ics([event], [chief]))
-            encode_base64(invite)
-            invite.add_header('Content-Description', invite_filename)
-            invite.add_header('Content-class', "urn:content-classes:calendarmessage")
-            invite.add_header('Filename', invite_filename)
-            invite.add_header('Path', invite_filename)
-            attachments.append(invite)
-
-            if i.setup_start:
-                local = timezone.localtime(i.setup_start)
-                local_formatted = local.strftime("%A %B %d at %I:%M %p")
-            else:
-                local_formatted = "a time of your choice "
-
-            context = {
-                    "is_new_cc": True if i.crew_chief.ccinstances == 1 else False
-                    }
-
-            e = CcAddEmailGenerator(ccinstance=i, attachments=attachments, context=context)
-            e.send()
-        if 'Slack Notification' in str(prefs.cc_add_subscriptions).split(', '):
-            blocks = cc_add_notification(instance)
-            slack_user = lookup_user(instance.crew_chief.email)
-            if slack_user:
-                message = "You've been added as a crew chief for the event %s." % instance.event.event_name
-                slack_post(slack_user, text=message, content=blocks)
+        send_cc_add_email(instance.pk)
+        send_cc_add_slack(instance.pk)
+
+
+def cc_add_subscriptions(ccinstance):
+    prefs, new_pref = UserPreferences.objects.get_or_create(user=ccinstance.crew_chief)
+    return str(prefs.cc_add_subscriptions).split(', ')
+
+
+@process_in_thread(retry=True)
+def send_cc_add_email(ccinstance_id):
+    """
+    Emails a new crew chief their workorder and a calendar invite (if they have subscribed to emails). The email is
+    only sent once, even if the task is retried.
+    """
+    i = EventCCInstance.objects.select_related('crew_chief', 'event').filter(pk=ccinstance_id, email_sent=False) \
+        .first()
+    if i is None or 'Email' not in cc_add_subscriptions(i):
+        return
+
+    # generate our pdf
+    event = i.event
+    pdf_handle = generate_pdfs_standalone([event.id])
+    filename = "%s.workorder.pdf" % slugify(event.event_name)
+    attachments = [{"file_handle": pdf_handle, "name": filename}]
+
+    # generate an Outlook invite
+    chief = EventAttendee(event, i.crew_chief)
+    invite_filename = '%s.invite.ics' % slugify(event.event_name)
+    invite = MIMEBase('text', "calendar", method="PUBLISH", name=invite_filename)
+    invite.set_payload(generate_ics([event], [chief]))
+    encode_base64(invite)
+    invite.add_header('Content-Description', invite_filename)
+    invite.add_header('Content-class', "urn:content-classes:calendarmessage")
+    invite.add_header('Filename', invite_filename)
+    invite.add_header('Path', invite_filename)
+    attachments.append(invite)
+
+    context = {
+        "is_new_cc": True if i.crew_chief.ccinstances == 1 else False
+    }
+
+    e = CcAddEmailGenerator(ccinstance=i, attachments=attachments, context=context)
+    e.send()
+    EventCCInstance.objects.filter(pk=i.pk).update(email_sent=True)
+
+
+@process_in_thread(retry=True)
+def send_cc_add_slack(ccinstance_id):
+    """ Messages a new crew chief on Slack (if they have subscribed to Slack notifications) """
+    i = EventCCInstance.objects.select_related('crew_chief', 'event').filter(pk=ccinstance_id).first()
+    if i is None or 'Slack Notification' not in cc_add_subscriptions(i):
+        return
+
+    blocks = cc_add_notification(i)
+    slack_user = lookup_user(i.crew_chief.email)
+    if slack_user:
+        message = "You've been added as a crew chief for the event %s." % i.event.event_name
+        slack_post(slack_user, text=message, content=blocks)
+
+
+@receiver(post_save, sender=Billing)
+@receiver(post_delete, sender=Billing)
+def update_billing_status(sender, instance, raw=False, **kwargs):
+    """ Keeps an event's stored billing status in sync with its bills """
+    if not raw:
+        BaseEvent.objects.filter(pk=instance.event_id).refresh_billing_status()
+
+
+@receiver(post_save, sender=MultiBilling)
+def update_multibilling_status(sender, instance, raw=False, **kwargs):
+    """ Keeps the stored billing status of every event in a multibill in sync with the multibill """
+    if not raw:
+        BaseEvent.objects.filter(pk__in=list(instance.events.values_list('pk', flat=True))).refresh_billing_status()
+
+
+@receiver(pre_delete, sender=MultiBilling)
+def remember_multibilling_events(sender, instance, **kwargs):
+    """ Events are no longer linked to a multibill once it has been deleted, so keep track of them beforehand """
+    instance._billing_status_event_ids = list(instance.events.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=MultiBilling)
+def update_deleted_multibilling_status(sender, instance, **kwargs):
+    """ Updates the stored billing status of the events that were part of a deleted multibill """
+    BaseEvent.objects.filter(pk__in=getattr(instance, '_billing_status_event_ids', [])).refresh_billing_status()
+
+
+@receiver(m2m_changed, sender=MultiBilling.events.through)
+def update_multibilling_events_status(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Keeps events' stored billing status in sync when they are added to or removed from a multibill """
+    if reverse:
+        # instance is an event
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            BaseEvent.objects.filter(pk=instance.pk).refresh_billing_status()
+    elif action == 'pre_clear':
+        instance._billing_status_event_ids = list(instance.events.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        BaseEvent.objects.filter(pk__in=getattr(instance, '_billing_status_event_ids', [])) \
+            .refresh_billing_status()
+    elif action in ('post_add', 'post_remove'):
+        BaseEvent.objects.filter(pk__in=pk_set).refresh_billing_status()
+
+
+@receiver(post_save, sender=BaseEvent)
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Event2019)
+@receiver(post_delete, sender=BaseEvent)
+@receiver(post_delete, sender=Event)
+@receiver(post_delete, sender=Event2019)
+def invalidate_event_cal(sender, instance, **kwargs):
+    """ Drops an event's cached calendar entries so that the feeds pick up the change """
+    invalidate_event_cal_fragments([instance.pk])
+
+
+@receiver(m2m_changed, sender=BaseEvent.org.through)
+def invalidate_event_org_cal(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Events list their clients on calendars, so drop their cached entries when the clients change """
+    if not reverse:
+        # instance is an event
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_event_cal_fragments([instance.pk])
+    elif action == 'pre_clear':
+        instance._cal_event_ids = list(instance.events.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_event_cal_fragments(getattr(instance, '_cal_event_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_event_cal_fragments(pk_set)
+
+
+@receiver(post_save, sender=Organization)
+def invalidate_org_cal(sender, instance, raw=False, **kwargs):
+    """ Drops the cached calendar entries of an organization's events in case its name changed """
+    if not raw:
+        invalidate_event_cal_fragments(instance.events.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=EventCCInstance)
+@receiver(post_delete, sender=EventCCInstance)
+def invalidate_ccinstance_cal(sender, instance, **kwargs):
+    """ Events list their crew chiefs on calendars, so drop their cached entries when the crew chiefs change """
+    invalidate_event_cal_fragments([instance.event_id])
+
+
+@receiver(post_save, sender=EventOccurrence)
+@receiver(post_delete, sender=EventOccurrence)
+def invalidate_occurrence_cal(sender, instance, **kwargs):
+    """ Drops an event occurrence's cached calendar entry """
+    invalidate_cal_fragments('eventoccurrence', [instance.pk])
+
+
+@receiver(post_save, sender=Meeting)
+@receiver(post_delete, sender=Meeting)
+def invalidate_meeting_cal(sender, instance, **kwargs):
+    """ Drops a meeting's cached calendar entry """
+    invalidate_cal_fragments('mtg', [instance.pk])
+
+
+@receiver(post_save, sender=Location)
+def invalidate_location_cal(sender, instance, raw=False, **kwargs):
+    """ Drops the cached calendar entries of everything held at a location in case its name changed """
+    if not raw:
+        invalidate_event_cal_fragments(BaseEvent.objects.filter(location=instance).values_list('pk', flat=True))
+        invalidate_cal_fragments('mtg', instance.meeting_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_crew_chief_cal(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ Events list their crew chiefs by name, so drop their cached entries when a crew chief's name changes """
+    if raw or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    invalidate_event_cal_fragments(instance.ccinstances.values_list('event_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Service)
+def invalidate_service_cal(sender, instance, raw=False, **kwargs):
+    """ Events list the services their crew chiefs run, so drop their cached entries when a service is renamed """
+    if not raw:
+        invalidate_event_cal_fragments(instance.ccinstances.values_list('event_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=MeetingType)
+def invalidate_meeting_type_cal(sender, instance, raw=False, **kwargs):
+    """ Meetings are titled after their type, so drop their cached entries when a meeting type is renamed """
+    if not raw:
+        invalidate_cal_fragments('mtg', instance.meeting_set.values_list('pk', flat=True))
 
 
 # @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -7,7 +7,7 @@ from django.core.exceptions import ValidationError
 from django.core.cache import cache
 from django.conf import settings
 from django.http import QueryDict
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
 from data.tests.util import ViewTestCase
 from django.utils import timezone
@@ -20,6 +20,9 @@ from ..templatetags import append_get, at_event_linking, gpa_scale_emoji
 
 logging.disable(logging.WARNING)
 
+# The calendar feed fixtures are dated 2019-2020, so the feed tests widen the default window to reach them
+FIXTURE_FEED_DAYS = 100 * 365
+
 
 class EventBasicViewTest(ViewTestCase):
     def setup(self):
@@ -2206,12 +2209,35 @@ class EventListBasicViewTest(ViewTestCase):
         self.assertNotContains(resp, "Test Event")
         self.assertNotContains(resp, "first e occurrence")
 
+    def test_paginate_helper_sort(self):
+        from ..views.list import paginate_helper
+
+        models.Billing.objects.create(event=self.e2019, date_billed=timezone.now().date(), amount=100)
+        models.Billing.objects.create(event=self.e2019, date_billed=timezone.now().date(), amount=100)
+        models.Billing.objects.create(event=self.e, date_billed=timezone.now().date(), amount=50)
+        events = models.BaseEvent.objects.all()
+
+        # Computed columns are sorted by the database
+        page = paginate_helper(events, 1, '-times_billed')
+        self.assertEqual(list(page.object_list)[:2], [self.e2019, self.e])
+        page = paginate_helper(events, 1, 'times_billed')
+        self.assertEqual(list(page.object_list)[-1], self.e2019)
+
+        # Descending sorts on concrete fields no longer fall back to sorting in Python
+        page = paginate_helper(events, 1, '-event_name')
+        self.assertEqual(list(page.object_list), [self.e, self.e2, self.e2019])
+
+        # Costs are still sorted in Python, but computed in bulk
+        page = paginate_helper(models.Event2019.objects.all(), 1, '-cost_total')
+        self.assertEqual(list(page.object_list), [self.e2019])
+
     def test_public(self):
         response = self.client.get(reverse('cal:list'))
         self.assertEqual(response.status_code, 200)
         response = self.client.get(reverse('cal:api-public'))
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
     def test_cal_feed(self):
         response = self.client.get(reverse('cal:feed'))
         self.assertEqual(response.status_code, 200)
@@ -2222,6 +2248,7 @@ class EventListBasicViewTest(ViewTestCase):
         self.assertContains(response, "2019 Event")
         self.assertContains(response, "e2019 occurrence")
 
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
     def test_cal_feed_full_base(self):
         # Check that feed loads ok (should not include either event)
         resp = self.client.get(reverse('cal:feed-full'))
@@ -2231,6 +2258,7 @@ class EventListBasicViewTest(ViewTestCase):
         self.assertNotContains(resp, "Other Event")
         self.assertNotContains(resp, "e2 occurrence")
 
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
     def test_cal_feed_full_no_sensitive(self):
         cache.clear()
         self.e.sensitive = False
@@ -2241,6 +2269,7 @@ class EventListBasicViewTest(ViewTestCase):
         # make sure we still don't see the occurrence that has display_on_cal=False
         self.assertNotContains(self.client.get(reverse('cal:feed-full')), "second e occurrence")
 
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
     def test_cal_feed_full_no_test_event(self):
         cache.clear()
         self.e2.test_event = False
@@ -2249,6 +2278,7 @@ class EventListBasicViewTest(ViewTestCase):
         self.assertContains(self.client.get(reverse('cal:feed-full')), "Other Event")
         self.assertContains(self.client.get(reverse('cal:feed-full')), "e2 occurrence")
 
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
     def test_cal_feed_light(self):
         response = self.client.get(reverse('cal:feed-light'))
         self.assertEqual(response.status_code, 200)
@@ -2259,6 +2289,65 @@ class EventListBasicViewTest(ViewTestCase):
         self.assertContains(response, "2019 Event")
         self.assertNotContains(response, "e2019 occurrence")
 
+    def test_cal_feed_window(self):
+        Event2019Factory.create(event_name="Upcoming Event", approved=True,
+                                datetime_start=timezone.now() + timezone.timedelta(days=30),
+                                datetime_end=timezone.now() + timezone.timedelta(days=31))
+
+        # By default, old events are left out
+        response = self.client.get(reverse('cal:feed'))
+        self.assertContains(response, "Upcoming Event")
+        self.assertNotContains(response, "2019 Event")
+
+        past = (timezone.now() - self.e2019.datetime_start).days + 1
+        with override_settings(CAL_FEED_MAX_DAYS=past):
+            response = self.client.get(reverse('cal:feed'), {'past': past, 'future': 7})
+        self.assertNotContains(response, "Upcoming Event")
+        self.assertContains(response, "2019 Event")
+
+        # Invalid values fall back to the default window
+        response = self.client.get(reverse('cal:feed'), {'past': 'all', 'future': 'all'})
+        self.assertContains(response, "Upcoming Event")
+        self.assertNotContains(response, "2019 Event")
+
+    @override_settings(CAL_FEED_PAST_DAYS=FIXTURE_FEED_DAYS)
+    def test_cal_feed_fragments(self):
+        cache.clear()
+        response = self.client.get(reverse('cal:feed'))
+        etag = response['ETag']
+        self.assertIsNotNone(cache.get(cal.fragment_cache_key('event', self.e2019.pk)))
+
+        # Feed is unchanged, so clients that already have it get a 304
+        response = self.client.get(reverse('cal:feed'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Editing an event only invalidates the entries for that event
+        self.e2019.event_name = "Renamed Event"
+        self.e2019.save()
+        self.assertIsNone(cache.get(cal.fragment_cache_key('event', self.e2019.pk)))
+        self.assertIsNone(cache.get(cal.fragment_cache_key('eventoccurrence', self.e2019.occurrences.get().pk)))
+
+        response = self.client.get(reverse('cal:feed'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, "Renamed Event")
+        self.assertNotContains(response, "2019 Event")
+
+        # Crew chiefs appear in event descriptions
+        CCInstanceFactory.create(event=self.e2019, crew_chief=self.user)
+        self.assertIsNone(cache.get(cal.fragment_cache_key('event', self.e2019.pk)))
+
+        # So do their names and the location's name
+        self.client.get(reverse('cal:feed'))
+        self.user.last_name = "Renamed"
+        self.user.save()
+        self.assertIsNone(cache.get(cal.fragment_cache_key('event', self.e2019.pk)))
+
+        self.client.get(reverse('cal:feed'))
+        self.e2019.location.name = "Renamed Location"
+        self.e2019.location.save()
+        self.assertIsNone(cache.get(cal.fragment_cache_key('event', self.e2019.pk)))
+
     def test_prospective(self):
         # By default, user should not have permission to view this page
         self.assertOk(self.client.get(reverse('events:prospective')), 403)
@@ -2919,7 +3008,27 @@ class EventIndices(ViewTestCase):
         permission = Permission.objects.get(codename="view_posteventsurveyresults")
         self.user.user_permissions.add(permission)
 
-        self.assertOk(self.client.get(reverse("survey-dashboard")))
+        cache.clear()
+        resp = self.client.get(reverse("survey-dashboard"))
+        self.assertOk(resp)
+        self.assertEqual(resp.context['num_events'], 2)
+        composites = dict((event.pk, values) for event, values in resp.context['survey_composites'])
+        self.assertEqual(composites[event.pk], {'vp': 0, 'crew': 2.5, 'pricelist': 2.5, 'overall': 2.5})
+        self.assertEqual(composites[second_event.pk], {'vp': None, 'crew': None, 'pricelist': None, 'overall': None})
+        self.assertEqual(resp.context['wma']['crew'], 2.5)
+
+        # Results are cached, so new responses don't show up right away
+        models.PostEventSurvey.objects.create(event=event, person=self.user, services_quality=4, lighting_quality=4,
+                                              sound_quality=4, work_order_method=1, communication_responsiveness=4,
+                                              pricelist_ux=4, setup_on_time=4, crew_respectfulness=4,
+                                              price_appropriate=4, customer_would_return=4)
+        resp = self.client.get(reverse("survey-dashboard"))
+        self.assertEqual(resp.context['survey_composites'][-1][1]['vp'], 0)
+
+        with self.settings(SURVEY_DASHBOARD_CACHE_TTL=0):
+            cache.clear()
+            resp = self.client.get(reverse("survey-dashboard"))
+            self.assertEqual(resp.context['survey_composites'][-1][1]['vp'], 2)
 
 
 class EventTemplateTags(TestCase):
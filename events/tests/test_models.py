@@ -1,8 +1,19 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from decimal import Decimal
 
-from .generators import Event2019Factory, ServiceFactory, ServiceInstanceFactory
-from .. import models
+from .generators import (CCInstanceFactory, Event2019Factory, OrgFactory, ServiceFactory, ServiceInstanceFactory,
+                         UserFactory)
+from accounts.models import UserPreferences
+from data.models import Task
+from .. import models, signals
+from ..perms import filter_visible
 
 class Event2019PropertyTests(TestCase):
     def setup(self):
@@ -324,3 +335,158 @@ class Event2019PropertyTests(TestCase):
         self.assertEqual(self.event.rentals_total, Decimal("287"))
 
         self.assertEqual(self.event.cost_total, Decimal("287"))
+
+    def test_category_subtotal(self):
+        self.setup()
+
+        test_discount = models.Discount.objects.create(name="Test Discount")
+        test_discount.categories.add(self.lighting)
+        models.DiscountPrice.objects.create(pricelist=self.pricelist, discount=test_discount, percent=10)
+
+        self.event.uses_new_discounts = True
+        self.event.pricelist = self.pricelist
+        self.event.applied_discounts.add(test_discount)
+        self.event.save()
+
+        lighting_service = ServiceFactory(category=self.lighting, base_cost=50)
+        ServiceInstanceFactory(service=lighting_service, event=self.event)
+        ServiceInstanceFactory(service=self.service, event=self.event)
+        models.ExtraInstance.objects.create(event=self.event, extra=self.extra, quant=1)
+
+        # the discount only applies to the lighting category, and uses the pricelist for the other service
+        self.assertEqual(self.event.category_subtotal(self.lighting), Decimal('4095.90'))
+        self.assertEqual(self.event.category_subtotal(self.category), Decimal('100.11'))
+        self.assertEqual(self.event.category_subtotal(self.projection), 0)
+
+        # once loaded, the breakdown is calculated entirely in memory
+        costs = self.event.compute_costs()
+        with self.assertNumQueries(0):
+            self.assertEqual(costs.category_subtotal(self.lighting), Decimal('4095.90'))
+            self.assertEqual(costs.cost_total, Decimal('4196.01'))
+
+    def test_with_costs(self):
+        self.setup()
+        other = Event2019Factory.create(event_name="Other Test Event", pricelist=self.pricelist)
+        ServiceInstanceFactory(service=self.service, event=self.event)
+        ServiceInstanceFactory(service=self.service, event=other)
+        models.ExtraInstance.objects.create(event=other, extra=self.extra2, quant=2)
+
+        # costs for every event are loaded along with the events
+        events = list(models.BaseEvent.objects.filter(pk__in=[self.event.pk, other.pk]).order_by('pk').with_costs())
+        with self.assertNumQueries(0):
+            self.assertEqual(events[0].cost_total, Decimal('10.01'))
+            self.assertEqual(events[1].cost_total, Decimal('104.09'))
+
+
+class BillingStatusTests(TestCase):
+    def setUp(self):
+        self.event = Event2019Factory.create(event_name="Billing Test Event")
+
+    def test_billing_status(self):
+        self.assertEqual(self.event.billing_status, 'unbilled')
+
+        bill = models.Billing.objects.create(event=self.event, date_billed=timezone.now().date(), amount=10)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'unpaid')
+
+        bill.date_paid = timezone.now().date()
+        bill.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'paid')
+
+        bill.delete()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'unbilled')
+
+    def test_multibilling_status(self):
+        multibill = models.MultiBilling.objects.create(date_billed=timezone.now().date(), amount=10)
+        multibill.events.add(self.event)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'unpaid')
+
+        multibill.date_paid = timezone.now().date()
+        multibill.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'paid')
+
+        multibill.delete()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'unbilled')
+
+    def test_stale_save(self):
+        # saving an old copy of the event does not overwrite the billing status
+        stale = models.BaseEvent.objects.get(pk=self.event.pk)
+        models.Billing.objects.create(event=self.event, date_billed=timezone.now().date(), amount=10)
+        stale.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.billing_status, 'unpaid')
+
+
+class CCNotificationTests(TestCase):
+    @override_settings(TASK_WORKERS=2)
+    def test_notifications_queued(self):
+        # Adding a crew chief only queues the notifications; nothing is sent until the task worker gets to them
+        cc = CCInstanceFactory.create(event=Event2019Factory.create(event_name="CC Test Event"),
+                                      crew_chief=UserFactory.create(password='123'))
+        tasks = Task.objects.filter(status=Task.PENDING)
+        self.assertEqual(sorted(tasks.values_list('name', flat=True)),
+                         ['events.signals.send_cc_add_email', 'events.signals.send_cc_add_slack'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(UserPreferences.objects.filter(user=cc.crew_chief).exists())
+
+        # Tasks for crew chiefs who have since been removed are dropped
+        cc.delete()
+        call_command('run_tasks', once=True, workers=1)
+        self.assertFalse(tasks.exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(TASK_WORKERS=0)
+    def test_email_sent_once(self):
+        chief = UserFactory.create(password='123')
+        UserPreferences.objects.create(user=chief, cc_add_subscriptions=['email'])
+        cc = CCInstanceFactory.create(event=Event2019Factory.create(event_name="CC Test Event"), crew_chief=chief)
+        self.assertEqual(len(mail.outbox), 1)
+        cc.refresh_from_db()
+        self.assertTrue(cc.email_sent)
+
+        # Running the task again (as a retry would) doesn't send another email
+        signals.send_cc_add_email(cc.pk)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class PermissionLogicTests(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create(password='123', is_superuser=False)
+        self.org = OrgFactory.create(name="Perm Test Org")
+        self.e1 = Event2019Factory.create(event_name="Org Event")
+        self.e2 = Event2019Factory.create(event_name="Crew Chief Event")
+        self.e3 = Event2019Factory.create(event_name="Other Event")
+        self.e1.org.add(self.org)
+
+    def test_filter_visible(self):
+        events = models.BaseEvent.objects.order_by('pk')
+        self.assertFalse(filter_visible(events, self.user, 'events.view_events').exists())
+
+        self.org.associated_users.add(self.user)
+        CCInstanceFactory.create(event=self.e2, crew_chief=self.user)
+        visible = filter_visible(events, self.user, 'events.view_events')
+        self.assertEqual(list(visible.values_list('pk', flat=True)), [self.e1.pk, self.e2.pk])
+        # Crew chiefs can't flag events
+        self.assertFalse(filter_visible(events, self.user, 'events.edit_event_flags').exists())
+
+        orgs = models.Organization.objects.all()
+        self.assertEqual(list(filter_visible(orgs, self.user, 'events.view_org')), [self.org])
+
+        # Global permissions make everything visible
+        self.user.user_permissions.add(Permission.objects.get(codename='view_events'))
+        self.user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(filter_visible(events, self.user, 'events.view_events').count(), 3)
+
+    def test_has_perm_memoized(self):
+        self.org.associated_users.add(self.user)
+        self.assertTrue(self.user.has_perm('events.view_events', self.e1))
+        # Other permissions granted by the same logics reuse the first lookups
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.user.has_perm('events.event_images', self.e1))
+        self.assertFalse([query for query in queries if 'events_baseevent' in query['sql']])
+        self.assertFalse(self.user.has_perm('events.view_events', self.e3))
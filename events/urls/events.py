@@ -58,6 +58,7 @@ urlpatterns = [
         name="pdf-multi"),
     re_path(r'^bills-pdf/(?P<ids>\d+(,\d+)*)?/?$', pdf_views.generate_event_bill_pdf_multi,
         name="bill-pdf-multi"),
+    re_path(r'^pdf/bundle/(?P<token>[0-9a-f]{32})/$', pdf_views.download_pdf_bundle, name="pdf-bundle"),
     re_path(r'^view/(?P<id>[0-9a-f]+)/pdf/$', pdf_views.generate_event_pdf, name="pdf"),
     re_path(r'^quote/(?P<id>[0-9]+)/$', pdf_views.view_quote, name="view-quote"),
     # re_path(r'^db/events/mk/$', 'events.views.mkedrm.eventnew', name="event-new"),
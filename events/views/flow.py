@@ -20,7 +20,7 @@ from reversion.models import Version
 
 from accounts.models import UserPreferences
 from emails.generators import (ReportReminderEmailGenerator, EventEmailGenerator, BillingEmailGenerator,
-                               DefaultLNLEmailGenerator as DLEG, send_survey_if_necessary)
+                               DefaultLNLEmailGenerator as DLEG, queue_batch, send_survey_if_necessary)
 from slack.views import cc_report_reminder
 from slack.api import lookup_user, slack_post
 from events.forms import (
@@ -241,7 +241,7 @@ def reviewremind(request, id, uid):
 
             reminder = ReportReminder.objects.create(event=cci.event, crew_chief=cci.crew_chief)
             email = ReportReminderEmailGenerator(reminder=reminder, attachments=attachments)
-            email.send()
+            queue_batch([email])
         if send_notification and prefs.cc_report_reminders in ['slack', 'all']:
             message = "This is a reminder that you have a pending crew chief report for %s." % event.event_name
             blocks = cc_report_reminder(cci)
@@ -277,20 +277,21 @@ def remindall(request, id):
     filename = "%s.workorder.pdf" % slugify(event.event_name)
     attachments = [{"file_handle": pdf_handle, "name": filename}]
 
+    emails = []
     for cci in event.crew_needing_reports:
         prefs, created = UserPreferences.objects.get_or_create(user=cci.crew_chief)
         if cci.crew_chief == request.user and prefs.ignore_user_action:
             continue
         if prefs.cc_report_reminders in ['email', 'all']:
             reminder = ReportReminder.objects.create(event=event, crew_chief=cci.crew_chief)
-            email = ReportReminderEmailGenerator(reminder=reminder, attachments=attachments)
-            email.send()
+            emails.append(ReportReminderEmailGenerator(reminder=reminder, attachments=attachments))
         if prefs.cc_report_reminders in ['slack', 'all']:
             message = "This is a reminder that you have a pending crew chief report for %s." % event.event_name
             blocks = cc_report_reminder(cci)
             slack_user = lookup_user(cci.crew_chief.email)
             if slack_user:
                 slack_post(slack_user, text=message, content=blocks)
+    queue_batch(emails)
 
     messages.add_message(request, messages.INFO, 'Reminders sent to all crew chiefs needing reports for %s' %
                          event.event_name)
@@ -1466,7 +1467,7 @@ class BillingEmailCreate(SetFormMsgMixin, HasPermMixin, LoginRequiredMixin, Crea
         filename = "%s-bill.pdf" % slugify(event.event_name)
         attachments = [{"file_handle": pdf_handle, "name": filename}]
         email = BillingEmailGenerator(event=event, subject=i.subject, body=i.message, to_emails=to, attachments=attachments)
-        email.send()
+        queue_batch([email])
         i.sent_at = timezone.now()
         i.save()
         return response
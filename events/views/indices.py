@@ -3,12 +3,12 @@ import os
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
-from django.db.models import Avg, Count, Q
+from django.db.models import Q
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, reverse
 from django.utils import timezone
 
-from events.charts import SurveyVpChart, SurveyCrewChart, SurveyPricelistChart, SurveyLnlChart
+from events.charts import SurveyVpChart, SurveyCrewChart, SurveyPricelistChart, SurveyLnlChart, recent_survey_results
 from events.models import BaseEvent, Workshop
 from helpers.challenges import is_officer
 from pages.models import OnboardingScreen, OnboardingRecord
@@ -121,11 +121,8 @@ def survey_dashboard(request):
                                                                                'overall': 0},
                'num_eligible_events': BaseEvent.objects.filter(approved=True, datetime_start__gte=year_ago,
                                                                datetime_end__lt=now).distinct().count()}
-    events = BaseEvent.objects \
-        .filter(approved=True, datetime_start__gte=year_ago, datetime_end__lt=now) \
-        .filter(surveys__isnull=False) \
-        .distinct()
-    context['num_events'] = events.count()
+    results = recent_survey_results()
+    context['num_events'] = len(results)
     context['response_rate'] = 0 if context['num_eligible_events'] == 0 else \
         context['num_events'] / float(context['num_eligible_events']) * 100
     if context['num_events'] > 0:
@@ -133,53 +130,7 @@ def survey_dashboard(request):
         crew_denominator = 0
         pricelist_denominator = 0
         overall_denominator = 0
-        i = context['num_events']
-        for event in events:
-            survey_results = {}
-            survey_results.update(event.surveys.filter(services_quality__gte=0).aggregate(
-                Avg('services_quality'),
-                Count('services_quality'),
-            ))
-            survey_results.update(event.surveys.filter(lighting_quality__gte=0).aggregate(
-                Avg('lighting_quality'),
-                Count('lighting_quality'),
-            ))
-            survey_results.update(event.surveys.filter(sound_quality__gte=0).aggregate(
-                Avg('sound_quality'),
-                Count('sound_quality'),
-            ))
-            survey_results.update(event.surveys.filter(work_order_experience__gte=0).aggregate(
-                Avg('work_order_experience'),
-                Count('work_order_experience'),
-            ))
-            survey_results.update(event.surveys.filter(work_order_ease__gte=0).aggregate(
-                Avg('work_order_ease'),
-                Count('work_order_ease'),
-            ))
-            survey_results.update(event.surveys.filter(communication_responsiveness__gte=0).aggregate(
-                Avg('communication_responsiveness'),
-                Count('communication_responsiveness'),
-            ))
-            survey_results.update(event.surveys.filter(pricelist_ux__gte=0).aggregate(
-                Avg('pricelist_ux'),
-                Count('pricelist_ux'),
-            ))
-            survey_results.update(event.surveys.filter(setup_on_time__gte=0).aggregate(
-                Avg('setup_on_time'),
-                Count('setup_on_time'),
-            ))
-            survey_results.update(event.surveys.filter(crew_respectfulness__gte=0).aggregate(
-                Avg('crew_respectfulness'),
-                Count('crew_respectfulness'),
-            ))
-            survey_results.update(event.surveys.filter(price_appropriate__gte=0).aggregate(
-                Avg('price_appropriate'),
-                Count('price_appropriate'),
-            ))
-            survey_results.update(event.surveys.filter(customer_would_return__gte=0).aggregate(
-                Avg('customer_would_return'),
-                Count('customer_would_return'),
-            ))
+        for event, survey_results in results:
             try:
                 vp = survey_results['communication_responsiveness__avg']
             except TypeError:
@@ -3,7 +3,8 @@ import re
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Count, F, Q, Sum, Case, When, IntegerField
+from django.db.models import Count, F, Q, Sum, Case, When, CharField, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.forms.models import modelformset_factory
 from django.http.response import HttpResponseRedirect
 from django.views.generic.edit import DeleteView
@@ -13,7 +14,9 @@ from django.utils.http import urlencode
 from django.utils.timezone import make_aware
 
 from helpers.mixins import HasPermMixin, LoginRequiredMixin, SetFormMsgMixin
-from events.models import BaseEvent, Event2019, Category, MultiBilling, Workshop, WorkshopDate
+from helpers.pagination import keyset_paginate
+from events.models import (BaseEvent, Billing, CCReport, Event2019, EventCCInstance, Category, MultiBilling,
+                           ServiceInstance, Workshop, WorkshopDate)
 from events.forms import WorkshopForm, WorkshopDatesForm
 
 DEFAULT_ENTRY_COUNT = 40
@@ -95,16 +98,103 @@ def datefilter(eventqs, context, start=None, end=None):
 
 # paginator helper
 
+def count_subquery(queryset, outer_field='event'):
+    """ Annotation counting the rows of a queryset filtered on OuterRef (0 if there are none) """
+    counts = queryset.order_by().values(outer_field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def status_annotation(model):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return Case(
+        When(cancelled=True, then=Value("Cancelled")),
+        When(closed=True, then=Value("Closed")),
+        When(approved=True, datetime_setup_complete__gt=now, reviewed=False, then=Value("Approved")),
+        When(approved=False, then=Value("Awaiting Approval")),
+        When(reviewed=False, then=Value("Awaiting Review")),
+        When(billing_status='paid', then=Value("Paid")),
+        When(billing_status='unpaid', then=Value("Awaiting Payment")),
+        default=Value("To Be Billed"),
+        output_field=CharField()
+    )
+
+
+def num_crew_needing_reports_annotation(model):
+    reports = CCReport.objects.filter(event=OuterRef('event'), crew_chief=OuterRef('crew_chief'))
+    return count_subquery(EventCCInstance.objects.filter(event=OuterRef('pk')).filter(~Exists(reports)))
+
+
+def crew_chief_annotation(model):
+    return count_subquery(EventCCInstance.objects.filter(event=OuterRef('pk')))
+
+
+def eventcount_annotation(model):
+    categories = ServiceInstance.objects.filter(event=OuterRef('pk')).order_by().values('event') \
+        .annotate(count=Count('service__category', distinct=True)).values('count')
+    categories = Coalesce(Subquery(categories, output_field=IntegerField()), 0)
+    if model is BaseEvent:
+        # 2012 events keep their service count in a field
+        return Coalesce(F('event__ccs_needed'), categories, output_field=IntegerField())
+    return categories
+
+
+def times_billed_annotation(model):
+    return count_subquery(Billing.objects.filter(event=OuterRef('pk'))) + \
+        count_subquery(MultiBilling.events.through.objects.filter(baseevent=OuterRef('pk')), 'baseevent')
+
+
+def last_billed_annotation(model):
+    return Coalesce(
+        Subquery(Billing.objects.filter(event=OuterRef('pk')).order_by('-date_billed').values('date_billed')[:1]),
+        Subquery(MultiBilling.objects.filter(events=OuterRef('pk')).order_by('-date_billed').values('date_billed')[:1])
+    )
+
+
+def last_paid_annotation(model):
+    return Coalesce(
+        Subquery(Billing.objects.filter(event=OuterRef('pk'), date_paid__isnull=False).order_by('-date_paid')
+                 .values('date_paid')[:1]),
+        Subquery(MultiBilling.objects.filter(events=OuterRef('pk'), date_paid__isnull=False).order_by('-date_paid')
+                 .values('date_paid')[:1])
+    )
+
+
+# Computed event columns (FakeFields) that the database can sort, mapped to functions that take the queryset's model
+# and return an equivalent annotation
+SORT_ANNOTATIONS = {
+    'status': status_annotation,
+    'num_crew_needing_reports': num_crew_needing_reports_annotation,
+    'crew_chief': crew_chief_annotation,
+    'eventcount': eventcount_annotation,
+    'times_billed': times_billed_annotation,
+    'last_billed': last_billed_annotation,
+    'last_paid': last_paid_annotation,
+}
+
+# Computed event columns that can only be sorted in Python, mapped to functions that load what they need in bulk first
+SORT_PREFETCHES = {
+    'cost_total': lambda queryset: queryset.with_costs(),
+}
+
+
 def paginate_helper(queryset, page, sort=None, count=DEFAULT_ENTRY_COUNT):
-    names = map(lambda f: f.name, queryset.model._meta.get_fields())
-    if sort and ((sort in names) or (sort[0] == '-' and sort[1:] in names)):
+    names = [f.name for f in queryset.model._meta.get_fields()]
+    descending = bool(sort) and sort[0] == '-'
+    key = sort[1:] if descending else sort
+    if sort and key in names:
         post_sort = queryset.order_by(sort)
+    elif sort and key in SORT_ANNOTATIONS and issubclass(queryset.model, BaseEvent):
+        annotation = SORT_ANNOTATIONS[key](queryset.model)
+        ordering = F('sort_value').desc(nulls_last=True) if descending else F('sort_value').asc(nulls_last=True)
+        post_sort = queryset.annotate(sort_value=annotation).order_by(ordering, *queryset.model._meta.ordering)
     elif sort:
+        if key in SORT_PREFETCHES and hasattr(queryset, 'with_costs'):
+            queryset = SORT_PREFETCHES[key](queryset)
         try:
-            if sort[0] == '-':
-                post_sort = sorted(queryset.all(), key=lambda m: getattr(m, sort[1:]), reverse=True)
+            if descending:
+                post_sort = sorted(queryset.all(), key=lambda m: getattr(m, key), reverse=True)
             else:
-                post_sort = sorted(queryset.all(), key=lambda m: getattr(m, sort))
+                post_sort = sorted(queryset.all(), key=lambda m: getattr(m, key))
         except Exception:
             # print "Won't sort.", e
             post_sort = queryset
@@ -150,7 +240,7 @@ def build_redirect(request, **kwargs):
 
 
 def filter_events(request, context, events, start, end, prefetch_org=False, prefetch_cc=False, prefetch_billing=False,
-                  hide_unapproved=False, event2019=False, sort='-datetime_start'):
+                  prefetch_costs=False, hide_unapproved=False, event2019=False, sort='-datetime_start'):
     """
     Filter a queryset of events based on specified criteria
 
@@ -164,10 +254,12 @@ def filter_events(request, context, events, start, end, prefetch_org=False, pref
     items based on building
     :param prefetch_billing: Boolean - If true, prefetch related items based on client or crew chiefs and select \
     related items based on building
+    :param prefetch_costs: Boolean - If true, compute the cost breakdowns for the listed events in bulk
     :param hide_unapproved: Boolean - If true, exclude events that have not been approved
     :param event2019: Boolean - If true, queryset only contains Event2019 objects
-    :param sort: String - Default field to sort by (prepend "-" for reverse)
-    :returns: Queryset of events and updated context dictionary
+    :param sort: String - Default field to sort by (prepend "-" for reverse). Lists sorted by start time are paginated \
+    with a cursor instead of page numbers.
+    :returns: Page of events and updated context dictionary
     """
     if not request.user.has_perm('events.view_hidden_event'):
         events = events.exclude(sensitive=True)
@@ -182,6 +274,8 @@ def filter_events(request, context, events, start, end, prefetch_org=False, pref
         events = events.prefetch_related('org')
     else:
         events = events.select_related('location__building').prefetch_related('org')
+    if prefetch_costs:
+        events = events.with_costs()
     if event2019:
         if request.GET.get('projection') == 'hide':
             events = events.exclude(
@@ -206,7 +300,12 @@ def filter_events(request, context, events, start, end, prefetch_org=False, pref
 
     page = request.GET.get('page')
     sort = request.GET.get('sort') or sort
-    events = paginate_helper(events, page, sort)
+    if sort in ('datetime_start', '-datetime_start') and page in (None, '', '1'):
+        # Walk chronological lists with a cursor so deep pages don't need an OFFSET scan or a COUNT
+        events = keyset_paginate(events, request.GET.get('cursor'), DEFAULT_ENTRY_COUNT,
+                                 descending=sort.startswith('-'))
+    else:
+        events = paginate_helper(events, page, sort)
     context['pagninate_next_label'] = "Older" if '-datetime_start' in sort else "Newer"
     context['pagninate_last_label'] = "Newer" if '-datetime_start' in sort else "Older"                                                                 
     return events, context
@@ -635,7 +734,7 @@ def unbilled(request, start=None, end=None):
         return build_redirect(request, projection=request.COOKIES['projection'], **request.GET.dict())
 
     events = BaseEvent.objects.filter(closed=False).filter(reviewed=True)\
-        .filter(billings__isnull=True, multibillings__isnull=True).filter(billed_in_bulk=False).distinct()
+        .filter(billing_status='unbilled').filter(billed_in_bulk=False).distinct()
     events, context = filter_events(request, context, events, start, end, prefetch_billing=True, sort='datetime_start')
     context['h2'] = "Events to be Billed"
     context['events'] = events
@@ -684,7 +783,7 @@ def unbilled_semester(request, start=None, end=None):
         return build_redirect(request, projection=request.COOKIES['projection'], **request.GET.dict())
 
     events = BaseEvent.objects.filter(closed=False).filter(reviewed=True)\
-        .filter(billings__isnull=True, multibillings__isnull=True).filter(billed_in_bulk=True).distinct()
+        .filter(billing_status='unbilled').filter(billed_in_bulk=True).distinct()
     events, context = filter_events(request, context, events, start, end, prefetch_billing=True, sort='datetime_start')
 
     context['h2'] = "Events to be Billed in Bulk"
@@ -733,8 +832,7 @@ def paid(request, start=None, end=None):
         return build_redirect(request, projection=request.COOKIES['projection'], **request.GET.dict())
 
     # events = Event.objects.filter(approved=True).filter(paid=True)
-    events = BaseEvent.objects.filter(closed=False).filter(Q(billings__date_paid__isnull=False) |
-                                                           Q(multibillings__date_paid__isnull=False)).distinct()
+    events = BaseEvent.objects.filter(closed=False).filter(billing_status='paid').distinct()
     events, context = filter_events(request, context, events, start, end, prefetch_billing=True)
 
     context['h2'] = "Paid Events"
@@ -781,12 +879,11 @@ def unpaid(request, start=None, end=None):
             and request.COOKIES['projection'] != 'show'):
         return build_redirect(request, projection=request.COOKIES['projection'], **request.GET.dict())
 
-    events = BaseEvent.objects.annotate(numpaid=Count('billings__date_paid')+Count('multibillings__date_paid'))\
-        .filter(Q(billings__isnull=False) | Q(multibillings__isnull=False)).exclude(closed=True)\
-        .exclude(numpaid__gt=0).filter(reviewed=True) \
+    events = BaseEvent.objects.filter(billing_status='unpaid').exclude(closed=True).filter(reviewed=True) \
         .exclude(billings__isnull=False, Event2019___workday_fund__isnull=False, Event2019___worktag__isnull=False) \
         .exclude(billings__isnull=False, Event2019___entered_into_workday=True).distinct()
-    events, context = filter_events(request, context, events, start, end, prefetch_billing=True, sort='datetime_start')
+    events, context = filter_events(request, context, events, start, end, prefetch_billing=True, prefetch_costs=True,
+                                    sort='datetime_start')
 
     context['h2'] = "Pending Payments"
     context['events'] = events
@@ -835,8 +932,9 @@ def awaitingworkday(request, start=None, end=None):
     events = Event2019.objects.filter(closed=False)\
         .filter(reviewed=True, billings__isnull=False, workday_fund__isnull=False, worktag__isnull=False,
                 entered_into_workday=False) \
-        .exclude(Q(billings__date_paid__isnull=False) | Q(multibillings__date_paid__isnull=False)).distinct()
-    events, context = filter_events(request, context, events, start, end, prefetch_billing=True, event2019=True, sort='datetime_start')
+        .exclude(billing_status='paid').distinct()
+    events, context = filter_events(request, context, events, start, end, prefetch_billing=True, prefetch_costs=True,
+                                    event2019=True, sort='datetime_start')
 
     context['h2'] = "Events to Enter Into Workday"
     context['events'] = events
@@ -873,8 +971,8 @@ def unpaid_workday(request, start=None, end=None):
             and request.COOKIES['projection'] != 'show'):
         return build_redirect(request, projection=request.COOKIES['projection'], **request.GET.dict())
 
-    events = Event2019.objects.annotate(numpaid=Count('billings__date_paid')+Count('multibillings__date_paid')) \
-        .filter(closed=False, reviewed=True, entered_into_workday=True).exclude(numpaid__gt=0).distinct()
+    events = Event2019.objects.filter(closed=False, reviewed=True, entered_into_workday=True) \
+        .exclude(billing_status='paid').distinct()
     events, context = filter_events(request, context, events, start, end, prefetch_org=True, event2019=True, sort='datetime_start')
 
     context['h2'] = "Pending Workday ISDs"
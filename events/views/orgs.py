@@ -18,6 +18,7 @@ import reversion
 from emails.generators import generate_transfer_email
 from events.forms import (ExternalOrgUpdateForm, IOrgForm, IOrgVerificationForm, OrgXFerForm)
 from events.models import (BaseEvent, Organization, OrganizationTransfer, OrgBillingVerificationEvent)
+from events.perms import filter_visible
 from helpers.mixins import HasPermMixin, LoginRequiredMixin, SetFormMsgMixin
 from helpers.revision import set_revision_comment
 
@@ -101,8 +102,8 @@ def orgdetail(request, org_id):
         raise PermissionDenied
     context['org'] = org
     context['history'] = Version.objects.get_for_object(org)
-    context['events'] = BaseEvent.objects.filter(org=org).prefetch_related('hours__user', 'ccinstances__crew_chief',
-                                                                           'location', 'org')
+    events = filter_visible(BaseEvent.objects.filter(org=org), request.user, 'events.view_events')
+    context['events'] = events.prefetch_related('hours__user', 'ccinstances__crew_chief', 'location', 'org')
     return render(request, 'org_detail.html', context)
 
 
@@ -0,0 +1,96 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class KeysetPage(object):
+    """
+    A page of results fetched by seeking past a cursor rather than with OFFSET. No COUNT query is needed, so later
+    pages cost the same as the first one.
+    """
+    paginator = None
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(obj, field, reverse=False):
+    """ Build an opaque cursor pointing just past (or, if reverse, just before) an object """
+    position = "%s|%s|%s" % ('p' if reverse else 'n', getattr(obj, field).isoformat(), obj.pk)
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Returns a (reverse, value, pk) tuple for a cursor, or None if it is missing or invalid """
+    if not cursor:
+        return None
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, value, pk = position.split('|')
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in ('n', 'p') or value is None:
+        return None
+    return direction == 'p', value, pk
+
+
+def keyset_paginate(queryset, cursor=None, count=40, field='datetime_start', descending=False):
+    """
+    Paginate a queryset on (field, pk) using a cursor from a previous page
+
+    :param queryset: The queryset to paginate (any existing ordering is replaced)
+    :param cursor: Cursor string from a previous page's next_cursor or previous_cursor (Optional)
+    :param count: Maximum number of objects on a page
+    :param field: Name of the (unique together with pk) datetime field to order by
+    :param descending: Boolean - If true, the newest objects come first
+    :returns: KeysetPage
+    """
+    position = decode_cursor(cursor)
+    reverse = position is not None and position[0]
+    # Walking backwards is the same as walking forwards with the ordering flipped
+    flipped = descending != reverse
+    ordering = ('-%s' % field, '-pk') if flipped else (field, 'pk')
+    if position is not None:
+        value, pk = position[1:]
+        lookup = 'lt' if flipped else 'gt'
+        queryset = queryset.filter(Q(**{'%s__%s' % (field, lookup): value}) |
+                                   Q(**{field: value, 'pk__%s' % lookup: pk}))
+
+    # Fetch one extra row to find out whether there is anything beyond this page
+    objects = list(queryset.order_by(*ordering)[:count + 1])
+    has_more = len(objects) > count
+    objects = objects[:count]
+    if reverse:
+        objects.reverse()
+    if not objects:
+        return KeysetPage(objects)
+
+    has_next = has_more if not reverse else True
+    has_previous = has_more if reverse else position is not None
+    return KeysetPage(objects,
+                      encode_cursor(objects[-1], field) if has_next else None,
+                      encode_cursor(objects[0], field, True) if has_previous else None)
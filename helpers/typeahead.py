@@ -0,0 +1,127 @@
+"""
+In-process trigram index for autocomplete (ajax_select) lookups.
+
+Typeahead queries match search terms anywhere in a handful of short text fields, which no index in MySQL or SQLite can
+serve. Instead, each process keeps the searchable fields of every row in memory along with a trigram index over them.
+Lookups resolve the matching primary keys locally and only ask the database for those rows (so any other filters and
+the ordering are still applied by the database).
+"""
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+
+from django.db.models import Q, signals
+
+# Past this many matches the query is barely selective, so it is cheaper to let the database scan than to send a huge
+# list of primary keys
+MAX_MATCHES = 1000
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class TypeaheadIndex(object):
+    """
+    Trigram index over some text fields of a model. Every search term has to be found (case-insensitively) in at least
+    one of the fields, just like OR'ed ``icontains`` filters for each term.
+
+    The index is rebuilt every `ttl` seconds. Rows saved or deleted in this process are updated right away, and rows
+    created elsewhere are picked up on the next search.
+    """
+
+    def __init__(self, model, fields, ttl=300):
+        self.model = model
+        self.fields = tuple(fields)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._built = None
+        self._max_pk = 0
+        self._values = {}
+        self._grams = defaultdict(set)
+        signals.post_save.connect(self._saved, sender=model, weak=False)
+        signals.post_delete.connect(self._deleted, sender=model, weak=False)
+
+    def _add(self, pk, row):
+        values = tuple((value or '').lower() for value in row)
+        self._values[pk] = values
+        for value in values:
+            for gram in trigrams(value):
+                self._grams[gram].add(pk)
+        self._max_pk = max(self._max_pk, pk)
+
+    def _remove(self, pk):
+        values = self._values.pop(pk, None)
+        if values is None:
+            return
+        for value in values:
+            for gram in trigrams(value):
+                self._grams[gram].discard(pk)
+
+    def _load(self, **filters):
+        for row in self.model._base_manager.filter(**filters).values_list('pk', *self.fields).iterator():
+            self._add(row[0], row[1:])
+
+    def _refresh(self):
+        if self._built is None or time.monotonic() - self._built > self.ttl:
+            self._values = {}
+            self._grams = defaultdict(set)
+            self._max_pk = 0
+            self._load()
+            self._built = time.monotonic()
+        else:
+            self._load(pk__gt=self._max_pk)
+
+    def _saved(self, sender, instance, **kwargs):
+        with self._lock:
+            if self._built is not None:
+                self._remove(instance.pk)
+                self._add(instance.pk, [getattr(instance, field) for field in self.fields])
+
+    def _deleted(self, sender, instance, **kwargs):
+        with self._lock:
+            self._remove(instance.pk)
+
+    def _match_term(self, term):
+        if len(term) < 3:
+            candidates = self._values.keys()
+        else:
+            postings = sorted((self._grams.get(gram, set()) for gram in trigrams(term)), key=len)
+            candidates = reduce(set.intersection, postings[1:], set(postings[0]))
+        return {pk for pk in candidates if any(term in value for value in self._values[pk])}
+
+    def search(self, q):
+        """
+        Find the rows matching every term in a query
+
+        :param q: The search query
+        :return: Set of primary keys
+        """
+        terms = q.lower().split()
+        with self._lock:
+            self._refresh()
+            if not terms:
+                return set(self._values)
+            matches = None
+            for term in terms:
+                found = self._match_term(term)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    break
+            return matches
+
+    def filter(self, queryset, q):
+        """
+        Limit a queryset to the rows matching every term in a query
+
+        :param queryset: QuerySet of the indexed model
+        :param q: The search query
+        :return: QuerySet
+        """
+        pks = self.search(q)
+        if len(pks) <= MAX_MATCHES:
+            return queryset.filter(pk__in=pks)
+        for term in q.split():
+            queryset = queryset.filter(reduce(Q.__or__, (Q(**{field + '__icontains': term}) for field in self.fields)))
+        return queryset
@@ -1,4 +1,3 @@
-from io import BytesIO
 import json
 import re
 import requests
@@ -13,11 +12,10 @@ from django.http import (HttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.template.loader import render_to_string
 from django.utils import timezone
-from xhtml2pdf import pisa
 
 from . import forms, models, api
 from emails.generators import DefaultLNLEmailGenerator
-from pdfs.views import link_callback
+from pdfs.views import pisa_to_pdf
 
 NUM_IN_PAGE = 25
 
@@ -449,9 +447,7 @@ def generate_receipt(request, data, renter, checkin=False):
             'checkout_to': renter,
         })
         action = "checkout"
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-    pdf_handle = pdf_file.getvalue()
+    pdf_handle = pisa_to_pdf(html)
     filename = 'LNL-{}-receipt-{}.pdf'.format(action, timezone.now().isoformat())
     attachments = [{'file_handle': pdf_handle, 'name': filename}]
     email = DefaultLNLEmailGenerator(subject='LNL Inventory {} Receipt'.format(action.capitalize()),
@@ -604,9 +600,7 @@ def old_snipe_checkout(request):
                 'total_rental_price': total_rental_price,
                 'checkout_to': checkout_to_name,
             })
-            pdf_file = BytesIO()
-            pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-            pdf_handle = pdf_file.getvalue()
+            pdf_handle = pisa_to_pdf(html)
             filename = 'LNL-checkout-receipt-{}.pdf'.format(timezone.now().isoformat())
             attachments = [{'file_handle': pdf_handle, 'name': filename}]
             email = DefaultLNLEmailGenerator(subject='LNL Inventory Checkout Receipt', to_emails=(request.user.email, settings.EMAIL_TARGET_RENTALS), attachments=attachments,
@@ -816,9 +810,7 @@ def old_snipe_checkin(request):
                 'total_rental_price': total_rental_price,
                 'checkin_from': checkin_from_name,
             })
-            pdf_file = BytesIO()
-            pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-            pdf_handle = pdf_file.getvalue()
+            pdf_handle = pisa_to_pdf(html)
             filename = 'LNL-checkin-receipt-{}.pdf'.format(timezone.now().isoformat())
             attachments = [{'file_handle': pdf_handle, 'name': filename}]
             email = DefaultLNLEmailGenerator(subject='LNL Inventory Checkin Receipt', to_emails=(request.user.email, settings.EMAIL_TARGET_RENTALS), attachments=attachments,
@@ -47,11 +47,22 @@ SNIPE_GENERAL_USER = env.str('SNIPE_USERNAME', "")
 SNIPE_GENERAL_PASS = env.str('SNIPE_PASSWORD', "")
 
 RT_TOKEN = env.str('RT_API_KEY', '')
+RT_TIMEOUT = env.int('RT_TIMEOUT', 10)
+RT_MAX_RETRIES = env.int('RT_MAX_RETRIES', 3)
+RT_MAX_WORKERS = env.int('RT_MAX_WORKERS', 8)
+RT_CACHE_TTL = env.int('RT_CACHE_TTL', 60)
 
 CRYPTO_KEY = env.str('CRYPTO_KEY', '')
 
 TESTING = sys.argv[1:2] == ['test']
 
+# Background tasks (see data.tasks). With no worker threads, tasks run as soon as they are queued.
+TASK_WORKERS = env.int('TASK_WORKERS', 0 if TESTING else 4)
+TASK_QUEUE_SIZE = env.int('TASK_QUEUE_SIZE', 100)
+TASK_STALE_AFTER = env.int('TASK_STALE_AFTER', 600)
+TASK_MAX_ATTEMPTS = env.int('TASK_MAX_ATTEMPTS', 3)
+TASK_RETRY_DELAY = env.int('TASK_RETRY_DELAY', 60)
+
 DEBUG = env.bool("DEBUG", default=True)
 
 SAML2_ENABLED = env.bool('SAML2_ENABLED', default=False)
@@ -104,11 +115,18 @@ GRAPH_API_SCOPE = env.str('GRAPH_API_SCOPE', '')
 GRAPH_API_SECRET = env.str('GRAPH_API_SECRET', '')
 GRAPH_API_ENDPOINT = env.str('GRAPH_API_ENDPOINT', '')
 
+# How long searches of the external user directories are cached for (in seconds). Searches that found nobody expire sooner.
+DIRECTORY_CACHE_TTL = env.int('DIRECTORY_CACHE_TTL', 86400)
+DIRECTORY_NEGATIVE_CACHE_TTL = env.int('DIRECTORY_NEGATIVE_CACHE_TTL', 3600)
+
 SLACK_TOKEN = env.str('SLACK_BOT_TOKEN', None)
 
 # If True, the bot will automatically attempt to join new channels when they are created in Slack
 SLACK_AUTO_JOIN = env.bool('SLACK_AUTO_JOIN', default=False)
 
+# How long channel details, user profiles and email lookups from Slack are cached for (in seconds)
+SLACK_CACHE_TTL = env.int('SLACK_CACHE_TTL', 3600)
+
 SLACK_TARGET_GENERAL = env.str('SLACK_TARGET_GENERAL', None)
 SLACK_TARGET_EXEC = env.str('SLACK_TARGET_EXEC', None)
 SLACK_TARGET_ACTIVE = env.str('SLACK_TARGET_ACTIVE', None)
@@ -159,6 +177,25 @@ MDM_UUID = env.str('MDM_UUID', None)
 MDM_PASS = env.str('MDM_PASS', None)
 MDM_TOKEN = env.str('MDM_TOKEN', 'DEV_TOKEN')
 
+# Post-event survey dashboard (seconds to keep the aggregated results; 0 to disable)
+SURVEY_DASHBOARD_CACHE_TTL = env.int('SURVEY_DASHBOARD_CACHE_TTL', 300)
+
+# Calendar feeds (seconds to keep each rendered calendar entry). Changes are picked up right away by the process that
+# made them, but every other process serves its own copy until it expires unless CACHES points to a shared cache.
+CAL_FRAGMENT_CACHE_TTL = env.int('CAL_FRAGMENT_CACHE_TTL', 300)
+# Days of past and upcoming items included in calendar feeds by default, and the most subscribers can ask for
+CAL_FEED_PAST_DAYS = env.int('CAL_FEED_PAST_DAYS', 365)
+CAL_FEED_FUTURE_DAYS = env.int('CAL_FEED_FUTURE_DAYS', 730)
+CAL_FEED_MAX_DAYS = env.int('CAL_FEED_MAX_DAYS', 3650)
+
+# Rendered PDFs (see pdfs.cache), kept in the default file storage. Maximum total size in bytes; 0 to disable.
+PDF_CACHE_DIR = env.str('PDF_CACHE_DIR', 'pdf_cache')
+PDF_CACHE_MAX_SIZE = env.int('PDF_CACHE_MAX_SIZE', 0 if TESTING else 256 * 1024 * 1024)
+# Processes used to render multi-event PDFs in parallel (0 or 1 to render them one at a time), and how many events a
+# combined PDF can have before it is prepared in the background and emailed instead
+PDF_RENDER_WORKERS = env.int('PDF_RENDER_WORKERS', 0 if TESTING else min(4, os.cpu_count() or 1))
+PDF_BUNDLE_ASYNC_THRESHOLD = env.int('PDF_BUNDLE_ASYNC_THRESHOLD', 50)
+
 # options we don't want in our env variables...
 for key in DATABASES:
     db = DATABASES[key]
@@ -0,0 +1,172 @@
+"""
+Cache for rendered PDFs.
+
+PDFs are stored through the default storage backend under the SHA-256 hash of the HTML they were rendered from (and the
+renderer used), so a document that hasn't changed since it was last generated is simply fetched again. The cache is
+kept under PDF_CACHE_MAX_SIZE bytes by deleting the oldest files first. The total size, along with the number of hits
+and misses, is counted in the database so that every process adds to the same totals. Eviction lists every file in
+the cache, so it is left to the task queue (or ``manage.py pdf_cache --evict``) rather than done while a request waits.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from data.decorators import process_in_thread
+from data.models import Counter
+
+logger = logging.getLogger(__name__)
+
+HITS_KEY = 'pdf_cache:hits'
+MISSES_KEY = 'pdf_cache:misses'
+SIZE_KEY = 'pdf_cache:size'
+
+
+def enabled():
+    return settings.PDF_CACHE_MAX_SIZE > 0
+
+
+def cache_key(html, renderer):
+    digest = hashlib.sha256(renderer.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(html.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_path(key):
+    return '%s/%s/%s.pdf' % (settings.PDF_CACHE_DIR, key[:2], key)
+
+
+def count(key, amount=1):
+    if Counter.objects.filter(name=key).update(value=F('value') + amount):
+        return
+    try:
+        with transaction.atomic():
+            Counter.objects.create(name=key, value=amount)
+    except IntegrityError:
+        # Another process created the counter first
+        Counter.objects.filter(name=key).update(value=F('value') + amount)
+
+
+def counter_value(key):
+    return Counter.objects.filter(name=key).values_list('value', flat=True).first() or 0
+
+
+def cached_files():
+    """ The files in the cache, as a list of (path, size, modified time) tuples """
+    files = []
+    if not default_storage.exists(settings.PDF_CACHE_DIR):
+        return files
+    for prefix in default_storage.listdir(settings.PDF_CACHE_DIR)[0]:
+        directory = '%s/%s' % (settings.PDF_CACHE_DIR, prefix)
+        for name in default_storage.listdir(directory)[1]:
+            path = '%s/%s' % (directory, name)
+            files.append((path, default_storage.size(path), default_storage.get_modified_time(path)))
+    return files
+
+
+def evict(max_size):
+    """
+    Delete the oldest cached PDFs until the cache takes up no more than `max_size` bytes
+
+    :returns: Number of files deleted
+    """
+    files = sorted(cached_files(), key=lambda file: file[2])
+    total = sum(file[1] for file in files)
+    deleted = 0
+    for path, size, modified in files:
+        if total <= max_size:
+            break
+        default_storage.delete(path)
+        total -= size
+        deleted += 1
+    Counter.objects.update_or_create(name=SIZE_KEY, defaults={'value': total})
+    return deleted
+
+
+@process_in_thread(retry=True)
+def trim():
+    """ Bring the cache back under PDF_CACHE_MAX_SIZE, leaving some headroom so that it isn't trimmed for every PDF """
+    evict(int(settings.PDF_CACHE_MAX_SIZE * 0.9))
+
+
+def get(key):
+    path = cache_path(key)
+    try:
+        with default_storage.open(path, 'rb') as f:
+            return f.read()
+    except Exception:
+        # Missing files (and storage errors, which vary by backend) are treated as a miss
+        return None
+
+
+def store(key, pdf):
+    default_storage.save(cache_path(key), ContentFile(pdf))
+    count(SIZE_KEY, len(pdf))
+    size = counter_value(SIZE_KEY)
+    # Only the PDF that takes the cache over the limit queues a trim
+    if size - len(pdf) <= settings.PDF_CACHE_MAX_SIZE < size:
+        trim()
+
+
+def lookup(html, renderer):
+    """
+    Look for a cached PDF, counting the hit or miss
+
+    :returns: The cache key and the cached PDF (`None` if there isn't one)
+    """
+    key = cache_key(html, renderer)
+    pdf = get(key)
+    count(HITS_KEY if pdf is not None else MISSES_KEY)
+    return key, pdf
+
+
+def save(key, pdf):
+    """ Add a freshly rendered PDF to the cache (unless another process beat us to it) """
+    try:
+        if not default_storage.exists(cache_path(key)):
+            store(key, pdf)
+    except Exception:
+        # The PDF is still good even if the cache isn't working
+        logger.exception("Unable to save PDF to cache")
+
+
+def render(html, renderer, method):
+    """
+    Return the cached PDF for some HTML, rendering (and caching) it if there isn't one
+
+    :param html: The HTML to render
+    :param renderer: Name of the rendering method, so that the same HTML rendered differently is cached separately
+    :param method: Function that takes the HTML and returns the PDF as bytes
+    :returns: PDF file contents
+    """
+    if not enabled():
+        return method(html)
+    key, pdf = lookup(html, renderer)
+    if pdf is None:
+        pdf = method(html)
+        save(key, pdf)
+    return pdf
+
+
+def stats():
+    """ Cache hits and misses since the counters were last reset, along with the current size of the cache """
+    files = cached_files()
+    counters = dict(Counter.objects.filter(name__in=[HITS_KEY, MISSES_KEY]).values_list('name', 'value'))
+    return {
+        'hits': counters.get(HITS_KEY, 0),
+        'misses': counters.get(MISSES_KEY, 0),
+        'files': len(files),
+        'size': sum(file[1] for file in files),
+    }
+
+
+def clear():
+    """ Delete every cached PDF and reset the counters """
+    for path, size, modified in cached_files():
+        default_storage.delete(path)
+    Counter.objects.filter(name__in=[HITS_KEY, MISSES_KEY, SIZE_KEY]).delete()
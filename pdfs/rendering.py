@@ -0,0 +1,159 @@
+"""
+Long-lived state shared by the PDF renderers.
+
+Static files referenced by the PDF templates (the logo and the Helvetica Neue fonts) are looked up once and kept in
+memory, and the WeasyPrint font configuration, along with the stylesheet that registers those fonts, is built once per
+thread instead of for every document.
+"""
+import mimetypes
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from weasyprint import CSS
+try:
+    from weasyprint.text.fonts import FontConfiguration
+except ModuleNotFoundError:
+    from weasyprint.fonts import FontConfiguration
+
+FONT_CSS = """
+@font-face {
+    font-family: 'Helvetica-Neue';
+    src: url('file:///static/fonts/HelveticaNeue.ttf');
+}
+
+@font-face {
+    font-family: 'Helvetica-Neue';
+    src: url('file:///static/fonts/HelveticaNeueBold.ttf');
+    font-weight: bold;
+}
+
+@font-face {
+    font-family: 'Helvetica-Neue';
+    src: url('file:///static/fonts/HelveticaNeueItalic.ttf');
+    font-style: italic;
+}
+
+@font-face {
+    font-family: 'Helvetica-Neue';
+    src: url('file:///static/fonts/HelveticaNeueBoldItalic.ttf');
+    font-weight: bold;
+    font-style: italic;
+}
+"""
+
+# Static files used by the PDF templates, loaded as soon as a renderer is set up
+PRELOAD = ('img/pdf-lnl-logo.png', 'fonts/HelveticaNeue.ttf', 'fonts/HelveticaNeueBold.ttf',
+           'fonts/HelveticaNeueItalic.ttf', 'fonts/HelveticaNeueBoldItalic.ttf')
+
+
+class AssetMap(object):
+    """
+    Resolves the URIs used in PDF templates to files, remembering where each one was found. The contents of static
+    files are kept in memory as well (media files are user uploads that may change, so those are always read again).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._contents = {}
+
+    def path(self, uri):
+        """
+        Convert a static or media URI to an absolute system path
+
+        :raises Exception: If the URI doesn't point to a static or media file
+        """
+        path = self._paths.get(uri)
+        if path is not None:
+            return path
+
+        # use short variable names
+        surl = settings.STATIC_URL  # Typically /static/
+        sroot = settings.STATIC_ROOT  # Typically /home/userX/project_static/
+        murl = settings.MEDIA_URL  # Typically /static/media/
+        mroot = settings.MEDIA_ROOT  # Typically /home/userX/project_static/media/
+
+        # convert URIs to absolute system paths
+        if murl and uri.startswith(murl):
+            path = os.path.join(mroot, uri.replace(murl, ""))
+        elif surl and uri.startswith(surl):
+            search_url = uri.replace(surl, "")
+            path = finders.find(search_url) or os.path.join(sroot, search_url)
+        else:
+            path = ""
+
+        # make sure that file exists
+        if not os.path.isfile(path):
+            raise Exception('media URI must start with %s or %s' % (surl, murl))
+        with self._lock:
+            self._paths[uri] = path
+        return path
+
+    def read(self, uri):
+        """ The contents of the file a static or media URI points to """
+        contents = self._contents.get(uri)
+        if contents is not None:
+            return contents
+        with open(self.path(uri), 'rb') as f:
+            contents = f.read()
+        if not (settings.MEDIA_URL and uri.startswith(settings.MEDIA_URL)):
+            with self._lock:
+                self._contents[uri] = contents
+        return contents
+
+    def preload(self, names):
+        """ Read static files into memory ahead of time. Files that can't be found are skipped. """
+        for name in names:
+            try:
+                self.read(settings.STATIC_URL + name)
+            except Exception:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._paths = {}
+            self._contents = {}
+
+
+assets = AssetMap()
+
+
+def url_fetcher(url):
+    """ a callback for weasyprint to fetch static files """
+    if url.startswith("file://"):
+        uri = url[7:]
+        return {
+            'string': assets.read(uri),
+            'mime_type': mimetypes.guess_type(uri)[0],
+            'redirected_url': url,
+        }
+    else:
+        raise Exception('Non-local files are not implemented for safety reasons')
+
+
+class RenderContext(object):
+    """ WeasyPrint objects that are expensive to set up and can be shared by every document a thread renders """
+
+    def __init__(self):
+        assets.preload(PRELOAD)
+        self.font_config = FontConfiguration()
+        self.stylesheets = [CSS(string=FONT_CSS, font_config=self.font_config, url_fetcher=url_fetcher)]
+
+
+_local = threading.local()
+
+
+def get_context():
+    """ The current thread's rendering context, set up the first time it is needed """
+    context = getattr(_local, 'context', None)
+    if context is None:
+        context = _local.context = RenderContext()
+    return context
+
+
+def reset():
+    """ Forget all loaded assets and this thread's rendering context (the next render starts cold) """
+    assets.clear()
+    _local.context = None
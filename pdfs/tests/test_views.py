@@ -1,16 +1,22 @@
 import datetime
+import re
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
 
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from pypdf import PdfReader
 from io import BytesIO
 
 from events.tests.generators import EventFactory, Event2019Factory, UserFactory, ServiceFactory
-from events.models import ExtraInstance, Extra, Category, MultiBilling, Organization, Lighting, ServiceInstance, \
+from events.models import BaseEvent, ExtraInstance, Extra, Category, MultiBilling, Organization, Lighting, ServiceInstance, \
     Pricelist, Discount, Fee, DiscountPrice, FeePrice, Rental, Quote
-from .. import views
+from .. import cache as pdf_cache, rendering, views
 
 
 class PdfViewTest(TestCase):
@@ -183,6 +189,62 @@ class PdfViewTest(TestCase):
         # test with the new template
         self.assertIsNotNone(views.generate_event_bill_pdf_standalone(event=self.e5))
 
+    def test_rendering_context(self):
+        rendering.reset()
+        logo = settings.STATIC_URL + 'img/pdf-lnl-logo.png'
+        path = views.link_callback(logo, "")
+        self.assertTrue(path.endswith('pdf-lnl-logo.png'))
+
+        # Static files are served from memory once they have been read
+        fetched = views.url_fetcher('file://' + logo)
+        self.assertEqual(fetched['mime_type'], 'image/png')
+        with open(path, 'rb') as f:
+            self.assertEqual(fetched['string'], f.read())
+        self.assertIs(views.url_fetcher('file://' + logo)['string'], fetched['string'])
+
+        with self.assertRaises(Exception):
+            views.url_fetcher('https://example.com/logo.png')
+
+        # The WeasyPrint setup is reused by every render on this thread
+        self.assertIs(rendering.get_context(), rendering.get_context())
+        self.assertIsNotNone(views.generate_event_bill_pdf_standalone(event=self.e5))
+
+    def test_pdf_cache(self):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, PDF_CACHE_MAX_SIZE=10 * 1024 * 1024):
+            pdf_cache.clear()
+            pdf = views.generate_pdfs_standalone([self.e.pk])
+            self.assertEqual(pdf_cache.stats()['misses'], 1)
+            self.assertEqual(pdf_cache.stats()['files'], 1)
+
+            # The same workorder comes straight out of the cache
+            self.assertEqual(views.generate_pdfs_standalone([self.e.pk]), pdf)
+            self.assertEqual(pdf_cache.stats()['hits'], 1)
+
+            # The counters are shared by every process, not kept in the local memory cache
+            cache.clear()
+            self.assertEqual(pdf_cache.stats()['hits'], 1)
+
+            # Different HTML is cached separately
+            views.generate_pdfs_standalone([self.e2.pk])
+            stats = pdf_cache.stats()
+            self.assertEqual((stats['hits'], stats['misses'], stats['files']), (1, 2, 2))
+            self.assertEqual(pdf_cache.counter_value(pdf_cache.SIZE_KEY), stats['size'])
+
+            # Eviction keeps the cache under the size limit
+            pdf_cache.evict(stats['size'] - 1)
+            self.assertEqual(pdf_cache.stats()['files'], 1)
+            pdf_cache.clear()
+            self.assertEqual(pdf_cache.stats()['files'], 0)
+
+            # Going over the limit queues a trim (which runs right away without worker threads)
+            views.generate_pdfs_standalone([self.e.pk])
+            with override_settings(PDF_CACHE_MAX_SIZE=pdf_cache.stats()['size']):
+                views.generate_pdfs_standalone([self.e2.pk])
+            stats = pdf_cache.stats()
+            self.assertLess(stats['files'], 2)
+            self.assertEqual(pdf_cache.counter_value(pdf_cache.SIZE_KEY), stats['size'])
+
     def test_pdf_multibill(self):
         response = self.client.get(reverse('events:multibillings:pdf', args=[self.multibilling.pk]))
         self.assertEqual(response.status_code, 200)
@@ -207,7 +269,7 @@ class PdfViewTest(TestCase):
         html_response = self.client.get(reverse('events:bill-pdf-multi', args=["%s,%s" % (self.e.pk, self.e2.pk)]),
                                         {'raw': True})
         self.assertEqual(html_response.status_code, 200)
-        self.assertTrue(b'QUOTE' in html_response.content)
+        self.assertTrue(b'QUOTE' in html_response.getvalue())
 
         # Test with no ids
         response = self.client.get(reverse('events:bill-pdf-multi'))
@@ -221,7 +283,7 @@ class PdfViewTest(TestCase):
         response = self.client.get(reverse('events:pdf-multi', args=["%s,%s,%s,%s,%s" % (self.e.pk, self.e2.pk, self.e3.pk, self.e4.pk, self.e5.pk)]))
         self.assertEqual(response.status_code, 200)
 
-        pdf = PdfReader(BytesIO(response.content))
+        pdf = PdfReader(BytesIO(response.getvalue()))
         text = ''.join(page.extract_text() for page in pdf.pages)
         self.assertTrue("First Test Event" in text)
         self.assertTrue("Other Test Event" in text)
@@ -229,6 +291,55 @@ class PdfViewTest(TestCase):
         self.assertTrue("Another 2019 Test Event" in text)
         self.assertTrue("New Discounts Test" in text)
 
+    def test_pdf_bundle(self):
+        ids = "%s,%s,%s" % (self.e.pk, self.e2.pk, self.e3.pk)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, PDF_BUNDLE_ASYNC_THRESHOLD=2):
+            # Large bundles are prepared in the background and the user gets a link to download them
+            response = self.client.get(reverse('events:pdf-multi', args=[ids]))
+            self.assertContains(response, "The PDF is being prepared")
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertEqual(mail.outbox[0].to, [self.user.email])
+            link = re.search(r'http://testserver(/db/events/pdf/bundle/[0-9a-f]{32}/)', mail.outbox[0].body).group(1)
+
+            response = self.client.get(link)
+            self.assertEqual(response.status_code, 200)
+            pdf = PdfReader(BytesIO(response.getvalue()))
+            text = ''.join(page.extract_text() for page in pdf.pages)
+            self.assertIn("First Test Event", text)
+            self.assertIn("First 2019 Test Event", text)
+            response.close()
+
+            # Nobody else can download it
+            other = UserFactory.create(password='123')
+            self.client.login(username=other.username, password='123')
+            self.assertEqual(self.client.get(link).status_code, 404)
+
+            # Bill bundles work the same way
+            response = self.client.get(reverse('events:bill-pdf-multi', args=[ids]))
+            self.assertContains(response, "The PDF is being prepared")
+            self.assertEqual(len(mail.outbox), 2)
+
+    def test_broken_render_pool(self):
+        class BrokenPool(object):
+            shut_down = False
+
+            def submit(self, *args, **kwargs):
+                raise BrokenProcessPool("A worker process died")
+
+            def shutdown(self, *args, **kwargs):
+                self.shut_down = True
+
+        pool = views._render_pool = BrokenPool()
+        documents = views.workorder_documents(BaseEvent.objects.filter(pk__in=[self.e.pk, self.e2.pk]))
+        with override_settings(PDF_RENDER_WORKERS=2):
+            # The documents are rendered here instead, and a new pool is started next time
+            pdfs = views.render_many(documents)
+        self.assertEqual(len(pdfs), 2)
+        self.assertTrue(all(pdf.startswith(b'%PDF') for pdf in pdfs))
+        self.assertTrue(pool.shut_down)
+        self.assertIsNone(views._render_pool)
+
     def test_quote_logging(self):
         response = self.client.get(reverse("events:bills:pdf", args=[self.e.pk]))
         self.assertEqual(response.status_code, 200)
@@ -1,63 +1,69 @@
 import datetime
-import os
+import logging
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
+from urllib.parse import urljoin
 
+from django.apps import apps
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.humanize.templatetags.humanize import intcomma
-from django.contrib.staticfiles import finders
 from django.core.exceptions import PermissionDenied
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db.models import Count
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 
 from xhtml2pdf import pisa
-from weasyprint import HTML, CSS
-try:
-    from weasyprint.text.fonts import FontConfiguration
-except ModuleNotFoundError:
-    from weasyprint.fonts import FontConfiguration
+from weasyprint import HTML
 from pypdf import PdfWriter
 
-from events.models import Category, BaseEvent, Event2019, ExtraInstance, MultiBilling, Quote
+from data.decorators import process_in_thread
+from emails.generators import GenericEmailGenerator
+from events.models import Category, BaseEvent, Event2019, EventCosts, ExtraInstance, MultiBilling, Quote
 from projection.models import PITLevel, Projectionist
+from . import cache as pdf_cache, rendering
+
+logger = logging.getLogger(__name__)
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
 
 
 def link_callback(uri, rel):
     """ Convert HTML URIs to absolute system paths so xhtml2pdf can access those resources """
-    # use short variable names
-    surl = settings.STATIC_URL  # Typically /static/
-    sroot = settings.STATIC_ROOT  # Typically /home/userX/project_static/
-    murl = settings.MEDIA_URL  # Typically /static/media/
-    mroot = settings.MEDIA_ROOT  # Typically /home/userX/project_static/media/
-
-    # convert URIs to absolute system paths
-    if murl and uri.startswith(murl):
-        path = os.path.join(mroot, uri.replace(murl, ""))
-    elif surl and uri.startswith(surl):
-        search_url = uri.replace(surl, "")
-        path = finders.find(search_url) or os.path.join(sroot, search_url)
-    else:
-        path = ""
-
-    # make sure that file exists
-    if not os.path.isfile(path):
-        raise Exception('media URI must start with %s or %s' % (surl, murl))
-    return path
+    return rendering.assets.path(uri)
 
 
 def url_fetcher(url):
     """ a callback for weasyprint to fetch static files """
-    if url.startswith("file://"):
-        path = link_callback(url[7:], "")
-        data = {}
-        data['file_obj'] = open(path, 'rb')
-        return data
-    else:
-        raise Exception('Non-local files are not implemented for safety reasons')
+    return rendering.url_fetcher(url)
+
+
+def pisa_to_pdf(html):
+    """ Render HTML to a PDF with xhtml2pdf """
+    pdf_file = BytesIO()
+    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
+    return pdf_file.getvalue()
+
+
+def html_to_pdf(html):
+    """
+    Render HTML to a PDF with xhtml2pdf, reusing the cached PDF if the same HTML has been rendered before
+
+    :returns: PDF file contents
+    """
+    return pdf_cache.render(html, 'xhtml2pdf', pisa_to_pdf)
 
 
 def generate_pdf(context, template, request):
@@ -67,12 +73,8 @@ def generate_pdf(context, template, request):
     if 'raw' in request.GET and bool(request.GET['raw']):
         return HttpResponse(html)
 
-    # Write PDF to file
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-
     # Return PDF document through a Django HTTP response
-    return HttpResponse(pdf_file.getvalue(), content_type='application/pdf')
+    return HttpResponse(html_to_pdf(html), content_type='application/pdf')
 
 
 def get_category_data(event):
@@ -111,9 +113,9 @@ def get_multibill_data(multibilling):
     data['orgs'] = orgs
     billing_org = multibilling.org
     data['billing_org'] = billing_org
-    events = multibilling.events.order_by('datetime_start')
+    events = multibilling.events.order_by('datetime_start').with_costs()
     data['events'] = events
-    data['total_cost'] = sum(map(lambda event: event.cost_total, multibilling.events.all()))
+    data['total_cost'] = sum(map(lambda event: event.cost_total, events))
     return data
 
 
@@ -126,7 +128,11 @@ def get_quote_data(event):
         'is_event2019': is_event2019,
         'expiry_date': timezone.now() + datetime.timedelta(days=7)
     }
+    if is_event2019:
+        # computed once and shared by the bill template, instead of once per total shown
+        EventCosts.attach([event])
     if is_event2019 and event.uses_new_discounts:
+        costs = event.costs
         for category in Category.objects.all():
             service_instances = event.serviceinstance_set.filter(service__category=category)
             extra_instances = event.extrainstance_set.filter(extra__category=category)
@@ -135,9 +141,9 @@ def get_quote_data(event):
                     'category': category,
                     'service_instances': service_instances,
                     'extra_instances': extra_instances,
-                    'discounts': event.get_discount_values(category=category),
-                    'fees': event.get_fee_values(category=category),
-                    'total': event.category_subtotal(category)
+                    'discounts': costs.get_discount_values(category=category),
+                    'fees': costs.get_fee_values(category=category),
+                    'total': costs.category_subtotal(category)
                 })
     else:
         for cat in Category.objects.all():
@@ -170,12 +176,8 @@ def generate_projection_pdf(request):
     html = render_to_string('pdf_templates/projection.html', context=data, request=request)
     if 'raw' in request.GET and bool(request.GET['raw']):
         return HttpResponse(html)
-    # write file
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-
     # return doc
-    return HttpResponse(pdf_file.getvalue(), content_type='application/pdf')
+    return HttpResponse(html_to_pdf(html), content_type='application/pdf')
 
 
 @login_required
@@ -206,54 +208,142 @@ def generate_event_bill_pdf(request, event):
         raise PermissionDenied
     if not event.approved and not request.user.has_perm('events.bill_event', event):
         raise PermissionDenied
+    quote = create_quote(event, request)
+
+    return view_quote(request, quote.pk)
+
+
+def create_quote(event, request=None):
+    """ Render an event's bill and save it as a quote """
     data = get_quote_data(event)
 
     if isinstance(event, Event2019) and event.uses_new_discounts:
         html = render_to_string('pdf_templates/bill-itemized-2025.html', context=data, request=request)
     else:
         html = render_to_string('pdf_templates/bill-itemized.html', context=data, request=request)
-    quote = Quote.objects.create(event=event, html=html, is_invoice=event.reviewed)
+    return Quote.objects.create(event=event, html=html, is_invoice=event.reviewed)
 
-    return view_quote(request, quote.pk)
 
-def render_quote_to_pdf(quote) -> BytesIO:
+def weasyprint_to_pdf(html):
+    """ Render HTML to a PDF with WeasyPrint, using the Helvetica Neue fonts from the static files """
+    context = rendering.get_context()
     pdf_file = BytesIO()
+    HTML(string=html, url_fetcher=url_fetcher, base_url="/").write_pdf(
+        pdf_file, stylesheets=context.stylesheets, font_config=context.font_config)
+    return pdf_file.getvalue()
+
+
+def render_quote_to_pdf(quote) -> BytesIO:
+    renderer = quote_renderer(quote)
+    return BytesIO(pdf_cache.render(quote.html, renderer, RENDERERS[renderer]))
 
+
+RENDERERS = {
+    'xhtml2pdf': pisa_to_pdf,
+    'weasyprint': weasyprint_to_pdf,
+}
+
+
+def quote_renderer(quote):
     if isinstance(quote.event, Event2019) and quote.event.uses_new_discounts:
-        font_config = FontConfiguration()
-        font_string = """
-        @font-face {
-            font-family: 'Helvetica-Neue';
-            src: url('file:///static/fonts/HelveticaNeue.ttf');
-        }
-
-        @font-face {
-            font-family: 'Helvetica-Neue';
-            src: url('file:///static/fonts/HelveticaNeueBold.ttf');
-            font-weight: bold;
-        }
-
-        @font-face {
-            font-family: 'Helvetica-Neue';
-            src: url('file:///static/fonts/HelveticaNeueItalic.ttf');
-            font-style: italic;
-        }
-
-        @font-face {
-            font-family: 'Helvetica-Neue';
-            src: url('file:///static/fonts/HelveticaNeueBoldItalic.ttf');
-            font-weight: bold;
-            font-style: italic;
-        }
-        """
-        HTML(string=quote.html, url_fetcher=url_fetcher, base_url="/").write_pdf(
-            pdf_file,
-            stylesheets=[CSS(string=font_string, font_config=font_config, url_fetcher=url_fetcher)],
-            font_config=font_config)
-    else:
-        pisa.CreatePDF(quote.html, dest=pdf_file, link_callback=link_callback)
+        return 'weasyprint'
+    return 'xhtml2pdf'
+
+
+def init_render_worker():
+    # Worker processes that were spawned rather than forked start without Django set up
+    if not apps.ready:
+        import django
+        django.setup()
+    rendering.get_context()
+
+
+def render_in_worker(html, renderer):
+    return RENDERERS[renderer](html)
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=settings.PDF_RENDER_WORKERS,
+                                               initializer=init_render_worker)
+    return _render_pool
+
+
+def discard_render_pool(pool):
+    """ Shut down a render pool that stopped working so that the next call to :func:`get_render_pool` starts a new one """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_many(documents):
+    """
+    Render several HTML documents to PDFs. Documents that aren't already cached are rendered in parallel, across up to
+    PDF_RENDER_WORKERS processes. If a worker process dies, whatever is left is rendered in this process instead.
+
+    :param documents: List of (html, renderer) tuples, where the renderer is one of the keys of RENDERERS
+    :returns: List of PDF file contents, in the same order as the documents
+    """
+    pdfs = [None] * len(documents)
+    keys = [None] * len(documents)
+    if pdf_cache.enabled():
+        for i, (html, renderer) in enumerate(documents):
+            keys[i], pdfs[i] = pdf_cache.lookup(html, renderer)
+    missing = [i for i, pdf in enumerate(pdfs) if pdf is None]
+
+    if settings.PDF_RENDER_WORKERS > 1 and len(missing) > 1:
+        pool = get_render_pool()
+        try:
+            futures = {i: pool.submit(render_in_worker, *documents[i]) for i in missing}
+            for i, future in futures.items():
+                pdfs[i] = future.result()
+        except BrokenProcessPool:
+            logger.exception("PDF render pool stopped working; rendering the remaining documents in this process")
+            discard_render_pool(pool)
+    for i in missing:
+        if pdfs[i] is None:
+            pdfs[i] = render_in_worker(*documents[i])
+
+    if pdf_cache.enabled():
+        for i in missing:
+            pdf_cache.save(keys[i], pdfs[i])
+    return pdfs
+
+
+def merge_pdfs(pdfs):
+    """
+    Combine PDFs into one document
+
+    :param pdfs: PDF file contents, in the order they should appear
+    :returns: File object (rewound) holding the combined PDF. It spills over to disk once it gets large.
+    """
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(BytesIO(pdf))
+    output_file = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+    writer.write(output_file)
+    output_file.seek(0)
+    return output_file
+
+
+def workorder_documents(events):
+    """ The workorder HTML for each event, as documents for :func:`render_many` """
+    return [(render_to_string('pdf_templates/events.html', context={'events_data': [get_category_data(event)]}),
+             'xhtml2pdf') for event in events]
+
+
+def bill_documents(events, request=None):
+    """ Saves a quote for each event and returns their HTML as documents for :func:`render_many` """
+    documents = []
+    for event in events:
+        quote = create_quote(event, request)
+        documents.append((quote.html, quote_renderer(quote)))
+    return documents
 
-    return pdf_file
 
 @login_required
 def view_quote(request, id):
@@ -282,13 +372,7 @@ def generate_event_bill_pdf_standalone(event, request=None, return_stream=False)
 
     :returns: PDF file
     """
-    data = get_quote_data(event)
-    # Render html content through html template with context
-    if isinstance(event, Event2019) and event.uses_new_discounts:
-        html = render_to_string('pdf_templates/bill-itemized-2025.html', context=data, request=request)
-    else:
-        html = render_to_string('pdf_templates/bill-itemized.html', context=data, request=request)
-    quote = Quote.objects.create(event=event, html=html, is_invoice=event.reviewed)
+    quote = create_quote(event, request)
 
     # Write PDF to file
     pdf_file = render_quote_to_pdf(quote)
@@ -327,10 +411,7 @@ def generate_multibill_pdf_standalone(multibilling, request=None):
     html = render_to_string('pdf_templates/bill-multi.html', context=data, request=request)
 
     # Write PDF to file
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
-
-    return pdf_file.getvalue()
+    return html_to_pdf(html)
 
 
 def generate_pdfs_standalone(ids=None):
@@ -344,19 +425,26 @@ def generate_pdfs_standalone(ids=None):
     # returns a standalone pdf, for sending via email
     timezone.activate(timezone.get_current_timezone())
 
-    data = {}
-    events = BaseEvent.objects.filter(pk__in=ids)
-    data['events_data'] = []
-    for event in events:
-        event_data = get_category_data(event)
-        data['events_data'].append(event_data)
+    events = BaseEvent.objects.filter(pk__in=ids).order_by("datetime_start")
+    pdfs = render_many(workorder_documents(events))
+    if len(pdfs) == 1:
+        return pdfs[0]
+    with merge_pdfs(pdfs) as output_file:
+        return output_file.read()
 
-    html = render_to_string('pdf_templates/events.html', context=data)
 
-    pdf_file = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
+def pdf_bundle_response(request, ids, kind):
+    """
+    Bundles of more than PDF_BUNDLE_ASYNC_THRESHOLD events are prepared by the task queue and emailed to the user when
+    they are ready, instead of being rendered while the request waits.
 
-    return pdf_file.getvalue()
+    :returns: HttpResponse if the bundle was queued, otherwise `None`
+    """
+    if len(ids) <= settings.PDF_BUNDLE_ASYNC_THRESHOLD:
+        return None
+    prepare_pdf_bundle(kind, ids, request.user.pk, request.build_absolute_uri('/'))
+    return HttpResponse("That's a lot of events! The PDF is being prepared and a link to it will be emailed to %s "
+                        "when it's ready." % request.user.email)
 
 
 def generate_event_pdf_multi(request, ids=None):
@@ -370,17 +458,24 @@ def generate_event_pdf_multi(request, ids=None):
         return HttpResponse("Should probably give some ids to return pdfs for.")
     # Prepare IDs
     idlist = ids.split(',')
-    # Prepare context
-    data = {}
-    events = BaseEvent.objects.filter(pk__in=idlist).order_by("datetime_start")
-    data['events_data'] = []
-    for event in events:
-        event_data = get_category_data(event)
-        data['events_data'].append(event_data)
 
-    resp = generate_pdf(data, 'pdf_templates/events.html', request)
-    resp['Content-Disposition'] = 'inline; filename="events.pdf"'
-    return resp
+    if 'raw' in request.GET and bool(request.GET['raw']):
+        # Prepare context
+        data = {}
+        events = BaseEvent.objects.filter(pk__in=idlist).order_by("datetime_start")
+        data['events_data'] = []
+        for event in events:
+            event_data = get_category_data(event)
+            data['events_data'].append(event_data)
+        return generate_pdf(data, 'pdf_templates/events.html', request)
+
+    queued = pdf_bundle_response(request, idlist, 'workorder')
+    if queued:
+        return queued
+
+    events = BaseEvent.objects.filter(pk__in=idlist).order_by("datetime_start")
+    pdfs = render_many(workorder_documents(events))
+    return FileResponse(merge_pdfs(pdfs), content_type='application/pdf', filename="events.pdf")
 
 
 @login_required
@@ -396,14 +491,58 @@ def generate_event_bill_pdf_multi(request, ids=None):
     if not events:
         raise Http404("Could not find any matching events.")
 
-    writer = PdfWriter()
-    for event in events:
-        pdf = generate_event_bill_pdf_standalone(event, request=request, return_stream=True)
-        writer.append(pdf)
-    
-    output_file = BytesIO()
-    writer.write(output_file)
+    queued = pdf_bundle_response(request, idlist, 'bill')
+    if queued:
+        return queued
 
-    resp = HttpResponse(output_file.getvalue(), content_type='application/pdf')
-    resp['Content-Disposition'] = 'inline; filename="multi-event-bill.pdf"'
-    return resp
+    pdfs = render_many(bill_documents(events, request))
+    return FileResponse(merge_pdfs(pdfs), content_type='application/pdf', filename="multi-event-bill.pdf")
+
+
+def pdf_bundle_path(user_id, token):
+    return 'pdf_bundles/%s/%s.pdf' % (user_id, token)
+
+
+@process_in_thread
+def prepare_pdf_bundle(kind, ids, user_id, base_url):
+    """
+    Render a combined workorder or bill PDF for a list of events, save it and email the user a link to it
+
+    :param kind: "workorder" or "bill"
+    :param ids: List of event ids
+    :param user_id: Primary key of the user who asked for the PDF
+    :param base_url: Scheme and host the user made the request on (i.e. https://lnl.wpi.edu/), used for the link
+    """
+    user = get_user_model().objects.get(pk=user_id)
+    timezone.activate(timezone.get_current_timezone())
+    events = BaseEvent.objects.filter(pk__in=ids).order_by("datetime_start")
+    if kind == 'bill':
+        documents = bill_documents(events)
+    else:
+        documents = workorder_documents(events)
+
+    # Bundles are only kept for a week
+    directory = 'pdf_bundles/%s' % user_id
+    if default_storage.exists(directory):
+        cutoff = timezone.now() - datetime.timedelta(days=7)
+        for name in default_storage.listdir(directory)[1]:
+            if default_storage.get_modified_time('%s/%s' % (directory, name)) < cutoff:
+                default_storage.delete('%s/%s' % (directory, name))
+
+    token = uuid.uuid4().hex
+    with merge_pdfs(render_many(documents)) as output_file:
+        default_storage.save(pdf_bundle_path(user_id, token), File(output_file))
+
+    link = urljoin(base_url, reverse("events:pdf-bundle", args=[token]))
+    body = "The PDF of %d event %s you asked for is ready. You can download it from the link below for the next " \
+           "week.\n\n%s" % (len(documents), "bills" if kind == 'bill' else "workorders", link)
+    GenericEmailGenerator(subject="Your PDF is ready", to_emails=user.email, body=body).send()
+
+
+@login_required
+def download_pdf_bundle(request, token):
+    """ Download a PDF prepared by :func:`prepare_pdf_bundle` (only available to the user who asked for it) """
+    path = pdf_bundle_path(request.user.pk, token)
+    if not default_storage.exists(path):
+        raise Http404("This PDF has expired or does not exist.")
+    return FileResponse(default_storage.open(path, 'rb'), content_type='application/pdf', filename="events.pdf")
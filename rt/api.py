@@ -1,8 +1,14 @@
 import requests
 import filetype
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.cache import cache
 from base64 import b64encode
+from requests.adapters import HTTPAdapter
 from urllib.parse import quote
+from urllib3.util.retry import Retry
 
 
 # API Methods
@@ -10,6 +16,60 @@ host = 'https://lnl-rt.wpi.edu/rt/REST/2.0/'
 
 # Documentation for most of the endpoints used here can be found at: https://github.com/bestpractical/rt-extension-rest2
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Shared HTTP session for talking to RT. Connections are pooled and kept alive between requests, and idempotent
+    requests are retried with backoff when RT is unreachable or overloaded.
+
+    :return: requests.Session
+    """
+
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(total=settings.RT_MAX_RETRIES, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                              allowed_methods=('GET', 'PUT'), raise_on_status=False)
+                adapter = HTTPAdapter(pool_maxsize=settings.RT_MAX_WORKERS, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+# Ticket lookups and searches are cached for RT_CACHE_TTL seconds. Searches are keyed by a version number that is
+# bumped whenever we write to RT, since any change to a ticket can change which tickets a query matches.
+SEARCH_VERSION_KEY = 'rt:search:version'
+
+
+def ticket_cache_key(ticket_id):
+    return 'rt:ticket:%s' % ticket_id
+
+
+def search_cache_key(query):
+    version = cache.get_or_set(SEARCH_VERSION_KEY, 1, None)
+    return 'rt:search:%s:%s' % (version, hashlib.md5(query.encode('utf-8')).hexdigest())
+
+
+def invalidate_ticket(ticket_id=None):
+    """
+    Drop cached RT data after writing to RT
+
+    :param ticket_id: The ticket that was changed (if applicable). Cached searches are always dropped.
+    """
+
+    if ticket_id is not None:
+        cache.delete(ticket_cache_key(ticket_id))
+    try:
+        cache.incr(SEARCH_VERSION_KEY)
+    except ValueError:
+        pass
+
 
 def api_request(method, endpoint, data=None, token=None):
     """
@@ -25,25 +85,18 @@ def api_request(method, endpoint, data=None, token=None):
     if not token:
         token = settings.RT_TOKEN
     headers = {"Content-Type": "application/json", "Authorization": "token " + token}
-    if method.lower() == 'get':
-        response = requests.get(endpoint, headers=headers)
-        if response.status_code != 500:
-            return response.json()
-        return {"message": "An unknown error occurred"}
-    elif method.lower() == 'post':
-        if data:
-            response = requests.post(endpoint, json=data, headers=headers)
-            if response.status_code != 500:
-                return response.json()
-            return {"message": "An unknown error occurred"}
-        return {"message": "Bad request"}
-    elif method.lower() == 'put':
-        if data:
-            response = requests.put(endpoint, json=data, headers=headers)
-            if response.status_code != 500:
-                return response.json()
-            return {"message": "An unknown error occurred"}
+    if method.lower() in ('post', 'put') and not data:
         return {"message": "Bad request"}
+    if method.lower() not in ('get', 'post', 'put'):
+        return None
+    try:
+        response = get_session().request(method.upper(), endpoint, json=data, headers=headers,
+                                         timeout=settings.RT_TIMEOUT)
+    except requests.RequestException:
+        return {"message": "Unable to reach RT"}
+    if response.status_code != 500:
+        return response.json()
+    return {"message": "An unknown error occurred"}
 
 
 def permission_error(response):
@@ -100,7 +153,9 @@ def create_ticket(queue, reporter, subject, content, html=False, cc=None, attach
             file_contents = b64encode(attachment.read()).decode('utf-8')
             files.append({"FileName": attachment.name, "FileType": mime_type, "FileContent": file_contents})
         payload["Attachments"] = files
-    return api_request('POST', endpoint, payload)
+    response = api_request('POST', endpoint, payload)
+    invalidate_ticket()
+    return response
 
 
 def fetch_ticket(ticket_id):
@@ -111,8 +166,29 @@ def fetch_ticket(ticket_id):
     :return: Dictionary of ticket information
     """
 
-    endpoint = host + 'ticket/' + str(ticket_id)
-    return api_request('GET', endpoint)
+    key = ticket_cache_key(ticket_id)
+    ticket = cache.get(key)
+    if ticket is None:
+        endpoint = host + 'ticket/' + str(ticket_id)
+        ticket = api_request('GET', endpoint)
+        if settings.RT_CACHE_TTL and not ticket.get('message'):
+            cache.set(key, ticket, settings.RT_CACHE_TTL)
+    return ticket
+
+
+def fetch_tickets(ticket_ids):
+    """
+    Retrieve several tickets from RT at once. The requests are made concurrently over the shared session.
+
+    :param ticket_ids: List of ticket ID #s
+    :return: List of dictionaries of ticket information, in the same order as `ticket_ids`
+    """
+
+    ticket_ids = list(ticket_ids)
+    if len(ticket_ids) <= 1:
+        return [fetch_ticket(ticket_id) for ticket_id in ticket_ids]
+    with ThreadPoolExecutor(max_workers=min(settings.RT_MAX_WORKERS, len(ticket_ids))) as executor:
+        return list(executor.map(fetch_ticket, ticket_ids))
 
 
 def update_ticket(ticket_id, token, status=None, owner=None):
@@ -134,7 +210,9 @@ def update_ticket(ticket_id, token, status=None, owner=None):
         "Owner": owner,
         "Status": status
     }
-    return api_request('PUT', endpoint, payload, token=token)
+    response = api_request('PUT', endpoint, payload, token=token)
+    invalidate_ticket(ticket_id)
+    return response
 
 
 def ticket_comment(ticket_id, comments, notify=False, token=None):
@@ -155,7 +233,9 @@ def ticket_comment(ticket_id, comments, notify=False, token=None):
         "Content": comments,
         "ContentType": "text/plain"
     }
-    return api_request('POST', endpoint, payload, token=token)
+    response = api_request('POST', endpoint, payload, token=token)
+    invalidate_ticket(ticket_id)
+    return response
 
 
 def ticket_history(ticket_id, simple=True, token=None):
@@ -174,7 +254,10 @@ def ticket_history(ticket_id, simple=True, token=None):
     headers = {"Content-Type": "application/json", "Authorization": "token " + token}
     if simple:
         endpoint = host.replace('2.0', '1.0') + 'ticket/' + str(ticket_id) + '/history'
-        response = requests.get(endpoint, headers=headers)
+        try:
+            response = get_session().get(endpoint, headers=headers, timeout=settings.RT_TIMEOUT)
+        except requests.RequestException:
+            return {"message": "Unable to reach RT"}
 
         # Parse the response
         try:
@@ -192,7 +275,10 @@ def ticket_history(ticket_id, simple=True, token=None):
             return {"message": "%s Unable to retrieve ticket history." % response.content.decode('utf-8')}
     else:
         endpoint = host.replace('2.0', '1.0') + 'ticket/' + str(ticket_id) + '/history?format=l'
-        response = requests.get(endpoint, headers=headers)
+        try:
+            response = get_session().get(endpoint, headers=headers, timeout=settings.RT_TIMEOUT)
+        except requests.RequestException:
+            return {"message": "Unable to reach RT"}
 
         # Parse the response
         try:
@@ -255,6 +341,10 @@ def search_tickets(query):
     :return: A list of ticket ids
     """
 
+    key = search_cache_key(query)
+    ids = cache.get(key)
+    if ids is not None:
+        return ids
     ids = []
 
     results = api_request('GET', host + "tickets?query=" + quote(query))
@@ -268,7 +358,10 @@ def search_tickets(query):
             results = api_request('GET', results['next_page'])
         else:
             done = True
-    return sorted(ids)
+    ids = sorted(ids)
+    if settings.RT_CACHE_TTL:
+        cache.set(key, ids, settings.RT_CACHE_TTL)
+    return ids
 
 
 def get_user(username, token):
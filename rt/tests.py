@@ -3,10 +3,12 @@ import requests
 from data.tests.util import ViewTestCase
 from django.shortcuts import reverse
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from cryptography.fernet import Fernet
 
 from accounts.models import UserPreferences
+from . import api
 
 
 class RTAPITests(ViewTestCase):
@@ -61,3 +63,25 @@ class RTAPITests(ViewTestCase):
             prefs = UserPreferences.objects.get(user=self.user)
             cipher_suite = Fernet(settings.CRYPTO_KEY)
             self.assertEqual(data["token"], cipher_suite.decrypt(prefs.rt_token.encode('utf-8')).decode('utf-8'))
+
+    def test_session(self):
+        # All requests should share a single pooled session
+        self.assertIs(api.get_session(), api.get_session())
+
+        # Writes without a payload are rejected before anything is sent to RT
+        self.assertEqual(api.api_request('POST', api.host + 'ticket'), {"message": "Bad request"})
+        self.assertEqual(api.fetch_tickets([]), [])
+
+    def test_cache(self):
+        # Cached tickets and searches are returned without contacting RT
+        cache.set(api.ticket_cache_key(1), {"id": 1, "Subject": "Cached"})
+        self.assertEqual(api.fetch_ticket(1), {"id": 1, "Subject": "Cached"})
+        query = "Queue = 'Database'"
+        search_key = api.search_cache_key(query)
+        cache.set(search_key, [1, 2])
+        self.assertEqual(api.search_tickets(query), [1, 2])
+
+        # Writing to a ticket drops it and every cached search
+        api.invalidate_ticket(1)
+        self.assertIsNone(cache.get(api.ticket_cache_key(1)))
+        self.assertNotEqual(api.search_cache_key(query), search_key)
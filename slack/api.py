@@ -1,9 +1,11 @@
+import hashlib
 import json
 import logging
+import threading
 from cryptography.fernet import Fernet
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import reverse
-from django.db import connection
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseServerError, JsonResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
@@ -19,10 +21,56 @@ from . import views, models
 
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Shared Slack client for the process. It is rebuilt only if the configured token changes.
+
+    :return: WebClient
+    """
+
+    global _client
+    with _client_lock:
+        if _client is None or _client.token != settings.SLACK_TOKEN:
+            _client = WebClient(token=settings.SLACK_TOKEN)
+        return _client
+
+
+# Channel details, user profiles and email lookups rarely change, so they are kept in the Django cache for
+# SLACK_CACHE_TTL seconds to save API calls (and stay under Slack's rate limits)
+def channel_cache_key(channel_id):
+    return 'slack:channel:%s' % channel_id
+
+
+def user_cache_key(user_id):
+    return 'slack:user:%s' % user_id
+
+
+def email_cache_key(email):
+    return 'slack:email:%s' % hashlib.md5(email.lower().encode('utf-8')).hexdigest()
+
+
+def cache_user(user):
+    """
+    Store a user's profile (and the mapping from their email address to their id) in the cache
+
+    :param user: Slack user object (Dictionary)
+    """
+
+    if not settings.SLACK_CACHE_TTL:
+        return
+    cache.set(user_cache_key(user['id']), {'ok': True, 'user': user}, settings.SLACK_CACHE_TTL)
+    email = user.get('profile', {}).get('email')
+    if email:
+        cache.set(email_cache_key(email), user['id'], settings.SLACK_CACHE_TTL)
+
 
 # API Methods
 def delete_file(id):
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     response = client.files_delete(file=id)
     return response['ok']
@@ -39,7 +87,7 @@ def load_channels(archived=False):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.conversations_list(exclude_archived=not archived)
@@ -66,11 +114,17 @@ def channel_info(channel_id):
     if not settings.SLACK_TOKEN:
         return None
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    channel = cache.get(channel_cache_key(channel_id))
+    if channel is not None:
+        return channel
+
+    client = get_client()
 
     try:
         response = client.conversations_info(channel=channel_id)
         assert response['ok'] is True
+        if settings.SLACK_CACHE_TTL:
+            cache.set(channel_cache_key(channel_id), response['channel'], settings.SLACK_CACHE_TTL)
         return response['channel']
     except SlackApiError as e:
         assert e.response['ok'] is False
@@ -87,7 +141,7 @@ def join_channel(channel):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.conversations_join(channel=channel)
@@ -113,8 +167,8 @@ def upload(attachment, filename, title=None, message=None, channels=None):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
-    client.timeout = 600
+    # Uploads get their own client with a longer timeout, leaving the shared one as it is for other requests
+    client = WebClient(token=settings.SLACK_TOKEN, timeout=600)
 
     try:
         if channels:
@@ -149,7 +203,7 @@ def slack_post(channel, thread=None, text=None, content=None, username=None, ico
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     if attachment:
         filename = attachment['filepath'].split('/')[-1]
@@ -197,7 +251,7 @@ def post_ephemeral(channel, text, user, username=None):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.chat_postEphemeral(channel=channel, text=text, user=user, username=username)
@@ -221,7 +275,7 @@ def message_react(channel, message, reaction):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.reactions_add(channel=channel, timestamp=message, name=reaction)
@@ -245,7 +299,7 @@ def message_unreact(channel, message, reaction):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.reactions_remove(channel=channel, timestamp=message, name=reaction)
@@ -268,7 +322,7 @@ def retrieve_message(channel, message_id):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.conversations_history(channel=channel, latest=message_id, inclusive=True, limit=1)
@@ -296,7 +350,7 @@ def replace_message(channel, message_id, text=None, content=None):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     if content or text:
         try:
@@ -323,7 +377,7 @@ def message_link(channel, message_id):
     if not settings.SLACK_TOKEN:
         return None
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.chat_getPermalink(channel=channel, message_ts=message_id)
@@ -346,7 +400,7 @@ def user_add(channel, users):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.conversations_invite(channel=channel, users=users)
@@ -369,7 +423,7 @@ def user_kick(channel, user):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.conversations_kick(channel=channel, user=user)
@@ -391,15 +445,20 @@ def user_profile(user_id):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    profile = cache.get(user_cache_key(user_id))
+    if profile is not None:
+        return profile
+
+    client = get_client()
 
     try:
         response = client.users_info(user=user_id)
         assert response['ok'] is True
-        return response
+        cache_user(response['user'])
+        return response.data
     except SlackApiError as e:
         assert e.response['ok'] is False
-        return e.response
+        return e.response.data
 
 
 def lookup_user(email):
@@ -413,11 +472,16 @@ def lookup_user(email):
     if not settings.SLACK_TOKEN:
         return None
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    user_id = cache.get(email_cache_key(email))
+    if user_id is not None:
+        return user_id
+
+    client = get_client()
 
     try:
         response = client.users_lookupByEmail(email=email)
         assert response['ok'] is True
+        cache_user(response['user'])
         return response['user']['id']
     except SlackApiError as e:
         assert e.response['ok'] is False
@@ -435,7 +499,7 @@ def check_presence(user):
     if not settings.SLACK_TOKEN:
         return None
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.users_getPresence(user=user)
@@ -461,7 +525,7 @@ def open_modal(trigger_id, blocks):
     if not settings.SLACK_TOKEN:
         return None
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.views_open(trigger_id=trigger_id, view=blocks)
@@ -486,17 +550,19 @@ def handle_event(request):
     elif payload['type'] == "event_callback":
         event = payload['event']
         if event['type'] == "team_join":
+            cache_user(event['user'])
             slack_post(event['user']['id'], text="Welcome to LNL!", content=views.welcome_message())
         elif event['type'] == "app_home_opened":
             load_app_home(event['user'])
         elif event['type'] == "channel_created":
+            cache.delete(channel_cache_key(event['channel']['id']))
             if settings.SLACK_AUTO_JOIN:
                 join_channel(event['channel']['id'])
         return HttpResponse()
     return HttpResponse("Not implemented")
 
 
-@process_in_thread
+@process_in_thread(retry=True)
 def load_app_home(user_id):
     """
     Load the App's Home tab.
@@ -511,8 +577,7 @@ def load_app_home(user_id):
     if user['ok']:
         email = user['user']['profile']['email']
         ticket_ids = sorted(rt_api.simple_ticket_search(requestor=email, status="__Active__"), reverse=True)
-    for ticket_id in ticket_ids:
-        ticket = rt_api.fetch_ticket(ticket_id)
+    for ticket in rt_api.fetch_tickets(ticket_ids):
         if ticket.get('message'):
             continue
         tickets.append(ticket)
@@ -521,7 +586,7 @@ def load_app_home(user_id):
     if not settings.SLACK_TOKEN:
         return {'ok': False, 'error': 'config_error'}
 
-    client = WebClient(token=settings.SLACK_TOKEN)
+    client = get_client()
 
     try:
         response = client.views_publish(user_id=user_id, view={"type": "home", "blocks": blocks})
@@ -807,7 +872,7 @@ def refresh_ticket_message(channel, message):
     return replace_message(channel, message['ts'], ticket_description, new_message)
 
 
-@process_in_thread
+@process_in_thread(retry=True)
 def __refresh_ticket_async(channel, message):
     """
     Update a TFed ticket message with the latest information in the background
@@ -873,4 +938,3 @@ def __save_report(message_id, reporter, comments):
 
         post_ephemeral(message.posted_to, "This feature currently does not support reporting private messages. Please "
                                           "contact a member of the executive board directly.", reporter)
-    connection.close()
@@ -3,7 +3,8 @@ import zoneinfo
 import logging
 import requests
 from urllib.parse import urlencode
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from data.tests.util import ViewTestCase
 from django.contrib.auth.models import Permission
 from django.utils import timezone
@@ -12,7 +13,7 @@ from django.shortcuts import reverse
 
 from events.tests.generators import CCInstanceFactory, Event2019Factory, LocationFactory, CategoryFactory, ServiceFactory
 from events.models import ServiceInstance
-from . import views, models
+from . import api, views, models
 from .templatetags import slack
 
 
@@ -214,6 +215,27 @@ class SlackAPITests(ViewTestCase):
         self.assertOk(self.client.post(reverse("slack:event-endpoint"), event_info, content_type="application/json"))
 
 
+    @override_settings(SLACK_TOKEN="xoxb-test", SLACK_AUTO_JOIN=False)
+    def test_metadata_cache(self):
+        # Users that join the workspace are cached straight from the event, so they can be looked up without the API
+        event_info = {
+            "type": "event_callback",
+            "event": {
+                "type": "channel_created",
+                "channel": {"id": "C1234567890", "name": "new-channel"}
+            }
+        }
+        api.cache_user({"id": "UABCD1234", "profile": {"email": "lnl@wpi.edu"}})
+        self.assertEqual(api.lookup_user("LNL@wpi.edu"), "UABCD1234")
+        self.assertEqual(api.user_profile("UABCD1234")['user']['id'], "UABCD1234")
+
+        # Creating a channel drops anything we knew about it
+        cache.set(api.channel_cache_key("C1234567890"), {"id": "C1234567890", "name": "stale"})
+        self.assertEqual(api.channel_info("C1234567890")['name'], "stale")
+        self.assertOk(self.client.post(reverse("slack:event-endpoint"), event_info, content_type="application/json"))
+        self.assertIsNone(cache.get(api.channel_cache_key("C1234567890")))
+        self.assertIs(api.get_client(), api.get_client())
+
 class SlackTemplateTags(TestCase):
     def test_slack_channel_tag(self):
         test_with_channel = "You should totally go join #webdev on Slack!"